@@ -0,0 +1,109 @@
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "tiktok_ai_analysis", "analysis_cache.sqlite")
+DEFAULT_MAX_ENTRIES = 50000
+
+
+def blob_identity(blob):
+    """Identify the content of a GCS object from its listing metadata, or None if there is nothing to go on."""
+    if blob.get("md5_hash"):
+        return f"md5:{blob['md5_hash']}"
+    if blob.get("crc32c"):
+        # Composite objects have no md5, so fall back to crc32c pinned to this object generation
+        return f"crc32c:{blob['crc32c']}:{blob['name']}:{blob.get('generation')}"
+    if blob.get("generation"):
+        return f"generation:{blob['name']}:{blob['generation']}"
+    return None
+
+
+def prompt_hash(instruction, prompts, schema):
+    digest = hashlib.sha256()
+    for part in [instruction] + list(prompts):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    digest.update(json.dumps(schema, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def make_cache_key(blob, prompt_digest, model_name, temperature, top_p, seed):
+    identity = blob_identity(blob)
+    if identity is None:
+        return None
+    key_fields = [identity, prompt_digest, model_name, repr(temperature), repr(top_p), repr(seed)]
+    return hashlib.sha256("|".join(key_fields).encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+    """Persistent, size-bounded store of processed analyses keyed by `make_cache_key`.
+
+    Entries are evicted least-recently-used once `max_entries` is exceeded. The cache is safe to
+    share between the worker threads of `video_processor.generate`.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS analysis_cache ("
+            "key TEXT PRIMARY KEY, analysis TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON analysis_cache (last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT analysis FROM analysis_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE analysis_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, analysis):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache (key, analysis, last_access) VALUES (?, ?, ?)",
+                (key, json.dumps(analysis), time.time())
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM analysis_cache WHERE key IN "
+                "(SELECT key FROM analysis_cache ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+            self.evictions += overflow
+
+    def stats(self):
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import logging
+from datetime import datetime
+from video_processor import (
+    MODEL_NAME, SEED, MAX_OUTPUT_TOKENS, ANALYSIS_INSTRUCTION, PROMPTS,
+    response_schema, process_analysis, extract_video_id, consistency_stats
+)
+from gcs_utils import upload_file, iter_gcs_text_lines, DERIVATIVE_MARKER
+
+BATCH_POLL_INTERVAL = 60  # Seconds between batch job status checks
+
+
+def _api_schema(schema):
+    # The REST API expects the OpenAPI type names in upper case
+    converted = {}
+    for key, value in schema.items():
+        if key == "type":
+            converted[key] = value.upper()
+        elif isinstance(value, dict):
+            converted[key] = _api_schema(value)
+        else:
+            converted[key] = value
+    return converted
+
+
+def build_batch_request(video_uri, temperature, top_p, candidate_count=1):
+    parts = [{"fileData": {"fileUri": video_uri, "mimeType": "video/mp4"}}, {"text": ANALYSIS_INSTRUCTION}]
+    parts += [{"text": prompt} for prompt in PROMPTS]
+    return {
+        "request": {
+            "contents": [{"role": "user", "parts": parts}],
+            "generationConfig": {
+                "candidateCount": candidate_count,
+                "maxOutputTokens": MAX_OUTPUT_TOKENS,
+                "temperature": temperature,
+                "topP": top_p,
+                "seed": SEED,
+                "responseMimeType": "application/json",
+                "responseSchema": _api_schema(response_schema),
+            },
+        }
+    }
+
+
+def write_batch_requests(video_files, bucket_name, output_path, temperature=0.01, top_p=0.99, video_uris=None,
+                         candidate_count=1):
+    """Write one batch prediction request per video to a local JSONL file and return the number written.
+
+    `video_uris` (video file -> gs:// URI) sends a preprocessed derivative in place of the original.
+    `candidate_count` above one samples every video that many times, as in `video_processor.generate`.
+    """
+    video_uris = video_uris or {}
+    count = 0
+    with open(output_path, "w", encoding="utf-8") as f:
+        for video_file in video_files:
+            video_uri = video_uris.get(video_file, f"gs://{bucket_name}/{video_file}")
+            f.write(json.dumps(build_batch_request(video_uri, temperature, top_p, candidate_count)) + "\n")
+            count += 1
+    logging.info(f"Wrote {count} batch requests to {output_path}")
+    return count
+
+
+def parse_batch_output_line(line):
+    """Turn one line of batch prediction output into a processed analysis, or None if it can't be used.
+
+    With several candidates the first one that parses is the analysis, with consistency statistics over all of them.
+    """
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError as e:
+        logging.error(f"Malformed batch output line: {e}")
+        return None
+
+    try:
+        video_uri = record["request"]["contents"][0]["parts"][0]["fileData"]["fileUri"]
+    except (KeyError, IndexError) as e:
+        logging.error(f"Batch output line without a video URI: {e}")
+        return None
+
+    if record.get("status"):
+        logging.error(f"Batch prediction failed for {video_uri}: {record['status']}")
+        return None
+
+    # A derivative is named after its original, e.g. 123.preprocessed.480p-1fps-60s.<md5>.mp4
+    video_id = extract_video_id(os.path.basename(video_uri).split(DERIVATIVE_MARKER)[0])
+    if video_id is None:
+        logging.error(f"Skipping video {video_uri} due to invalid ID format")
+        return None
+
+    try:
+        texts = [candidate["content"]["parts"][0]["text"] for candidate in record["response"]["candidates"]]
+    except (KeyError, IndexError) as e:
+        logging.error(f"Batch output for {video_uri} has no response text: {e}")
+        return None
+
+    samples = []
+    for text in texts:
+        try:
+            samples.append(process_analysis(json.loads(text)))
+        except json.JSONDecodeError as e:
+            logging.error(f"JSON decode error for {video_uri}: {e}")
+    if not samples:
+        return None
+
+    analysis = samples[0]
+    if len(texts) > 1:
+        analysis['consistency'] = consistency_stats(samples)
+    analysis['video_id'] = video_id
+    return analysis
+
+
+def parse_batch_output(lines):
+    """Lazily parse batch prediction output lines, yielding processed analyses."""
+    for line in lines:
+        if line.strip():
+            analysis = parse_batch_output_line(line)
+            if analysis is not None:
+                yield analysis
+
+
+def parse_batch_output_files(paths):
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            yield from parse_batch_output(f)
+
+
+def submit_batch_job(input_uri, output_uri_prefix):
+    from vertexai.batch_prediction import BatchPredictionJob
+
+    job = BatchPredictionJob.submit(
+        source_model=MODEL_NAME,
+        input_dataset=input_uri,
+        output_uri_prefix=output_uri_prefix,
+    )
+    logging.info(f"Submitted batch prediction job {job.resource_name}")
+    return job
+
+
+def wait_for_batch_job(job, poll_interval=BATCH_POLL_INTERVAL):
+    while not job.has_ended:
+        time.sleep(poll_interval)
+        job.refresh()
+        logging.info(f"Batch prediction job {job.resource_name} state: {job.state.name}")
+
+    if not job.has_succeeded:
+        raise RuntimeError(f"Batch prediction job {job.resource_name} failed: {job.error}")
+    return job.output_location
+
+
+def run_batch_prediction(video_files, bucket_name, staging_prefix, temperature=0.01, top_p=0.99,
+                         local_dir=".", video_uris=None, candidate_count=1):
+    """Analyze videos through a Vertex AI batch prediction job and return the processed analyses."""
+    run_prefix = f"{staging_prefix}{datetime.now().strftime('%Y%m%d_%H%M%S')}/"
+    local_path = os.path.join(local_dir, "batch_requests.jsonl")
+
+    write_batch_requests(video_files, bucket_name, local_path, temperature, top_p, video_uris, candidate_count)
+    input_uri = upload_file(bucket_name, local_path, f"{run_prefix}requests.jsonl")
+
+    job = submit_batch_job(input_uri, f"gs://{bucket_name}/{run_prefix}output/")
+    output_location = wait_for_batch_job(job)
+
+    results = list(parse_batch_output(iter_gcs_text_lines(output_location, suffix=".jsonl")))
+    logging.info(f"Parsed {len(results)} analyses from {output_location} ({len(video_files)} requested)")
+    return results
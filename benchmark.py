@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import importlib
+import tracemalloc
+import gcs_utils
+from gcs_utils import list_gcs_folders, list_gcs_blobs
+from planner import fetch_analyzed_video_ids, plan_video_files
+from video_processor import generate
+from star_schema import create_and_populate_tables
+from metrics import RunMetrics
+from video_processor import extract_video_id
+from simulated_backends import (LatencyModel, FakeGenerativeModel, FakeStorageClient, FakeBigQueryClient,
+                                synthetic_metadata_rows)
+
+SCENARIOS = (100, 1000, 10000)
+BASELINE_PATH = "benchmark_baseline.json"
+REGRESSION_TOLERANCE = 0.2  # Relative change that counts as a regression
+
+BUCKET_NAME = "benchmark-bucket"
+BASE_PREFIX = "TIKTOK_samples/"
+PROJECT_ID = "benchmark-project"
+DATASET_ID = "tiktok_data"
+METADATA_TABLE_NAME = "tiktok_videos_metadata"
+# Modules the pipeline imports on first use; loaded before measuring so no scenario times the SDK imports
+LAZY_IMPORTS = ("vertexai.generative_models", "tqdm", "google.cloud.bigquery")
+
+
+def local_warehouse_client(storage_client, seed):
+    """An in-memory DuckDB warehouse whose metadata table covers every video in the fake bucket."""
+    from local_warehouse import LocalWarehouseClient
+
+    client = LocalWarehouseClient(":memory:", PROJECT_ID)
+    video_ids = [extract_video_id(os.path.basename(name)) for names in storage_client.names.values() for name in names]
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "metadata.ndjson")
+        with open(path, "w", encoding="utf-8") as f:
+            for row in synthetic_metadata_rows(video_ids, seed):
+                f.write(json.dumps(row) + "\n")
+        client.load_file(f"{PROJECT_ID}.{DATASET_ID}.{METADATA_TABLE_NAME}", path)
+    return client
+
+
+def run_scenario(num_videos, args):
+    """Run listing, planning, analysis and the warehouse load for `num_videos` synthetic videos.
+
+    With `args.local_warehouse` the star schema transforms really run, in an embedded DuckDB warehouse.
+    """
+    for module in LAZY_IMPORTS:
+        importlib.import_module(module)
+    storage_client = FakeStorageClient({"2024-01-01": num_videos}, BASE_PREFIX,
+                                       page_latency=LatencyModel(args.listing_latency, seed=args.seed))
+    if args.local_warehouse:
+        bq_client = local_warehouse_client(storage_client, args.seed)
+    else:
+        bq_client = FakeBigQueryClient(insert_latency=LatencyModel(args.insert_latency, seed=args.seed),
+                                       query_latency=LatencyModel(args.query_latency, seed=args.seed),
+                                       row_error_rate=args.row_error_rate, seed=args.seed)
+    model = FakeGenerativeModel(latency=LatencyModel(args.model_latency, args.model_latency_sigma, seed=args.seed),
+                                error_rate=args.error_rate,
+                                resource_exhausted_rate=args.resource_exhausted_rate,
+                                malformed_rate=args.malformed_rate, seed=args.seed)
+    gcs_utils.get_storage_client = lambda: storage_client
+    metrics = RunMetrics(run_id=f"benchmark-{num_videos}")
+
+    tracemalloc.start()
+    start_time = time.perf_counter()
+
+    with metrics.stage("listing"):
+        latest_folder = list_gcs_folders(BUCKET_NAME, BASE_PREFIX)[0]
+        video_files = [blob["name"] for blob in list_gcs_blobs(BUCKET_NAME, f"{BASE_PREFIX}{latest_folder}/")]
+    with metrics.stage("planning"):
+        analyzed_ids = fetch_analyzed_video_ids(bq_client, f"{PROJECT_ID}.{DATASET_ID}.ai_results")
+        video_files, _ = plan_video_files(video_files, analyzed_ids)
+
+    results = generate(video_files, BUCKET_NAME, max_workers=args.max_workers, model=model, metrics=metrics,
+                       hedge_percentile=args.hedge_percentile or None)
+    create_and_populate_tables(bq_client, PROJECT_ID, DATASET_ID, METADATA_TABLE_NAME, results, metrics=metrics)
+
+    elapsed = time.perf_counter() - start_time
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    summary = metrics.summary()
+    stages = summary["stages"]
+    video_stage = stages.get("video", {})
+    if args.local_warehouse:
+        ai_table_id = f"{PROJECT_ID}.{DATASET_ID}.ai_results"
+        rows_in_warehouse = next(bq_client.query(f"SELECT COUNT(*) AS n FROM `{ai_table_id}`").result()).n
+    else:
+        rows_in_warehouse = len(bq_client.rows)
+    return {
+        "videos": num_videos,
+        "analyzed": len(results),
+        "rows_in_warehouse": rows_in_warehouse,
+        "model_calls": model.calls,
+        "seconds": elapsed,
+        "throughput_videos_per_sec": num_videos / elapsed if elapsed > 0 else 0.0,
+        "p50_video_seconds": video_stage.get("p50_seconds", 0.0),
+        "p99_video_seconds": video_stage.get("p99_seconds", 0.0),
+        "peak_memory_mb": peak_memory / (1024 * 1024),
+        "star_schema_seconds": stages.get("star_schema", {}).get("total_seconds", 0.0),
+        "hedged_requests": summary["counters"].get("hedged_requests", 0),
+    }
+
+
+def find_regressions(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    regressions = []
+    for size, result in results.items():
+        previous = baseline.get(size)
+        if previous is None:
+            continue
+        checks = [
+            ("throughput_videos_per_sec", result["throughput_videos_per_sec"] < previous["throughput_videos_per_sec"] * (1 - tolerance)),
+            ("p99_video_seconds", result["p99_video_seconds"] > previous["p99_video_seconds"] * (1 + tolerance)),
+            ("peak_memory_mb", result["peak_memory_mb"] > previous["peak_memory_mb"] * (1 + tolerance)),
+        ]
+        for metric, regressed in checks:
+            if regressed:
+                regressions.append(f"{size} videos: {metric} {previous[metric]:.4f} -> {result[metric]:.4f}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline against simulated Vertex AI, GCS and BigQuery")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SCENARIOS))
+    parser.add_argument("--max-workers", type=int, default=32)
+    parser.add_argument("--model-latency", type=float, default=0.05, help="Median model latency in seconds")
+    parser.add_argument("--model-latency-sigma", type=float, default=0.5)
+    parser.add_argument("--listing-latency", type=float, default=0.005, help="Median latency per listing page")
+    parser.add_argument("--insert-latency", type=float, default=0.01, help="Median latency per insert request")
+    parser.add_argument("--query-latency", type=float, default=0.01, help="Median latency per query")
+    parser.add_argument("--hedge-percentile", type=float,
+                        help="Latency percentile after which model calls are hedged (off by default)")
+    parser.add_argument("--error-rate", type=float, default=0.005)
+    parser.add_argument("--resource-exhausted-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.005)
+    parser.add_argument("--row-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--local-warehouse", action="store_true",
+                        help="Run the star schema transforms in an embedded DuckDB warehouse instead of recording them")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = {}
+    for size in args.sizes:
+        results[str(size)] = run_scenario(size, args)
+        print(json.dumps(results[str(size)]))
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        sys.exit(0)
+
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        sys.exit(0)
+
+    regressions = find_regressions(results, baseline)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    sys.exit(1 if regressions else 0)
@@ -3,6 +3,7 @@ from google.cloud import bigquery
 from google.api_core.exceptions import NotFound
 from datetime import datetime
 import pytz
+from warehouse_writer import WarehouseWriter
 
 PROJECT_TIMEZONE = pytz.timezone('Asia/Jerusalem')
 
@@ -69,15 +70,13 @@ def insert_rows_to_bigquery(client, project_id, dataset_id, table_name, rows):
         create_ai_table(client, project_id, dataset_id, table_name)
 
     current_time = get_current_timestamp()
-    for row in rows:
-        row['created_at'] = current_time.isoformat()
-
     try:
-        errors = client.insert_rows_json(table_id, rows)
-        if errors:
-            logging.error(f"Errors inserting rows: {errors}")
+        report = WarehouseWriter(client, table_id).write(rows, extra_fields={'created_at': current_time.isoformat()})
+        if report["failed_rows"]:
+            logging.error(f"Errors inserting {report['rows_failed']} rows into {table_id}")
         else:
             logging.info(f"Inserted {len(rows)} rows into {table_id}")
+        return report
     except Exception as e:
         logging.error(f"Error inserting rows: {e}")
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,343 @@
+"""Command line entry point with one subcommand per pipeline stage.
+
+    python cli.py list --json > videos.jsonl
+    python cli.py analyze --input videos.jsonl --output results.jsonl
+    python cli.py load --input results.jsonl
+    python cli.py build-schema --input results.jsonl
+    python cli.py analytics --output report.json
+    python cli.py lookup --video-ids 7300000000000000001 --output scores.jsonl
+    python cli.py --local-warehouse warehouse.duckdb --local-metadata metadata.parquet build-schema --full-rebuild
+    python cli.py check-imports
+
+Each subcommand imports only the modules it needs inside its handler, so a `list` never loads the Vertex AI SDK
+and `build-schema` never loads the Cloud Storage client. `check-imports` enforces that, and the cold import
+budget of every subcommand, in fresh interpreters.
+"""
+import os
+import sys
+import json
+import logging
+import argparse
+import subprocess
+
+DEFAULT_PROJECT = "python-code-running"
+DEFAULT_LOCATION = "me-west1"
+DEFAULT_BUCKET = "main_il"
+DEFAULT_BASE_PREFIX = "TIKTOK_samples/"
+DEFAULT_DATASET = "tiktok_data"
+DEFAULT_METADATA_TABLE = "tiktok_videos_metadata"
+
+# Modules each subcommand imports, the modules it must never pull in, and its cold import budget in seconds
+SUBCOMMAND_IMPORTS = {
+    "list": (["gcs_utils"], ["vertexai", "google.cloud.bigquery"], 1.5),
+    "analyze": (["video_processor", "analysis_cache", "rate_limiter", "vertexai"], ["google.cloud.bigquery"], 6.0),
+    "load": (["star_schema", "results"], ["vertexai", "google.cloud.storage"], 3.0),
+    "build-schema": (["star_schema"], ["vertexai", "google.cloud.storage"], 3.0),
+    "analytics": (["fact_analytics"], ["vertexai", "google.cloud.storage", "google.cloud.bigquery"], 2.0),
+    "lookup": (["result_store"], ["vertexai", "google.cloud.storage", "google.cloud.bigquery"], 2.0),
+}
+
+
+def read_lines(path):
+    if path in (None, "-"):
+        return [line.strip() for line in sys.stdin if line.strip()]
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def read_video_blobs(path):
+    """Read video files as written by `list`: JSON blob metadata per line, or one plain object name per line."""
+    return [json.loads(line) if line.startswith("{") else {"name": line} for line in read_lines(path)]
+
+
+def read_results(path):
+    """Read analyses from a JSONL file written by `analyze`, or from a Parquet export."""
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        return pq.read_table(path).to_pylist()
+    return [json.loads(line) for line in read_lines(path)]
+
+
+def write_lines(path, lines):
+    output = sys.stdout if path in (None, "-") else open(path, "w", encoding="utf-8")
+    try:
+        for line in lines:
+            output.write(line + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+def warehouse_client(args):
+    """A BigQuery client, or with --local-warehouse the embedded DuckDB warehouse that stands in for one."""
+    if args.local_warehouse:
+        from local_warehouse import LocalWarehouseClient
+
+        client = LocalWarehouseClient(args.local_warehouse, args.project)
+        if args.local_metadata:
+            metadata_table = getattr(args, "metadata_table", DEFAULT_METADATA_TABLE)
+            client.load_file(f"{args.project}.{args.dataset}.{metadata_table}", args.local_metadata)
+        return client
+    from google.cloud import bigquery
+
+    return bigquery.Client(project=args.project)
+
+
+def cmd_list(args):
+    from gcs_utils import select_folders, iter_folders_blob_pages
+
+    folders = select_folders(args.bucket, args.base_prefix, args.folders, args.start_date, args.end_date)
+    if not folders:
+        logging.error("No folders found.")
+        return 1
+    blobs = (blob for page in iter_folders_blob_pages(args.bucket, args.base_prefix, folders) for blob in page)
+    write_lines(args.output, (json.dumps(blob) if args.json else blob["name"] for blob in blobs))
+    return 0
+
+
+def cmd_analyze(args):
+    import vertexai
+    from video_processor import generate
+    from analysis_cache import AnalysisCache
+    from rate_limiter import QuotaScheduler, default_state_path
+
+    blobs = read_video_blobs(args.input)
+    if not blobs:
+        logging.error("No video files to analyze.")
+        return 1
+
+    vertexai.init(project=args.project, location=args.location)
+    analysis_cache = AnalysisCache()
+    scheduler = QuotaScheduler(args.requests_per_minute, args.tokens_per_minute, state_path=default_state_path(),
+                               max_concurrency=args.max_workers)
+    results = generate([blob["name"] for blob in blobs], args.bucket,
+                       temperature=args.temperature,
+                       top_p=args.top_p,
+                       max_workers=args.max_workers,
+                       cache=analysis_cache,
+                       blob_metadata={blob["name"]: blob for blob in blobs if "md5_hash" in blob},
+                       scheduler=scheduler,
+                       candidate_count=args.samples,
+                       repair=not args.no_repair,
+                       request_timeout=args.request_timeout,
+                       hedge_percentile=args.hedge_percentile or None)
+    analysis_cache.close()
+    write_lines(args.output, (json.dumps(analysis) for analysis in results))
+    logging.info(f"Analyzed {len(results)} of {len(blobs)} videos")
+    return 0 if results else 1
+
+
+def cmd_load(args):
+    from planner import fetch_analyzed_video_ids
+    from star_schema import ensure_ai_results_table, insert_ai_results
+
+    client = warehouse_client(args)
+    ai_table_id = f"{args.project}.{args.dataset}.ai_results"
+    ensure_ai_results_table(client, ai_table_id)
+
+    # Loading the same file twice must not duplicate rows
+    analyzed_ids = fetch_analyzed_video_ids(client, ai_table_id)
+    all_results = read_results(args.input)
+    results = [row for row in all_results if row['video_id'] not in analyzed_ids]
+    if not results:
+        logging.info("Every result in the input is already loaded.")
+        return 0
+    if args.input.endswith(".parquet") and len(results) == len(all_results):
+        # A Parquet export with only new videos is appended as it is by one load job, not row by row
+        from results import load_parquet
+
+        load_parquet(client, ai_table_id, args.input)
+        return 0
+    written = insert_ai_results(client, ai_table_id, results)
+    logging.info(f"Loaded {len(written)} of {len(results)} new results into {ai_table_id}")
+    return 0 if len(written) == len(results) else 1
+
+
+def cmd_build_schema(args):
+    from metrics import RunMetrics
+    from query_guard import QueryGuard
+    from star_schema import update_star_schema
+
+    if args.full_rebuild:
+        video_ids = []
+    elif args.input:
+        video_ids = sorted({row['video_id'] for row in read_results(args.input)})
+    elif args.video_ids:
+        video_ids = sorted(set(args.video_ids))
+    else:
+        logging.error("Pass --input, --video-ids or --full-rebuild.")
+        return 1
+
+    client = warehouse_client(args)
+    metrics = RunMetrics()
+    budget = int(args.query_budget_gib * 1024 ** 3) if args.query_budget_gib is not None else None
+    update_star_schema(client, args.project, args.dataset, args.metadata_table, video_ids, args.full_rebuild,
+                       QueryGuard(budget, args.dry_run_queries, metrics))
+    write_lines(args.output, [json.dumps(metrics.summary()["queries"], indent=2)])
+    return 0
+
+
+def cmd_analytics(args):
+    from fact_analytics import load_fact_data, export_is_fresh, engagement_report
+
+    client = None
+    if args.refresh or not export_is_fresh(args.export_path, args.max_age_hours):
+        # The warehouse client is only loaded when the local export has to be refreshed
+        client = warehouse_client(args)
+    data = load_fact_data(client, f"{args.project}.{args.dataset}", args.export_path, args.max_age_hours,
+                          args.refresh)
+    report = engagement_report(data, n_resamples=args.resamples)
+    write_lines(args.output, [json.dumps(report, indent=2)])
+    return 0
+
+
+def cmd_lookup(args):
+    from result_store import ResultStore
+
+    store = ResultStore(args.store)
+    if args.all:
+        video_ids = None
+    elif args.input:
+        video_ids = [int(line) for line in read_lines(args.input)]
+    elif args.video_ids:
+        video_ids = args.video_ids
+    else:
+        logging.error("Pass --video-ids, --input or --all.")
+        return 1
+
+    columns = store.to_columns(video_ids)
+    if args.output and args.output.endswith(".parquet"):
+        return 0 if columns.write_parquet(args.output) else 1
+    write_lines(args.output, (json.dumps(row) for row in columns))
+    if video_ids is not None and len(columns) < len(set(video_ids)):
+        logging.warning(f"{len(set(video_ids)) - len(columns)} of the requested videos are not in the store")
+    return 0
+
+
+def measure_imports(modules):
+    """Cold-import `modules` in a fresh interpreter; return the seconds taken and every module that got loaded."""
+    code = (
+        "import json, sys, time, importlib\n"
+        "start = time.perf_counter()\n"
+        f"for name in {modules!r}:\n"
+        "    importlib.import_module(name)\n"
+        "print(json.dumps({'seconds': time.perf_counter() - start, 'modules': sorted(sys.modules)}))\n"
+    )
+    completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr else "import failed")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def cmd_check_imports(args):
+    failures = 0
+    for command, (modules, forbidden, budget) in SUBCOMMAND_IMPORTS.items():
+        budget = args.budget if args.budget is not None else budget
+        try:
+            measured = measure_imports(modules)
+        except RuntimeError as e:
+            print(f"{command}: FAILED to import {', '.join(modules)}: {e}")
+            failures += 1
+            continue
+        leaked = [name for name in forbidden if name in measured["modules"]]
+        ok = not leaked and measured["seconds"] <= budget
+        failures += not ok
+        print(f"{command}: {measured['seconds']:.2f}s (budget {budget:.2f}s)"
+              + (f", loads {', '.join(leaked)}" if leaked else "") + ("" if ok else "  FAILED"))
+    return 1 if failures else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="TikTok AI analytics pipeline, one stage at a time")
+    parser.add_argument("--project", default=DEFAULT_PROJECT)
+    parser.add_argument("--dataset", default=DEFAULT_DATASET)
+    parser.add_argument("--bucket", default=DEFAULT_BUCKET)
+    parser.add_argument("--base-prefix", default=DEFAULT_BASE_PREFIX)
+    parser.add_argument("--local-warehouse", metavar="DB_PATH",
+                        help="Use an embedded DuckDB database at this path instead of BigQuery")
+    parser.add_argument("--local-metadata", metavar="FILE",
+                        help="Parquet or NDJSON file loaded as the metadata table of the local warehouse")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="List the video files of the selected date folders")
+    list_parser.add_argument("--folders", nargs="+", metavar="FOLDER")
+    list_parser.add_argument("--start-date", help="YYYY-MM-DD")
+    list_parser.add_argument("--end-date", help="YYYY-MM-DD")
+    list_parser.add_argument("--json", action="store_true",
+                             help="Write blob metadata as JSON lines, which lets analyze use the analysis cache")
+    list_parser.add_argument("--output", help="Output file (default: stdout)")
+    list_parser.set_defaults(handler=cmd_list)
+
+    analyze_parser = subparsers.add_parser("analyze", help="Analyze listed videos and write the results as JSONL")
+    analyze_parser.add_argument("--input", help="Output of list (default: stdin)")
+    analyze_parser.add_argument("--output", help="Results file (default: stdout)")
+    analyze_parser.add_argument("--location", default=DEFAULT_LOCATION)
+    analyze_parser.add_argument("--temperature", type=float, default=0.5)
+    analyze_parser.add_argument("--top-p", type=float, default=0.95)
+    analyze_parser.add_argument("--max-workers", type=int, default=8)
+    analyze_parser.add_argument("--requests-per-minute", type=int, default=60)
+    analyze_parser.add_argument("--tokens-per-minute", type=int, default=4000000)
+    analyze_parser.add_argument("--samples", type=int, default=1,
+                                help="Candidates per request; above 1 adds per-field consistency statistics")
+    analyze_parser.add_argument("--no-repair", action="store_true",
+                                help="Don't re-ask fields that came back missing or unparseable")
+    analyze_parser.add_argument("--request-timeout", type=float, default=600,
+                                help="Seconds after which a model call is abandoned")
+    analyze_parser.add_argument("--hedge-percentile", type=float,
+                                help="Send a duplicate of calls slower than this percentile of recent calls "
+                                     "(e.g. 0.95); duplicates are billed, so hedging is off by default")
+    analyze_parser.set_defaults(handler=cmd_analyze)
+
+    load_parser = subparsers.add_parser("load", help="Append analyze results (JSONL or Parquet) to ai_results")
+    load_parser.add_argument("--input", required=True)
+    load_parser.set_defaults(handler=cmd_load)
+
+    schema_parser = subparsers.add_parser("build-schema", help="Merge or rebuild the star schema tables")
+    schema_parser.add_argument("--metadata-table", default=DEFAULT_METADATA_TABLE)
+    schema_parser.add_argument("--input", help="Results file whose videos are merged")
+    schema_parser.add_argument("--video-ids", nargs="+", type=int, metavar="VIDEO_ID")
+    schema_parser.add_argument("--full-rebuild", action="store_true")
+    schema_parser.add_argument("--dry-run-queries", action="store_true",
+                               help="Dry-run every statement first and log its estimated bytes")
+    schema_parser.add_argument("--query-budget-gib", type=float,
+                               help="Abort before any statement that would take the total over this many GiB "
+                                    "processed")
+    schema_parser.add_argument("--output", help="Job statistics file (default: stdout)")
+    schema_parser.set_defaults(handler=cmd_build_schema)
+
+    analytics_parser = subparsers.add_parser("analytics",
+                                             help="Engagement-vs-surprise statistics over a local export of "
+                                                  "fact_video_analytics")
+    analytics_parser.add_argument("--export-path", default=os.path.join(os.path.expanduser("~"), ".cache",
+                                                                        "tiktok_ai_analysis",
+                                                                        "fact_video_analytics.npz"))
+    analytics_parser.add_argument("--max-age-hours", type=float, default=24,
+                                  help="Export the fact table again when the local copy is older than this")
+    analytics_parser.add_argument("--refresh", action="store_true", help="Export the fact table again now")
+    analytics_parser.add_argument("--resamples", type=int, default=2000, help="Bootstrap resamples")
+    analytics_parser.add_argument("--output", help="Report file (default: stdout)")
+    analytics_parser.set_defaults(handler=cmd_analytics)
+
+    lookup_parser = subparsers.add_parser("lookup", help="Read analyses from the local result store by video_id")
+    lookup_parser.add_argument("--store", default=os.path.join(os.path.expanduser("~"), ".cache",
+                                                               "tiktok_ai_analysis", "result_store"))
+    lookup_parser.add_argument("--video-ids", nargs="+", type=int, metavar="VIDEO_ID")
+    lookup_parser.add_argument("--input", help="File with one video_id per line")
+    lookup_parser.add_argument("--all", action="store_true", help="Every stored video (its latest analysis)")
+    lookup_parser.add_argument("--output", help="JSONL or .parquet file (default: JSONL to stdout)")
+    lookup_parser.set_defaults(handler=cmd_lookup)
+
+    check_parser = subparsers.add_parser("check-imports",
+                                         help="Check each subcommand's cold import time and that it avoids "
+                                              "unneeded SDKs")
+    check_parser.add_argument("--budget", type=float, help="Override every subcommand's budget (seconds)")
+    check_parser.set_defaults(handler=cmd_check_imports)
+    return parser
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = build_parser().parse_args()
+    sys.exit(args.handler(args))
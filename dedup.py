@@ -0,0 +1,227 @@
+import os
+import json
+import logging
+import sqlite3
+import tempfile
+import threading
+import time
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from gcs_utils import get_storage_client
+from video_processor import extract_video_id
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.expanduser("~"), ".cache", "tiktok_ai_analysis", "frame_hashes.sqlite")
+FRAMES_PER_VIDEO = 8
+MIN_FRAMES = 4  # Videos with fewer decodable frames are not fingerprinted
+HASH_BANDS = 4  # Each 64-bit frame hash is indexed as four 16-bit bands
+MAX_MEAN_DISTANCE = 6  # Mean Hamming distance per frame (out of 64 bits) still counted as the same video
+
+
+def dhash(gray_frame, cv2):
+    """64-bit difference hash of a grayscale frame: one bit per horizontally adjacent pixel pair of a 9x8 thumbnail."""
+    thumbnail = cv2.resize(gray_frame, (9, 8), interpolation=cv2.INTER_AREA)
+    value = 0
+    for row in thumbnail:
+        for left, right in zip(row[:-1], row[1:]):
+            value = (value << 1) | int(left > right)
+    return value
+
+
+def sample_frame_hashes(path, frames=FRAMES_PER_VIDEO):
+    """dHash `frames` frames spread over a local video file, skipping the first and last 5% (intros, end cards)."""
+    import cv2
+
+    capture = cv2.VideoCapture(path)
+    try:
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        if frame_count < frames:
+            return []
+        start, end = int(frame_count * 0.05), int(frame_count * 0.95)
+        hashes = []
+        for i in range(frames):
+            capture.set(cv2.CAP_PROP_POS_FRAMES, start + (end - start) * i // frames)
+            ok, frame = capture.read()
+            if ok:
+                hashes.append(dhash(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), cv2))
+        return hashes
+    finally:
+        capture.release()
+
+
+def fingerprint_video(bucket_name, video_file, frames=FRAMES_PER_VIDEO):
+    bucket = get_storage_client().bucket(bucket_name)
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(video_file)[1]) as local_file:
+        bucket.blob(video_file).download_to_filename(local_file.name)
+        return sample_frame_hashes(local_file.name, frames)
+
+
+def fingerprint_videos(bucket_name, video_files, max_workers=8):
+    """Fingerprint videos concurrently. Returns video file -> frame hashes, or {} when OpenCV is not installed."""
+    if importlib.util.find_spec("cv2") is None:
+        logging.warning("OpenCV (cv2) is not installed; near-duplicate detection is skipped")
+        return {}
+
+    def fingerprint(video_file):
+        try:
+            return fingerprint_video(bucket_name, video_file)
+        except Exception as e:
+            logging.warning(f"Could not fingerprint {video_file}: {e}")
+            return []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        hashes = list(executor.map(fingerprint, video_files))
+    return {video_file: frame_hashes for video_file, frame_hashes in zip(video_files, hashes)
+            if len(frame_hashes) >= MIN_FRAMES}
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def fingerprint_distance(hashes_a, hashes_b):
+    """Mean Hamming distance of aligned frame hashes."""
+    pairs = list(zip(hashes_a, hashes_b))
+    if len(pairs) < MIN_FRAMES:
+        return 64.0
+    return sum(hamming(a, b) for a, b in pairs) / len(pairs)
+
+
+def _bands(frame_hash):
+    band_bits = 64 // HASH_BANDS
+    mask = (1 << band_bits) - 1
+    return [(band, (frame_hash >> (band * band_bits)) & mask) for band in range(HASH_BANDS)]
+
+
+class HashBandIndex:
+    """In-memory multi-index over frame hashes.
+
+    Two frames within a few bits of each other almost always agree exactly on at least one 16-bit band, so
+    candidates are found with dictionary lookups and only they are compared bit by bit.
+    """
+
+    def __init__(self):
+        self.fingerprints = {}
+        self._bands = {}
+
+    def add(self, video_id, hashes):
+        self.fingerprints[video_id] = hashes
+        for position, frame_hash in enumerate(hashes):
+            for band in _bands(frame_hash):
+                self._bands.setdefault((position,) + band, set()).add(video_id)
+
+    def find(self, hashes, max_distance=MAX_MEAN_DISTANCE):
+        """Return (video_id, distance) of the closest indexed fingerprint within `max_distance`, or None."""
+        candidates = set()
+        for position, frame_hash in enumerate(hashes):
+            for band in _bands(frame_hash):
+                candidates |= self._bands.get((position,) + band, set())
+
+        best = None
+        for video_id in candidates:
+            distance = fingerprint_distance(hashes, self.fingerprints[video_id])
+            if distance <= max_distance and (best is None or distance < best[1]):
+                best = (video_id, distance)
+        return best
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+
+class FrameHashIndex:
+    """Persistent fingerprints of analyzed videos with their analyses, plus the duplicate links found so far.
+
+    The fingerprints are loaded into a `HashBandIndex` when the index is opened.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                video_id INTEGER PRIMARY KEY, hashes TEXT NOT NULL, analysis TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS duplicate_links (
+                video_id INTEGER PRIMARY KEY, original_video_id INTEGER NOT NULL, distance REAL NOT NULL,
+                linked_at REAL NOT NULL
+            );
+        """)
+        self.index = HashBandIndex()
+        for video_id, hashes in self._conn.execute("SELECT video_id, hashes FROM fingerprints"):
+            self.index.add(video_id, json.loads(hashes))
+
+    def add(self, video_id, hashes, analysis):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO fingerprints (video_id, hashes, analysis) VALUES (?, ?, ?)",
+                               (video_id, json.dumps(hashes), json.dumps(analysis)))
+            self._conn.commit()
+            self.index.add(video_id, hashes)
+
+    def analysis(self, video_id):
+        with self._lock:
+            row = self._conn.execute("SELECT analysis FROM fingerprints WHERE video_id = ?", (video_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def link(self, video_id, original_video_id, distance):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO duplicate_links (video_id, original_video_id, distance, linked_at) "
+                "VALUES (?, ?, ?, ?)",
+                (video_id, original_video_id, distance, time.time())
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def find_duplicates(index, fingerprints):
+    """Map each video file that duplicates an indexed video, or an earlier file of the batch, to its original.
+
+    Returns video file -> (original video_id, distance). Matches against the index win over matches within the
+    batch, since their analysis already exists.
+    """
+    batch_index = HashBandIndex()
+    duplicates = {}
+    for video_file, hashes in fingerprints.items():
+        match = index.index.find(hashes) or batch_index.find(hashes)
+        if match is not None:
+            duplicates[video_file] = match
+        else:
+            batch_index.add(extract_video_id(os.path.basename(video_file)), hashes)
+    logging.info(f"Near-duplicate detection: {len(duplicates)} of {len(fingerprints)} fingerprinted videos "
+                 f"match an earlier video ({len(index.index)} fingerprints indexed)")
+    return duplicates
+
+
+def orphaned_duplicates(index, duplicates, analyses):
+    """Video files among `duplicates` whose original has no analysis, for instance because it failed in this run.
+
+    They are analyzed themselves. `analyses` maps video_id -> analysis for the videos analyzed in this run;
+    duplicates that already have one of their own are left out.
+    """
+    return [video_file for video_file, (original_id, _) in duplicates.items()
+            if original_id not in analyses and index.analysis(original_id) is None
+            and extract_video_id(os.path.basename(video_file)) not in analyses]
+
+
+def reuse_duplicate_analyses(index, duplicates, analyses):
+    """Copy each original's analysis to its duplicates and record the links.
+
+    `analyses` maps video_id -> analysis for the videos analyzed in this run. Duplicates with an analysis of
+    their own are skipped. Returns the copied analyses.
+    """
+    reused = []
+    for video_file, (original_id, distance) in duplicates.items():
+        video_id = extract_video_id(os.path.basename(video_file))
+        if video_id in analyses:
+            continue
+        original = analyses.get(original_id) or index.analysis(original_id)
+        if original is None:
+            logging.warning(f"No analysis available for {original_id}, the original of {video_file}")
+            continue
+        index.link(video_id, original_id, distance)
+        reused.append(dict(original, video_id=video_id))
+    return reused
@@ -0,0 +1,232 @@
+import os
+import time
+import logging
+import numpy as np
+from video_processor import INTEGER_FIELDS
+
+DEFAULT_EXPORT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "tiktok_ai_analysis", "fact_video_analytics.npz")
+DEFAULT_MAX_AGE_HOURS = 24
+ENGAGEMENT_COLUMNS = ["video_plays", "video_likes", "video_shares", "video_comments", "video_bookmarks"]
+FACT_COLUMNS = ["video_id", "lang_id", "duration", "user_followers"] + ENGAGEMENT_COLUMNS + INTEGER_FIELDS
+BOOTSTRAP_BLOCK_CELLS = 10_000_000  # Resampled values held in memory at once while bootstrapping
+
+
+def export_fact_table(client, dataset, path=DEFAULT_EXPORT_PATH):
+    """Export the numeric columns of fact_video_analytics, with the author's follower count, to a local .npz file.
+
+    Every column is stored as a float64 array with NaN for nulls. The file is replaced atomically.
+    """
+    query = f"""
+    SELECT f.video_id, f.lang_id, f.duration, u.user_followers,
+        {', '.join(f'f.{column}' for column in ENGAGEMENT_COLUMNS + INTEGER_FIELDS)}
+    FROM `{dataset}.fact_video_analytics` f
+    LEFT JOIN (
+        SELECT user_id, MAX(user_followers) AS user_followers FROM `{dataset}.dim_user` GROUP BY user_id
+    ) u USING (user_id)
+    """
+    rows = client.query(query).result(page_size=100000)
+    values = [[row[column] for column in FACT_COLUMNS] for row in rows]
+    table = np.array(values, dtype=np.float64).reshape(len(values), len(FACT_COLUMNS))  # None becomes NaN
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.tmp.npz"
+    np.savez_compressed(temp_path, exported_at=np.array(time.time()),
+                        **{column: table[:, index] for index, column in enumerate(FACT_COLUMNS)})
+    os.replace(temp_path, path)
+    logging.info(f"Exported {len(values)} rows of {dataset}.fact_video_analytics to {path}")
+    return path
+
+
+def load_fact_data(client=None, dataset=None, path=DEFAULT_EXPORT_PATH, max_age_hours=DEFAULT_MAX_AGE_HOURS,
+                   refresh=False):
+    """Return the exported fact columns (name -> array), exporting again when the file is missing, stale or
+    `refresh` is set. Without a client the local file is used whatever its age."""
+    if refresh or not export_is_fresh(path, max_age_hours):
+        if client is not None:
+            export_fact_table(client, dataset, path)
+        elif not os.path.exists(path):
+            raise FileNotFoundError(f"No exported fact data at {path}; pass a BigQuery client to export it")
+        else:
+            logging.warning(f"Using fact data exported more than {max_age_hours} hours ago from {path}")
+
+    with np.load(path) as exported:
+        return {column: exported[column] for column in FACT_COLUMNS}
+
+
+def export_is_fresh(path, max_age_hours):
+    if not os.path.exists(path):
+        return False
+    with np.load(path) as exported:
+        return time.time() - float(exported["exported_at"]) <= max_age_hours * 3600
+
+
+def _rate(numerator, denominator):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+def engagement_kpis(data):
+    """Per-play engagement rates and per-follower reach, NaN where the denominator is zero or missing."""
+    plays, followers = data["video_plays"], data["user_followers"]
+    kpis = {
+        "like_rate": _rate(data["video_likes"], plays),
+        "share_rate": _rate(data["video_shares"], plays),
+        "comment_rate": _rate(data["video_comments"], plays),
+        "bookmark_rate": _rate(data["video_bookmarks"], plays),
+        "engagement_rate": _rate(data["video_likes"] + data["video_shares"] + data["video_comments"]
+                                 + data["video_bookmarks"], plays),
+        "plays_per_follower": _rate(plays, followers),
+        "likes_per_follower": _rate(data["video_likes"], followers),
+    }
+    return kpis
+
+
+def correlation_matrix(x_columns, y_columns=None, method="pearson"):
+    """Correlations between two sets of columns (name -> array), using every row where both values are present.
+
+    Returns (x_names, y_names, matrix). `method` is "pearson" or "spearman" (Pearson on ranks).
+    """
+    y_columns = y_columns if y_columns is not None else x_columns
+    x = np.column_stack([x_columns[name] for name in x_columns]).astype(np.float64)
+    y = np.column_stack([y_columns[name] for name in y_columns]).astype(np.float64)
+    if method == "spearman":
+        x, y = _ranks(x), _ranks(y)
+
+    # Pairwise-complete sums as matrix products: missing values contribute zero, masks count the shared rows
+    x_mask, y_mask = ~np.isnan(x), ~np.isnan(y)
+    x0, y0 = np.where(x_mask, x, 0.0), np.where(y_mask, y, 0.0)
+    xm, ym = x_mask.astype(np.float64), y_mask.astype(np.float64)
+    n = xm.T @ ym
+    sum_x, sum_y = x0.T @ ym, xm.T @ y0
+    sum_xx, sum_yy = (x0 ** 2).T @ ym, xm.T @ (y0 ** 2)
+    sum_xy = x0.T @ y0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = n * sum_xy - sum_x * sum_y
+        scale = np.sqrt((n * sum_xx - sum_x ** 2) * (n * sum_yy - sum_y ** 2))
+        matrix = np.where((n > 2) & (scale > 0), covariance / scale, np.nan)
+    return list(x_columns), list(y_columns), matrix
+
+
+def _ranks(matrix):
+    """Average ranks per column, keeping NaN in place."""
+    ranks = np.full(matrix.shape, np.nan)
+    for index in range(matrix.shape[1]):
+        column = matrix[:, index]
+        valid = ~np.isnan(column)
+        values = column[valid]
+        order = np.argsort(values, kind="mergesort")
+        sorted_values = values[order]
+        # Ties share the mean of the ranks they span
+        unique, first, counts = np.unique(sorted_values, return_index=True, return_counts=True)
+        average = first + (counts - 1) / 2.0 + 1
+        column_ranks = np.empty(len(values))
+        column_ranks[order] = np.repeat(average, counts)
+        ranks[valid, index] = column_ranks
+    return ranks
+
+
+def bootstrap_ci(values, statistic=np.mean, n_resamples=2000, confidence=0.95, seed=0):
+    """Percentile bootstrap confidence interval of `statistic` over the non-NaN values.
+
+    `statistic` must accept an `axis` argument; resamples are drawn in blocks to bound memory.
+    Returns (estimate, low, high).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if len(values) < 2:
+        return (float(statistic(values)) if len(values) else np.nan), np.nan, np.nan
+
+    rng = np.random.default_rng(seed)
+    block = max(1, BOOTSTRAP_BLOCK_CELLS // len(values))
+    estimates = []
+    for start in range(0, n_resamples, block):
+        size = min(block, n_resamples - start)
+        estimates.append(statistic(values[rng.integers(0, len(values), (size, len(values)))], axis=1))
+    estimates = np.concatenate(estimates)
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(estimates, [alpha, 1 - alpha])
+    return float(statistic(values)), float(low), float(high)
+
+
+def bootstrap_correlation_ci(x, y, n_resamples=2000, confidence=0.95, seed=0):
+    """Percentile bootstrap interval of the Pearson correlation of two columns over rows where both are present."""
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[valid], y[valid]
+    if len(x) < 3:
+        return np.nan, np.nan, np.nan
+
+    def pearson(a, b, axis=None):
+        a = a - a.mean(axis=axis, keepdims=True)
+        b = b - b.mean(axis=axis, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (a * b).sum(axis=axis) / np.sqrt((a ** 2).sum(axis=axis) * (b ** 2).sum(axis=axis))
+
+    rng = np.random.default_rng(seed)
+    block = max(1, BOOTSTRAP_BLOCK_CELLS // len(x))
+    estimates = []
+    for start in range(0, n_resamples, block):
+        indices = rng.integers(0, len(x), (min(block, n_resamples - start), len(x)))
+        estimates.append(pearson(x[indices], y[indices], axis=1))
+    estimates = np.concatenate(estimates)
+    alpha = (1 - confidence) / 2
+    low, high = np.nanquantile(estimates, [alpha, 1 - alpha])
+    return float(pearson(x, y)), float(low), float(high)
+
+
+def grouped_summary(keys, value_columns):
+    """Count, mean and standard deviation of each value column per distinct key, ignoring NaN values and keys.
+
+    Returns {key: {column: {"count", "mean", "std"}}}, with keys in ascending order.
+    """
+    keys = np.asarray(keys, dtype=np.float64)
+    has_key = ~np.isnan(keys)
+    groups, group_index = np.unique(keys[has_key], return_inverse=True)
+    summary = {(int(group) if group.is_integer() else float(group)): {} for group in groups}
+
+    for name, values in value_columns.items():
+        values = np.asarray(values, dtype=np.float64)[has_key]
+        valid = ~np.isnan(values)
+        clean = np.where(valid, values, 0.0)
+        counts = np.bincount(group_index, weights=valid, minlength=len(groups))
+        sums = np.bincount(group_index, weights=clean, minlength=len(groups))
+        squares = np.bincount(group_index, weights=clean ** 2, minlength=len(groups))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means = sums / counts
+            variances = np.maximum(squares / counts - means ** 2, 0.0) * counts / (counts - 1)
+        for key, count, mean, variance in zip(summary, counts, means, variances):
+            summary[key][name] = {"count": int(count), "mean": float(mean) if count else None,
+                                  "std": float(np.sqrt(variance)) if count > 1 else None}
+    return summary
+
+
+def engagement_report(data, n_resamples=2000, seed=0):
+    """The standard engagement-vs-surprise report: correlations, KPI intervals and summaries per language and
+    unexpectedness rating."""
+    kpis = engagement_kpis(data)
+    ratings = {field: data[field] for field in INTEGER_FIELDS}
+    report = {"rows": int(len(data["video_id"]))}
+
+    for method in ("pearson", "spearman"):
+        x_names, y_names, matrix = correlation_matrix(ratings, kpis, method)
+        report[f"{method}_correlations"] = {
+            x_name: {y_name: _json_float(matrix[i, j]) for j, y_name in enumerate(y_names)}
+            for i, x_name in enumerate(x_names)
+        }
+
+    report["unexpectedness_vs_engagement_rate_ci"] = dict(zip(
+        ("estimate", "low", "high"),
+        map(_json_float, bootstrap_correlation_ci(data["ai_unexpectedness_rating"], kpis["engagement_rate"],
+                                                  n_resamples, seed=seed))))
+    report["kpi_mean_ci"] = {
+        name: dict(zip(("estimate", "low", "high"), map(_json_float, bootstrap_ci(values, np.mean, n_resamples,
+                                                                               seed=seed))))
+        for name, values in kpis.items()
+    }
+    report["by_lang_id"] = grouped_summary(data["lang_id"], kpis)
+    report["by_unexpectedness_rating"] = grouped_summary(data["ai_unexpectedness_rating"], kpis)
+    return report
+
+
+def _json_float(value):
+    return None if value is None or np.isnan(value) else float(value)
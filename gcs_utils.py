@@ -1,25 +1,128 @@
 from google.cloud import storage
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import queue
+import threading
+
+VIDEO_MATCH_GLOB = "**.[mM][pP]4"  # Evaluated by GCS so non-video objects never leave the server
+BLOB_LIST_FIELDS = "items(name,size,md5Hash,crc32c,generation),prefixes,nextPageToken"
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_LISTING_WORKERS = 4
+DERIVATIVE_MARKER = ".preprocessed."  # In the names of transcoded copies written next to the originals
+
+_LISTING_DONE = object()
+
+
+@lru_cache(maxsize=None)
+def get_storage_client():
+    """Return the process-wide storage client so every call shares one authenticated connection pool."""
+    return storage.Client()
+
+
+def blob_metadata(blob):
+    return {
+        "name": blob.name,
+        "size": blob.size,
+        "md5_hash": blob.md5_hash,
+        "crc32c": blob.crc32c,
+        "generation": blob.generation,
+    }
+
+
+def is_video_blob(name):
+    return name.lower().endswith('.mp4') and DERIVATIVE_MARKER not in name
 
 
 def list_gcs_folders(bucket_name, prefix):
-    storage_client = storage.Client()
-    bucket = storage_client.get_bucket(bucket_name)
-    blobs = bucket.list_blobs(prefix=prefix, delimiter='/')
+    bucket = get_storage_client().bucket(bucket_name)
+    blobs = bucket.list_blobs(prefix=prefix, delimiter='/', fields="prefixes,nextPageToken")
     prefixes = set()
     for page in blobs.pages:
         prefixes.update(page.prefixes)
     return sorted([prefix.split('/')[-2] for prefix in prefixes if prefix.count('/') > 1], reverse=True)
 
 
+def list_date_folders(bucket_name, base_prefix, start_date=None, end_date=None):
+    """List the date folders under `base_prefix` within [start_date, end_date], newest first.
+
+    Folder names are compared as strings, which orders ISO dates (YYYY-MM-DD) chronologically.
+    """
+    folders = list_gcs_folders(bucket_name, base_prefix)
+    return [
+        folder for folder in folders
+        if (start_date is None or folder >= str(start_date)) and (end_date is None or folder <= str(end_date))
+    ]
+
+
+def select_folders(bucket_name, base_prefix, folders=None, start_date=None, end_date=None):
+    """Resolve which date folders to process: explicit folders, a date range, or just the latest folder."""
+    if folders:
+        return folders
+    if start_date or end_date:
+        return list_date_folders(bucket_name, base_prefix, start_date, end_date)
+    return list_gcs_folders(bucket_name, base_prefix)[:1]
+
+
+def iter_gcs_blob_pages(bucket_name, prefix, page_size=DEFAULT_PAGE_SIZE, match_glob=VIDEO_MATCH_GLOB):
+    """Lazily yield the video blobs under a prefix one listing page at a time."""
+    bucket = get_storage_client().bucket(bucket_name)
+    blobs = bucket.list_blobs(prefix=prefix, page_size=page_size, match_glob=match_glob, fields=BLOB_LIST_FIELDS)
+    for page in blobs.pages:
+        yield [blob_metadata(blob) for blob in page if is_video_blob(blob.name)]
+
+
+def _list_folder_into(result_queue, stop_event, bucket_name, prefix, page_size):
+    try:
+        for page in iter_gcs_blob_pages(bucket_name, prefix, page_size):
+            if stop_event.is_set():
+                return
+            result_queue.put(page)  # Blocks while the consumer is behind
+    except Exception as e:
+        logging.exception(f"Error listing gs://{bucket_name}/{prefix}: {e}")
+    finally:
+        result_queue.put(_LISTING_DONE)
+
+
+def iter_folders_blob_pages(bucket_name, base_prefix, folders, max_workers=DEFAULT_LISTING_WORKERS,
+                            page_size=DEFAULT_PAGE_SIZE):
+    """Yield pages of video blobs from several folders, listing up to `max_workers` folders concurrently.
+
+    Pages are yielded as they arrive, so their order across folders is not deterministic.
+    """
+    if not folders:
+        return
+    result_queue = queue.Queue(maxsize=max_workers * 2)
+    stop_event = threading.Event()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for folder in folders:
+            executor.submit(_list_folder_into, result_queue, stop_event, bucket_name, f"{base_prefix}{folder}/",
+                            page_size)
+        remaining = len(folders)
+        try:
+            while remaining:
+                page = result_queue.get()
+                if page is _LISTING_DONE:
+                    remaining -= 1
+                else:
+                    yield page
+        finally:
+            # If the consumer stopped early, release listers blocked on the full queue so the pool can shut down
+            stop_event.set()
+            while remaining:
+                if result_queue.get() is _LISTING_DONE:
+                    remaining -= 1
+
+
+def list_gcs_blobs(bucket_name, prefix):
+    return [blob for page in iter_gcs_blob_pages(bucket_name, prefix) for blob in page]
+
+
 def list_gcs_files(bucket_name, prefix):
-    storage_client = storage.Client()
-    bucket = storage_client.get_bucket(bucket_name)
-    blobs = bucket.list_blobs(prefix=prefix)
-    return [blob.name for blob in blobs if blob.name.lower().endswith('.mp4')]
+    return [blob["name"] for blob in list_gcs_blobs(bucket_name, prefix)]
 
 
-def get_latest_folder_and_files(bucket_name, base_prefix):
+def get_latest_folder_and_blobs(bucket_name, base_prefix):
     folders = list_gcs_folders(bucket_name, base_prefix)
     if not folders:
         logging.error("No folders found.")
@@ -27,10 +130,31 @@ def get_latest_folder_and_files(bucket_name, base_prefix):
 
     latest_folder = folders[0]
     prefix = f"{base_prefix}{latest_folder}/"
-    video_files = list_gcs_files(bucket_name, prefix)
+    blobs = list_gcs_blobs(bucket_name, prefix)
 
-    if not video_files:
+    if not blobs:
         logging.error(f"No video files found in the latest folder: {latest_folder}")
         return latest_folder, []
 
-    return latest_folder, video_files
\ No newline at end of file
+    return latest_folder, blobs
+
+
+def get_latest_folder_and_files(bucket_name, base_prefix):
+    latest_folder, blobs = get_latest_folder_and_blobs(bucket_name, base_prefix)
+    return latest_folder, [blob["name"] for blob in blobs]
+
+
+def upload_file(bucket_name, local_path, blob_name):
+    blob = get_storage_client().bucket(bucket_name).blob(blob_name)
+    blob.upload_from_filename(local_path)
+    logging.info(f"Uploaded {local_path} to gs://{bucket_name}/{blob_name}")
+    return f"gs://{bucket_name}/{blob_name}"
+
+
+def iter_gcs_text_lines(gcs_uri_prefix, suffix=""):
+    """Stream the lines of every object under a gs:// prefix without downloading whole files."""
+    bucket_name, _, prefix = gcs_uri_prefix[len("gs://"):].partition('/')
+    for blob in get_storage_client().list_blobs(bucket_name, prefix=prefix):
+        if blob.name.endswith(suffix):
+            with blob.open("r", encoding="utf-8") as f:
+                yield from f
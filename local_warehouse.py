@@ -0,0 +1,249 @@
+import os
+import re
+import json
+import uuid
+import logging
+import tempfile
+import threading
+from datetime import datetime, timezone
+from google.api_core.exceptions import BadRequest, NotFound
+
+# BigQuery column types as DuckDB types, for tables created from a bigquery.Table schema
+DUCKDB_TYPES = {
+    "INTEGER": "BIGINT", "INT64": "BIGINT", "FLOAT": "DOUBLE", "FLOAT64": "DOUBLE", "NUMERIC": "DECIMAL(38, 9)",
+    "BOOLEAN": "BOOLEAN", "BOOL": "BOOLEAN", "STRING": "VARCHAR", "BYTES": "BLOB", "DATE": "DATE",
+    "DATETIME": "TIMESTAMP", "TIMESTAMP": "TIMESTAMPTZ",
+}
+
+_TABLE_REFERENCE = re.compile(r"`[\w-]+\.([\w-]+)\.([\w-]+)`")
+_STATEMENT_END = re.compile(r";[ \t]*(?:\n|$)")
+_TEMP_TABLE = re.compile(r"\bCREATE\s+TEMP(?:ORARY)?\s+TABLE\s+`?(\w+)`?", re.I)
+
+
+def to_duckdb_sql(query, array_types=None):
+    """Rewrite the BigQuery SQL this pipeline issues into DuckDB SQL.
+
+    Covers what the star schema, planner and analytics queries use: `project.dataset.table` references become
+    "dataset"."table", partitioning and clustering clauses are dropped, and the BigQuery spellings of types,
+    literals, UNNEST parameters and MERGE are translated. It is not a general BigQuery dialect translator.
+    Array parameters (name -> DuckDB element type in `array_types`) are expected as JSON text: binding a long
+    Python list is far slower than parsing it inside DuckDB.
+    """
+    array_types = array_types or {}
+    query = _TABLE_REFERENCE.sub(r'"\1"."\2"', query)
+    query = re.sub(r"`([^`.]+)`", r'"\1"', query)  # Unqualified names such as script temp tables
+    query = re.sub(r"^[ \t]*PARTITION BY [^\n]*\n", "", query, flags=re.M)
+    query = re.sub(r"^([ \t]*)CLUSTER BY .*?(AS)?$", r"\1\2", query, flags=re.M)
+    query = re.sub(r"\bINT64\b", "BIGINT", query)
+    query = re.sub(r"\bTIMESTAMP\(('[^']*')\)", r"CAST(\1 AS TIMESTAMPTZ)", query)
+    query = re.sub(r"\bDATE\(('[^']*')\)", r"CAST(\1 AS DATE)", query)
+    query = re.sub(r"\b(CURRENT_TIMESTAMP|CURRENT_DATE)\(\)", r"\1", query)
+    query = re.sub(r"\bIN UNNEST\(@(\w+)\)",
+                   lambda match: f"IN (SELECT UNNEST(from_json(${match[1]}, "
+                                 f"'[\"{array_types.get(match[1], 'BIGINT')}\"]')))", query)
+    query = re.sub(r"@(\w+)", r"$\1", query)
+    return re.sub(r"\bMERGE\s+(?!INTO\b)", "MERGE INTO ", query)
+
+
+def split_statements(query):
+    return [statement.strip() for statement in _STATEMENT_END.split(query) if statement.strip()]
+
+
+def _table_name(table):
+    """(dataset, table) of a 'project.dataset.table' id or a bigquery.Table."""
+    if isinstance(table, str):
+        parts = table.split(".")
+        return parts[-2], parts[-1]
+    return table.dataset_id, table.table_id
+
+
+class LocalRow(dict):
+    """A result row readable both as row['column'] and as row.column, like bigquery.Row."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+class LocalQueryJob:
+    """The parts of a finished bigquery.QueryJob the pipeline reads: its rows and its statistics."""
+
+    def __init__(self, rows, started, ended=None, bytes_processed=0):
+        self.job_id = f"local_{uuid.uuid4().hex[:12]}"
+        self.started = started
+        self.ended = ended or started
+        self.total_bytes_processed = bytes_processed
+        self.total_bytes_billed = 0
+        self.slot_millis = None
+        self.cache_hit = False
+        self.output_rows = len(rows)
+        self._rows = rows
+
+    def result(self, **kwargs):
+        return iter(self._rows)
+
+
+class LocalWarehouseClient:
+    """Embedded DuckDB warehouse behind the subset of the bigquery.Client interface the pipeline uses.
+
+    Every BigQuery dataset is a DuckDB schema, so the star schema functions, the planner and the analytics export
+    run unchanged against a local database file (or in memory with ':memory:'). Source tables such as
+    tiktok_videos_metadata are loaded from local Parquet or NDJSON files with `load_file`. Dry runs validate
+    nothing and estimate zero bytes.
+    """
+
+    def __init__(self, path=":memory:", project="local"):
+        import duckdb
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.project = project
+        self.path = path
+        self._duckdb = duckdb
+        self._conn = duckdb.connect(path)
+        # One connection serves every thread; DuckDB parallelizes each statement internally
+        self._lock = threading.RLock()
+
+    def _execute(self, sql, parameters=None):
+        with self._lock:
+            try:
+                cursor = self._conn.execute(sql, parameters) if parameters else self._conn.execute(sql)
+                if cursor.description is None:
+                    return []
+                columns = [column[0] for column in cursor.description]
+                return [LocalRow(zip(columns, values)) for values in cursor.fetchall()]
+            except self._duckdb.CatalogException as e:
+                raise NotFound(str(e)) from e
+            except self._duckdb.Error as e:
+                raise BadRequest(str(e)) from e
+
+    def _ensure_schema(self, dataset):
+        self._execute(f'CREATE SCHEMA IF NOT EXISTS "{dataset}"')
+
+    def query(self, query, job_config=None, **kwargs):
+        started = datetime.now(timezone.utc)
+        if job_config is not None and getattr(job_config, "dry_run", False):
+            return LocalQueryJob([], started)
+
+        parameters, array_types = {}, {}
+        for parameter in getattr(job_config, "query_parameters", None) or []:
+            if hasattr(parameter, "values"):
+                parameters[parameter.name] = json.dumps(list(parameter.values), default=str)
+                array_types[parameter.name] = DUCKDB_TYPES.get(parameter.array_type, "VARCHAR")
+            else:
+                parameters[parameter.name] = parameter.value
+        for dataset, _ in _TABLE_REFERENCE.findall(query):
+            self._ensure_schema(dataset)
+
+        rows = []
+        with self._lock:
+            try:
+                for statement in split_statements(to_duckdb_sql(query, array_types)):
+                    used = {name: value for name, value in parameters.items() if f"${name}" in statement}
+                    rows = self._execute(statement, used)
+            except Exception:
+                # A failed BigQuery script rolls back its open transaction
+                try:
+                    self._conn.execute("ROLLBACK")
+                except self._duckdb.Error:
+                    pass  # No transaction was open
+                raise
+            finally:
+                # Temp tables live as long as the script in BigQuery, but as long as the connection in DuckDB
+                for name in _TEMP_TABLE.findall(query):
+                    self._conn.execute(f'DROP TABLE IF EXISTS temp."{name}"')
+        return LocalQueryJob(rows, started, datetime.now(timezone.utc))
+
+    def create_table(self, table, exists_ok=False):
+        dataset, name = _table_name(table)
+        self._ensure_schema(dataset)
+        columns = ", ".join(
+            f'"{field.name}" {DUCKDB_TYPES.get(field.field_type, "VARCHAR")}'
+            + (" NOT NULL" if field.mode == "REQUIRED" else "")
+            for field in table.schema
+        )
+        self._execute(f'CREATE TABLE {"IF NOT EXISTS " if exists_ok else ""}"{dataset}"."{name}" ({columns})')
+        return table
+
+    def get_table(self, table_id):
+        dataset, name = _table_name(table_id)
+        self._execute(f'SELECT * FROM "{dataset}"."{name}" LIMIT 0')  # Raises NotFound like BigQuery
+        return table_id
+
+    def insert_rows_json(self, table_id, rows, **kwargs):
+        """Append rows by column name, ignoring keys the table does not have. Returns [] like BigQuery on success."""
+        if not rows:
+            return []
+        data = "".join(json.dumps(row, default=str) + "\n" for row in rows).encode("utf-8")
+        try:
+            self._append_ndjson(table_id, data)
+        except BadRequest as e:
+            return [{"index": index, "errors": [{"reason": "invalid", "message": str(e)}]}
+                    for index in range(len(rows))]
+        return []
+
+    def load_table_from_file(self, file_obj, table_id, job_config=None, **kwargs):
+        """Append rows from a binary file object: newline-delimited JSON as WarehouseWriter's load jobs send, or
+        Parquet when the job config says so (`results.load_parquet`)."""
+        started = datetime.now(timezone.utc)
+        if getattr(job_config, "source_format", None) == "PARQUET":
+            rows = self._append_parquet(table_id, file_obj.read())
+        else:
+            rows = self._append_ndjson(table_id, file_obj.read())
+        return LocalQueryJob([{}] * rows, started, datetime.now(timezone.utc))
+
+    def _append_parquet(self, table_id, data):
+        dataset, name = _table_name(table_id)
+        with self._lock, tempfile.NamedTemporaryFile(suffix=".parquet") as staging:
+            staging.write(data)
+            staging.flush()
+            before = self._execute(f'SELECT COUNT(*) AS n FROM "{dataset}"."{name}"')[0].n
+            self._execute(f'INSERT INTO "{dataset}"."{name}" BY NAME SELECT * FROM read_parquet(?)', [staging.name])
+            return self._execute(f'SELECT COUNT(*) AS n FROM "{dataset}"."{name}"')[0].n - before
+
+    def _append_ndjson(self, table_id, data):
+        """Bulk-insert NDJSON bytes through DuckDB's JSON reader, typed by the table's columns; row-by-row
+        parameterized inserts are orders of magnitude slower. Returns the number of rows appended."""
+        dataset, name = _table_name(table_id)
+        with self._lock:
+            columns = self._execute(
+                "SELECT column_name, data_type FROM information_schema.columns "
+                "WHERE table_schema = ? AND table_name = ? ORDER BY ordinal_position", [dataset, name])
+            if not columns:
+                raise NotFound(f"Table {table_id} not found")
+            column_types = ", ".join(f"'{column.column_name}': '{column.data_type}'" for column in columns)
+            column_list = ", ".join(f'"{column.column_name}"' for column in columns)
+            with tempfile.NamedTemporaryFile(suffix=".ndjson") as staging:
+                staging.write(data)
+                staging.flush()
+                self._execute(f'INSERT INTO "{dataset}"."{name}" ({column_list}) SELECT {column_list} '
+                              f"FROM read_json(?, format = 'newline_delimited', columns = {{{column_types}}})",
+                              [staging.name])
+        return data.count(b"\n")
+
+    def load_file(self, table_id, path, replace=True):
+        """Create (or append to) a table from a local Parquet or NDJSON file; columns and types come from the file."""
+        dataset, name = _table_name(table_id)
+        self._ensure_schema(dataset)
+        reader = "read_parquet" if path.endswith(".parquet") else "read_json_auto"
+        source = f"SELECT * FROM {reader}(?)"
+        if replace:
+            self._execute(f'CREATE OR REPLACE TABLE "{dataset}"."{name}" AS {source}', [path])
+        else:
+            self._execute(f'INSERT INTO "{dataset}"."{name}" BY NAME {source}', [path])
+        count = self._execute(f'SELECT COUNT(*) AS n FROM "{dataset}"."{name}"')[0].n
+        logging.info(f"Loaded {path} into local table {dataset}.{name} ({count} rows)")
+        return count
+
+    def export_table(self, table_id, path):
+        """Write a local table to Parquet."""
+        dataset, name = _table_name(table_id)
+        quoted_path = path.replace("'", "''")
+        self._execute(f'COPY "{dataset}"."{name}" TO \'{quoted_path}\' (FORMAT PARQUET)')
+        return path
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
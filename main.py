@@ -1,165 +1,426 @@
+import os
 import time
 import sys
+import argparse
 import logging
-import vertexai
-from video_processor import generate
-from gcs_utils import get_latest_folder_and_files
+from video_processor import generate, create_analysis_run, analyze_video_isolated, video_cache_key, extract_video_id
+from gcs_utils import select_folders, iter_folders_blob_pages
+from streaming_pipeline import run_streaming_pipeline
+from metrics import RunMetrics
+from analysis_cache import AnalysisCache
+from batch_prediction import run_batch_prediction
+from planner import fetch_analyzed_video_ids, plan_video_files, fetch_video_durations
+from rate_limiter import QuotaScheduler, default_state_path
+from work_queue import SQLiteWorkQueue, run_worker
+from run_journal import RunJournal
+from dedup import FrameHashIndex, fingerprint_videos, find_duplicates, orphaned_duplicates, reuse_duplicate_analyses
+from preprocess import preprocess_videos, clipped_duration
+from results import ResultColumns
+from result_store import ResultStore, DEFAULT_STORE_PATH
+from query_guard import QueryGuard, QueryBudgetExceeded
+from star_schema import (ensure_ai_results_table, insert_ai_results, create_and_populate_tables, update_star_schema,
+                         PROJECT_TIMEZONE)
 from google.cloud import bigquery
-from google.api_core.exceptions import BadRequest
 from datetime import datetime
-import pytz
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
-PROJECT_TIMEZONE = pytz.timezone('Asia/Jerusalem')
+STAR_SCHEMA_CHUNK = 10000  # Videos written by a streaming run that are merged into the star schema at a time
 
-def execute_query(client, query, description):
-    job_config = bigquery.QueryJobConfig()
-    job_config.use_legacy_sql = False
+def create_quota_scheduler(config):
+    # Worker processes on this machine share the budget through the same state file
+    return QuotaScheduler(config["requests_per_minute"], config["tokens_per_minute"], state_path=default_state_path(),
+                          max_concurrency=config["max_workers"])
+
+def create_query_guard(config, metrics):
+    budget = config["query_budget_gib"]
+    return QueryGuard(int(budget * 1024 ** 3) if budget is not None else None, config["dry_run_queries"], metrics)
+
+def run_streaming(bq_client, project_id, dataset_id, metadata_table_name, bucket_name, base_prefix, folders, config,
+                  full_rebuild=False, metrics=None):
+    metrics = metrics if metrics is not None else RunMetrics()
+    ai_table_id = f"{project_id}.{dataset_id}.ai_results"
+    ensure_ai_results_table(bq_client, ai_table_id)
+    analyzed_ids = fetch_analyzed_video_ids(bq_client, ai_table_id)
+    result_store = ResultStore(config["result_store"]) if config["result_store"] else None
+
+    analysis_cache = AnalysisCache()
+    run = create_analysis_run(bucket_name, config["temperature"], config["top_p"], cache=analysis_cache,
+                              metrics=metrics, scheduler=create_quota_scheduler(config),
+                              candidate_count=config["candidate_count"], repair=config["repair"],
+                              request_timeout=config["request_timeout"], hedge_percentile=config["hedge_percentile"])
+
+    def analyze(blob):
+        # Cached entries hold a single sample, so consistency runs always call the model
+        cache_key = None
+        if config["candidate_count"] == 1:
+            cache_key = video_cache_key(blob, config["temperature"], config["top_p"])
+        return analyze_video_isolated(run, blob["name"], cache_key)
+
+    guard = create_query_guard(config, metrics)
+    pending_ids = []  # Written but not yet merged into the star schema
+    merges = []
+
+    def merge_pending():
+        # Merging in chunks keeps memory flat: the run never holds every video_id it wrote
+        if full_rebuild or not pending_ids:
+            return
+        with metrics.stage("star_schema"):
+            update_star_schema(bq_client, project_id, dataset_id, metadata_table_name, sorted(pending_ids),
+                               guard=guard, ensure_tables=not merges)
+        merges.append(len(pending_ids))
+        pending_ids.clear()
+
+    def flush(rows):
+        with metrics.stage("warehouse_write"):
+            written = insert_ai_results(bq_client, ai_table_id, rows)
+        if not written:
+            raise RuntimeError(f"Failed to write any of {len(rows)} AI results into {ai_table_id}")
+        if result_store is not None:
+            result_store.append(written)
+        pending_ids.extend(row['video_id'] for row in written)
+        if len(pending_ids) >= STAR_SCHEMA_CHUNK:
+            merge_pending()
+
+    logging.info(f"Streaming videos from folders: {', '.join(folders)}")
+    blob_pages = iter_folders_blob_pages(bucket_name, base_prefix, folders)
     try:
-        job = client.query(query, job_config=job_config)
-        job.result()  # Wait for the job to complete
-        logging.info(f"Successfully executed: {description}")
-    except BadRequest as e:
-        logging.error(f"Error in {description}: {e}")
-        raise
-
-def create_and_populate_tables(client, project_id, dataset_id, metadata_table_name, ai_results):
-    current_time = datetime.now(PROJECT_TIMEZONE)
-    current_date = current_time.date()
-    current_timestamp = current_time.isoformat()
-
-    # Create or use the permanent table for AI results
-    ai_table_name = "ai_results"
-    ai_table_id = f"{project_id}.{dataset_id}.{ai_table_name}"
-    schema = [
-        bigquery.SchemaField("video_id", "INTEGER", mode="REQUIRED"),
-        bigquery.SchemaField("ai_unexpectedness_rating", "INTEGER"),  # text1
-        bigquery.SchemaField("ai_unexpectedness_duration", "INTEGER"),  # text2
-        bigquery.SchemaField("ai_expectation_violation_description", "STRING"),  # text3
-        bigquery.SchemaField("ai_emotional_intensity", "INTEGER"),  # text4
-        bigquery.SchemaField("ai_positivity", "INTEGER"),  # text5
-        bigquery.SchemaField("ai_negativity", "INTEGER"),  # text6
-        bigquery.SchemaField("ai_expected_desirability", "INTEGER"),  # text7
-        bigquery.SchemaField("ai_unexpected_desirability", "INTEGER"),  # text8
-        bigquery.SchemaField("ai_emotional_spatial_closeness", "INTEGER"),  # text9
-        bigquery.SchemaField("ai_cognitive_interruption", "INTEGER"),  # text10
-        bigquery.SchemaField("ai_perceived_realism", "INTEGER"),  # text11
-        bigquery.SchemaField("ai_sexual_content_rating", "INTEGER")  # text12
-    ]
-
-    table = bigquery.Table(ai_table_id, schema=schema)
-    table = client.create_table(table, exists_ok=True)
-
-    # Insert AI results into the AI results table
-    errors = client.insert_rows_json(ai_table_id, ai_results)
-    if errors:
-        logging.error(f"Errors inserting AI results: {errors}")
-        return
-
-    # Create dim_lang table
-    dim_lang_query = f"""
-    CREATE OR REPLACE TABLE `{project_id}.{dataset_id}.dim_lang` AS
-    SELECT ROW_NUMBER() OVER() as lang_id, lang, TIMESTAMP('{current_timestamp}') as created_at
-    FROM (SELECT DISTINCT lang FROM `{project_id}.{dataset_id}.{metadata_table_name}`) t;
-    """
-    execute_query(client, dim_lang_query, "Create dim_lang table")
+        stats = run_streaming_pipeline(blob_pages, analyze, flush, analyzed_ids, max_workers=config["max_workers"])
+    finally:
+        analysis_cache.close()
+    logging.info(f"Token usage: {metrics.usage.report()}")
 
-    # Create dim_user table
-    dim_user_query = f"""
-    CREATE OR REPLACE TABLE `{project_id}.{dataset_id}.dim_user` AS
-    SELECT DISTINCT user_id, user, user_nickname, user_signature, user_followers, user_videos, TIMESTAMP('{current_timestamp}') as created_at
-    FROM `{project_id}.{dataset_id}.{metadata_table_name}`;
-    """
-    execute_query(client, dim_user_query, "Create dim_user table")
-
-    # Create dim_video table - Updated to use video_id instead of id
-    dim_video_query = f"""
-    CREATE OR REPLACE TABLE `{project_id}.{dataset_id}.dim_video` AS
-    SELECT 
-        CAST(m.id AS INT64) as video_id, 
-        m.text, 
-        m.gcs_path, 
-        TIMESTAMP('{current_timestamp}') as created_at
-    FROM `{project_id}.{dataset_id}.{metadata_table_name}` m
-    JOIN `{ai_table_id}` a ON CAST(m.id AS INT64) = a.video_id;
-    """
-    execute_query(client, dim_video_query, "Create dim_video table")
-
-    # Create fact_video_analytics table - Updated to use video_id
-    fact_table_query = f"""
-    CREATE OR REPLACE TABLE `{project_id}.{dataset_id}.fact_video_analytics` AS
-    SELECT 
-        CAST(m.id AS INT64) as video_id,
-        m.user_id,
-        l.lang_id,
-        m.createTimeISO,
-        m.duration,
-        m.video_likes,
-        m.video_shares,
-        m.video_plays,
-        m.video_bookmarks,
-        m.video_comments,
-        a.ai_unexpectedness_rating,
-        a.ai_unexpectedness_duration,
-        a.ai_expectation_violation_description,
-        a.ai_emotional_intensity,
-        a.ai_positivity,
-        a.ai_negativity,
-        a.ai_expected_desirability,
-        a.ai_unexpected_desirability,
-        a.ai_emotional_spatial_closeness,
-        a.ai_cognitive_interruption,
-        a.ai_perceived_realism,
-        a.ai_sexual_content_rating,
-        DATE('{current_date}') as analysis_date,
-        TIMESTAMP('{current_timestamp}') as created_at
-    FROM `{project_id}.{dataset_id}.{metadata_table_name}` m
-    JOIN `{ai_table_id}` a ON CAST(m.id AS INT64) = a.video_id
-    JOIN `{project_id}.{dataset_id}.dim_lang` l ON m.lang = l.lang;
+    if stats["flushed"] and full_rebuild:
+        with metrics.stage("star_schema"):
+            update_star_schema(bq_client, project_id, dataset_id, metadata_table_name, [], full_rebuild, guard)
+    elif stats["flushed"]:
+        merge_pending()
+    else:
+        logging.warning("No AI results generated. BigQuery tables were not created or populated.")
+
+def run_distributed(role, queue, bq_client, project_id, dataset_id, metadata_table_name, bucket_name, base_prefix,
+                    folders, config, full_rebuild=False, metrics=None):
+    """One role of a sharded run: enqueue the planned videos, work through leased batches, or load the results.
+
+    Any number of `work` processes can share the queue. The `load` role writes committed results that are not yet
+    in the warehouse and can be repeated safely, for example after a crash between the write and the bookkeeping.
     """
-    execute_query(client, fact_table_query, "Create fact_video_analytics table")
+    metrics = metrics if metrics is not None else RunMetrics()
+    ai_table_id = f"{project_id}.{dataset_id}.ai_results"
+
+    if role == "enqueue":
+        with metrics.stage("listing"):
+            video_files = [blob["name"] for page in iter_folders_blob_pages(bucket_name, base_prefix, folders)
+                           for blob in page]
+        with metrics.stage("planning"):
+            analyzed_ids = fetch_analyzed_video_ids(bq_client, ai_table_id)
+            video_files, _ = plan_video_files(video_files, analyzed_ids)
+        queue.enqueue(video_files)
 
-    logging.info(f"Star schema populated with data from {metadata_table_name} and AI results")
+    elif role == "work":
+        analysis_cache = AnalysisCache()
+        run = create_analysis_run(bucket_name, config["temperature"], config["top_p"], cache=analysis_cache,
+                                  metrics=metrics, scheduler=create_quota_scheduler(config),
+                                  candidate_count=config["candidate_count"], repair=config["repair"],
+                                  request_timeout=config["request_timeout"],
+                                  hedge_percentile=config["hedge_percentile"])
+        try:
+            committed = run_worker(queue, run, max_workers=config["max_workers"])
+        finally:
+            analysis_cache.close()
+        logging.info(f"Worker committed {committed} results. Token usage: {metrics.usage.report()}")
+
+    elif role == "load":
+        ensure_ai_results_table(bq_client, ai_table_id)
+        analyzed_ids = fetch_analyzed_video_ids(bq_client, ai_table_id)
+        results = queue.unloaded_results()
+        already_loaded = [row['video_id'] for row in results if row['video_id'] in analyzed_ids]
+        queue.mark_loaded(already_loaded)
+        results = [row for row in results if row['video_id'] not in analyzed_ids]
+        if not results:
+            logging.info(f"No new results to load. Queue: {queue.stats()}")
+            return
+        with metrics.stage("warehouse_write"):
+            written = insert_ai_results(bq_client, ai_table_id, results)
+        video_ids = sorted({row['video_id'] for row in written})
+        if config["result_store"]:
+            ResultStore(config["result_store"]).append(written)
+        queue.mark_loaded(video_ids)
+        if video_ids:
+            with metrics.stage("star_schema"):
+                update_star_schema(bq_client, project_id, dataset_id, metadata_table_name, video_ids, full_rebuild,
+                                   create_query_guard(config, metrics))
+
+    logging.info(f"Queue status: {queue.stats()}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze TikTok videos and update the star schema")
+    parser.add_argument("--batch", action="store_true",
+                        help="Analyze the videos with a Vertex AI batch prediction job instead of online requests")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream videos from the listing to the warehouse in micro-batches")
+    parser.add_argument("--folders", nargs="+", metavar="FOLDER",
+                        help="Date folders under the base prefix to process instead of only the latest one")
+    parser.add_argument("--start-date", help="Process every date folder from this date (YYYY-MM-DD)")
+    parser.add_argument("--end-date", help="Process every date folder up to this date (YYYY-MM-DD)")
+    parser.add_argument("--queue", metavar="PATH",
+                        help="Run one role of a sharded run against the shared work queue at this path")
+    parser.add_argument("--role", choices=["enqueue", "work", "load"], default="work",
+                        help="Role of this process in a sharded run (with --queue)")
+    parser.add_argument("--preprocess", action="store_true",
+                        help="Analyze downscaled, frame-rate reduced and trimmed copies of the videos")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Reuse analyses across near-duplicate videos; downloads every planned video in full "
+                             "to hash its frames before any model call")
+    parser.add_argument("--samples", type=int, default=1,
+                        help="Candidates sampled per video in one request; above 1 also stores per-field consistency")
+    parser.add_argument("--no-repair", action="store_true",
+                        help="Don't send a second request for fields that came back missing or unparseable")
+    parser.add_argument("--request-timeout", type=float, default=600,
+                        help="Seconds after which a model call is abandoned and the video counted as failed")
+    parser.add_argument("--hedge-percentile", type=float,
+                        help="Send a duplicate request for model calls slower than this percentile of recent calls "
+                             "(e.g. 0.95); duplicates are billed, so hedging is off by default")
+    parser.add_argument("--full-rebuild", action="store_true",
+                        help="Recreate the star schema tables from the full history instead of merging the new batch")
+    parser.add_argument("--resume", metavar="RUN_ID",
+                        help="Resume an interrupted run from its journal, redoing only the videos and steps left")
+    parser.add_argument("--parquet-dir", metavar="DIR",
+                        help="Also export the run's AI results as a Parquet file in this directory")
+    parser.add_argument("--dry-run-queries", action="store_true",
+                        help="Dry-run every star schema statement first and log its estimated bytes")
+    parser.add_argument("--query-budget-gib", type=float,
+                        help="Abort before any star schema statement that would take the run over this many GiB "
+                             "processed (implies --dry-run-queries)")
+    parser.add_argument("--local-warehouse", metavar="DB_PATH",
+                        help="Build the star schema in an embedded DuckDB database at this path instead of BigQuery")
+    parser.add_argument("--local-metadata", metavar="FILE",
+                        help="Parquet or NDJSON file loaded as the metadata table of the local warehouse")
+    parser.add_argument("--result-store", metavar="DIR", default=DEFAULT_STORE_PATH,
+                        help="Local result store the run's analyses are appended to")
+    parser.add_argument("--no-result-store", action="store_true",
+                        help="Do not append the run's analyses to the local result store")
+    parser.add_argument("--run-summary", default="run_summary.json",
+                        help="Path of the machine-readable run summary (JSON)")
+    parser.add_argument("--prometheus-file", help="Also write the run metrics in Prometheus text format to this path")
+    args = parser.parse_args()
+    if args.resume and (args.queue or args.stream):
+        parser.error("--resume applies to online and --batch runs only")
+    if args.preprocess and (args.queue or args.stream):
+        parser.error("--preprocess applies to online and --batch runs only")
+    if args.dedup and (args.queue or args.stream):
+        parser.error("--dedup applies to online and --batch runs only")
+
+    metrics = RunMetrics(args.resume)
+
+    def write_run_summary():
+        metrics.write_json(args.run_summary)
+        if args.prometheus_file:
+            metrics.write_prometheus(args.prometheus_file)
+
     # Initialize VertexAI
+    import vertexai
     vertexai.init(project="python-code-running", location="me-west1")
 
-    # Set up BigQuery client
     project_id = "python-code-running"
-    bq_client = bigquery.Client(project=project_id)
-
-    # List all video files in the bucket from the latest date folder
     bucket_name = "main_il"
     base_prefix = "TIKTOK_samples/"
-    latest_folder, video_files = get_latest_folder_and_files(bucket_name, base_prefix)
+    dataset_id = "tiktok_data"
+    metadata_table_name = "tiktok_videos_metadata"
 
-    if not latest_folder:
-        logging.error("No folders found. Exiting.")
-        sys.exit(1)
+    # Set up the BigQuery client, or the embedded warehouse that stands in for it
+    if args.local_warehouse:
+        from local_warehouse import LocalWarehouseClient
+
+        bq_client = LocalWarehouseClient(args.local_warehouse, project_id)
+        if args.local_metadata:
+            bq_client.load_file(f"{project_id}.{dataset_id}.{metadata_table_name}", args.local_metadata)
+    else:
+        bq_client = bigquery.Client(project=project_id)
 
-    if not video_files:
-        logging.error("No video files found. Exiting.")
+    # Define LLM configuration
+    config = {
+        "temperature": 0.5,
+        "top_p": 0.95,
+        "max_workers": 8,
+        "request_timeout": args.request_timeout,
+        "hedge_percentile": args.hedge_percentile,
+        "dedup": args.dedup,
+        "candidate_count": args.samples,
+        "repair": not args.no_repair,
+        "preprocess": {"max_height": 480, "fps": 1, "max_seconds": 60} if args.preprocess else None,
+        "dry_run_queries": args.dry_run_queries,
+        "query_budget_gib": args.query_budget_gib,
+        "result_store": None if args.no_result_store else args.result_store,
+        "requests_per_minute": 60,
+        "tokens_per_minute": 4000000
+    }
+
+    journal = RunJournal(args.resume) if args.resume else None
+    if journal is not None and journal.plan is None:
+        logging.error(f"No journaled plan found for run {args.resume}. Exiting.")
         sys.exit(1)
 
-    logging.info(f"Processing videos from folder: {latest_folder}")
-    logging.info(f"Processing the following videos: {', '.join(video_files)}")
+    if journal is None:
+        with metrics.stage("listing"):
+            folders = select_folders(bucket_name, base_prefix, args.folders, args.start_date, args.end_date)
+        if not folders:
+            logging.error("No folders found. Exiting.")
+            sys.exit(1)
+    else:
+        folders = journal.plan["folders"]
+
+    if args.queue:
+        queue = SQLiteWorkQueue(args.queue)
+        run_distributed(args.role, queue, bq_client, project_id, dataset_id, metadata_table_name, bucket_name,
+                        base_prefix, folders, config, full_rebuild=args.full_rebuild, metrics=metrics)
+        queue.close()
+        write_run_summary()
+        sys.exit(0)
+
+    if args.stream:
+        start_time = time.time()
+        run_streaming(bq_client, project_id, dataset_id, metadata_table_name, bucket_name, base_prefix, folders,
+                      config, full_rebuild=args.full_rebuild, metrics=metrics)
+        logging.info(f"\nTotal execution time: {time.time() - start_time:.2f} seconds")
+        write_run_summary()
+        sys.exit(0)
+
+    if journal is None:
+        # List all video files in the selected date folders
+        with metrics.stage("listing"):
+            video_blobs = [blob for page in iter_folders_blob_pages(bucket_name, base_prefix, folders)
+                           for blob in page]
+        video_files = [blob["name"] for blob in video_blobs]
+
+        if not video_files:
+            logging.error("No video files found. Exiting.")
+            sys.exit(1)
+
+        # Leave out videos that already have AI results before any Vertex AI call is made
+        with metrics.stage("planning"):
+            analyzed_ids = fetch_analyzed_video_ids(bq_client, f"{project_id}.{dataset_id}.ai_results")
+            video_files, skipped_files = plan_video_files(video_files, analyzed_ids)
+
+        if not video_files:
+            logging.info(f"All {len(skipped_files)} listed videos are already analyzed or invalid. Exiting.")
+            sys.exit(0)
+
+        # Collapse near-duplicate uploads so only one copy of each video is sent to the model
+        fingerprints, duplicates = {}, {}
+        if config["dedup"]:
+            with metrics.stage("dedup"):
+                fingerprints = fingerprint_videos(bucket_name, video_files, config["max_workers"])
+                frame_index = FrameHashIndex()
+                duplicates = find_duplicates(frame_index, fingerprints)
+                frame_index.close()
+
+        # Journal the plan so an interrupted run can be resumed with --resume <run_id>
+        planned_files = set(video_files)
+        video_blobs = [blob for blob in video_blobs if blob["name"] in planned_files]
+        journal = RunJournal(metrics.run_id)
+        journal.record_plan({"folders": folders, "video_blobs": video_blobs, "fingerprints": fingerprints,
+                             "duplicates": duplicates})
+        logging.info(f"Journaling run {metrics.run_id} to {journal.path}")
+    else:
+        video_blobs = journal.plan["video_blobs"]
+        video_files = [blob["name"] for blob in video_blobs]
+        logging.info(f"Resuming run {journal.run_id}: {len(journal.analyses)} of {len(video_files)} videos "
+                     f"already analyzed")
+
+    # Videos with a journaled analysis and near-duplicates of other videos are not sent to the model
+    duplicates = journal.plan.get("duplicates", {})
+    remaining_files = [video_file for video_file in video_files
+                       if extract_video_id(os.path.basename(video_file)) not in journal.analyses
+                       and video_file not in duplicates]
+    if journal.step_done("analysis"):
+        remaining_files = []
+    with metrics.stage("planning"):
+        durations = fetch_video_durations(bq_client, f"{project_id}.{dataset_id}.{metadata_table_name}",
+                                          remaining_files)
+
+    # Optionally send smaller derivatives to the model; their md5 then keys the analysis cache
+    blob_metadata = {blob["name"]: blob for blob in video_blobs}
+    video_uris = {}
+    if config["preprocess"] and remaining_files:
+        with metrics.stage("preprocess"):
+            derivatives = preprocess_videos(bucket_name, [blob_metadata[video_file] for video_file in remaining_files],
+                                            config["preprocess"], durations, metrics=metrics)
+        for video_file, derivative in derivatives.items():
+            blob_metadata[video_file] = derivative
+            video_uris[video_file] = f"gs://{bucket_name}/{derivative['name']}"
+            if video_file in durations:
+                durations[video_file] = clipped_duration(durations[video_file], config["preprocess"])
+
+    logging.info(f"Processing videos from folders: {', '.join(folders)}")
+    logging.info(f"Processing {len(remaining_files)} videos")
 
     # Start the timer
     start_time = time.time()
 
-    # Define LLM configuration
-    config = {
-        "temperature": 0.5,
-        "top_p": 0.95
-    }
+    # Reuse analyses of unchanged videos from previous runs with the same prompts and configuration
+    analysis_cache = AnalysisCache()
+
+    def analyze(files):
+        # Run generate function, or a batch prediction job for large backfills
+        if args.batch:
+            batch_results = run_batch_prediction(files, bucket_name, "batch_prediction/",
+                                                 temperature=config["temperature"],
+                                                 top_p=config["top_p"],
+                                                 video_uris=video_uris,
+                                                 candidate_count=config["candidate_count"])
+            for analysis in batch_results:
+                journal.record_analysis(analysis)
+        else:
+            generate(files, bucket_name,
+                     temperature=config["temperature"],
+                     top_p=config["top_p"],
+                     max_workers=config["max_workers"],
+                     cache=analysis_cache,
+                     blob_metadata=blob_metadata,
+                     metrics=metrics,
+                     scheduler=create_quota_scheduler(config),
+                     durations=durations,
+                     journal=journal,
+                     video_uris=video_uris,
+                     candidate_count=config["candidate_count"],
+                     repair=config["repair"],
+                     request_timeout=config["request_timeout"],
+                     hedge_percentile=config["hedge_percentile"])
 
-    # Run generate function
     logging.info(f"Running analysis with configuration: {config}")
-    all_results = generate(video_files, bucket_name,
-                           temperature=config["temperature"],
-                           top_p=config["top_p"])
+    if remaining_files:
+        analyze(remaining_files)
+    if not journal.step_done("analysis"):
+        fingerprints = journal.plan.get("fingerprints", {})
+        if fingerprints:
+            frame_index = FrameHashIndex()
+            for video_file, hashes in fingerprints.items():
+                video_id = extract_video_id(os.path.basename(video_file))
+                if video_file not in duplicates and video_id in journal.analyses:
+                    frame_index.add(video_id, hashes, journal.analyses[video_id])
+            # A duplicate whose original got no analysis is analyzed itself rather than left without a result
+            orphaned = orphaned_duplicates(frame_index, duplicates, journal.analyses)
+            if orphaned:
+                logging.info(f"Analyzing {len(orphaned)} duplicates whose original could not be analyzed")
+                analyze(orphaned)
+            for analysis in reuse_duplicate_analyses(frame_index, duplicates, journal.analyses):
+                journal.record_analysis(analysis)
+                metrics.increment("duplicates_reused")
+            frame_index.close()
+        journal.record_step("analysis")
+    analysis_cache.close()
+
+    planned_ids = [extract_video_id(os.path.basename(video_file)) for video_file in video_files]
+    all_results = ResultColumns.from_analyses(journal.analyses[video_id] for video_id in planned_ids
+                                              if video_id in journal.analyses)
+    if config["result_store"] and all_results and not journal.step_done("result_store"):
+        # Later reads by video_id (dashboards, charts, re-exports) are served locally instead of by the warehouse
+        ResultStore(config["result_store"]).append(all_results)
+        journal.record_step("result_store")
+    if args.parquet_dir and all_results:
+        os.makedirs(args.parquet_dir, exist_ok=True)
+        all_results.write_parquet(os.path.join(args.parquet_dir, f"ai_results_{metrics.run_id}.parquet"))
 
     # End the timer
     end_time = time.time()
@@ -168,11 +429,20 @@ if __name__ == "__main__":
     logging.info(f"\nTotal execution time: {end_time - start_time:.2f} seconds")
 
     # Create and populate BigQuery tables
+    exit_code = 0
     if all_results:
-        dataset_id = "tiktok_data"
-        metadata_table_name = "tiktok_videos_metadata"
-        create_and_populate_tables(bq_client, project_id, dataset_id, metadata_table_name, all_results)
+        try:
+            create_and_populate_tables(bq_client, project_id, dataset_id, metadata_table_name, all_results,
+                                       full_rebuild=args.full_rebuild, metrics=metrics, journal=journal,
+                                       guard=create_query_guard(config, metrics))
+        except QueryBudgetExceeded as e:
+            # The journal keeps the completed steps, so the run can be resumed with a larger budget
+            logging.error(f"Query budget exceeded, star schema not updated: {e}. Resume with --resume {metrics.run_id}")
+            exit_code = 1
     else:
         logging.warning("No AI results generated. BigQuery tables were not created or populated.")
+    journal.close()
 
+    write_run_summary()
     logging.info(f"Script execution completed at {datetime.now(PROJECT_TIMEZONE).strftime('%Y-%m-%d %H:%M:%S %Z')}")
+    sys.exit(exit_code)
@@ -0,0 +1,172 @@
+import json
+import math
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Estimated Gemini 1.5 Pro list prices in USD per million tokens (prompts up to 128K tokens)
+INPUT_COST_PER_MILLION = 1.25
+CACHED_INPUT_COST_PER_MILLION = 0.3125
+OUTPUT_COST_PER_MILLION = 5.00
+
+PERCENTILES = (0.5, 0.9, 0.99)
+PROMETHEUS_PREFIX = "tiktok_pipeline"
+
+
+def percentile(sorted_samples, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_samples:
+        return 0.0
+    rank = min(len(sorted_samples) - 1, max(0, math.ceil(q * len(sorted_samples)) - 1))
+    return sorted_samples[rank]
+
+
+class TokenUsage:
+    """Accumulates `usage_metadata` token counts over a run, separating cached from uncached input tokens."""
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += getattr(usage, "prompt_token_count", 0) or 0
+            self.cached_tokens += getattr(usage, "cached_content_token_count", 0) or 0
+            self.output_tokens += getattr(usage, "candidates_token_count", 0) or 0
+
+    def report(self):
+        with self._lock:
+            uncached = self.prompt_tokens - self.cached_tokens
+            return {
+                "requests": self.requests,
+                "input_tokens": self.prompt_tokens,
+                "cached_input_tokens": self.cached_tokens,
+                "uncached_input_tokens": uncached,
+                "cached_input_share": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+                "output_tokens": self.output_tokens,
+                "avg_input_tokens_per_request": self.prompt_tokens / self.requests if self.requests else 0.0,
+            }
+
+
+class RunMetrics:
+    """Thread-safe per-run metrics: stage timings, event counters and token usage with estimated cost.
+
+    Stage samples are kept in full so exact percentiles can be reported; a run holds at most a few samples per video.
+    """
+
+    def __init__(self, run_id=None):
+        self.run_id = run_id or datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        self.started_at = time.time()
+        self.usage = TokenUsage()
+        self._samples = {}
+        self._counters = {}
+        self._queries = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self._samples.setdefault(name, []).append(seconds)
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def record_query(self, stats):
+        """Record the statistics of one finished BigQuery job (see `query_guard.job_statistics`)."""
+        with self._lock:
+            self._queries.append(stats)
+            self._counters["bigquery_jobs"] = self._counters.get("bigquery_jobs", 0) + 1
+            self._counters["bigquery_bytes_billed"] = (self._counters.get("bigquery_bytes_billed", 0)
+                                                       + (stats["bytes_billed"] or 0))
+            self._counters["bigquery_slot_ms"] = self._counters.get("bigquery_slot_ms", 0) + (stats["slot_ms"] or 0)
+            self._counters["bigquery_cache_hits"] = (self._counters.get("bigquery_cache_hits", 0)
+                                                     + bool(stats["cache_hit"]))
+
+    def estimated_cost(self):
+        report = self.usage.report()
+        return (
+            report["uncached_input_tokens"] * INPUT_COST_PER_MILLION
+            + report["cached_input_tokens"] * CACHED_INPUT_COST_PER_MILLION
+            + report["output_tokens"] * OUTPUT_COST_PER_MILLION
+        ) / 1_000_000
+
+    def summary(self):
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+            counters = dict(self._counters)
+            queries = list(self._queries)
+        # Every ResourceExhausted is retried unless it exhausted the retry budget and failed the video
+        counters["retries"] = max(0, counters.get("resource_exhausted", 0)
+                                  - counters.get("videos_failed_resource_exhausted", 0))
+
+        stages = {}
+        for name, values in samples.items():
+            stages[name] = {
+                "count": len(values),
+                "total_seconds": sum(values),
+                "max_seconds": values[-1],
+                **{f"p{int(q * 100)}_seconds": percentile(values, q) for q in PERCENTILES},
+            }
+
+        return {
+            "run_id": self.run_id,
+            "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+            "wall_seconds": time.time() - self.started_at,
+            "stages": stages,
+            "counters": counters,
+            "tokens": self.usage.report(),
+            "estimated_cost_usd": self.estimated_cost(),
+            "queries": queries,
+        }
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
+        logging.info(f"Run summary written to {path}")
+
+    def to_prometheus(self):
+        summary = self.summary()
+        lines = [
+            f"# HELP {PROMETHEUS_PREFIX}_stage_seconds Duration of pipeline stages.",
+            f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds summary",
+        ]
+        for name, stage in summary["stages"].items():
+            for q in PERCENTILES:
+                value = stage[f"p{int(q * 100)}_seconds"]
+                lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds{{stage="{name}",quantile="{q}"}} {value}')
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_sum{{stage="{name}"}} {stage["total_seconds"]}')
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_events_total counter")
+        for name, value in summary["counters"].items():
+            lines.append(f'{PROMETHEUS_PREFIX}_events_total{{event="{name}"}} {value}')
+
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_tokens_total counter")
+        for kind in ("input_tokens", "cached_input_tokens", "uncached_input_tokens", "output_tokens"):
+            lines.append(f'{PROMETHEUS_PREFIX}_tokens_total{{kind="{kind}"}} {summary["tokens"][kind]}')
+
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_estimated_cost_usd gauge")
+        lines.append(f"{PROMETHEUS_PREFIX}_estimated_cost_usd {summary['estimated_cost_usd']}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        logging.info(f"Prometheus metrics written to {path}")
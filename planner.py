@@ -0,0 +1,85 @@
+import os
+import logging
+from array import array
+from collections import Counter
+from bisect import bisect_left
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery
+from video_processor import extract_video_id
+
+
+class VideoIdSet:
+    """Read-only set of video IDs stored as a sorted array of 64-bit integers (8 bytes per ID)."""
+
+    def __init__(self, video_ids=()):
+        self._ids = array('q', sorted(set(video_ids)))
+
+    def __contains__(self, video_id):
+        index = bisect_left(self._ids, video_id)
+        return index < len(self._ids) and self._ids[index] == video_id
+
+    def __len__(self):
+        return len(self._ids)
+
+
+def fetch_analyzed_video_ids(client, ai_table_id):
+    """Fetch every video_id already stored in the AI results table in one bulk query."""
+    query = f"SELECT DISTINCT video_id FROM `{ai_table_id}` WHERE video_id IS NOT NULL"
+    try:
+        rows = client.query(query).result(page_size=100000)
+        return VideoIdSet(row.video_id for row in rows)
+    except NotFound:
+        logging.warning(f"Table {ai_table_id} not found. Treating every video as unprocessed.")
+        return VideoIdSet()
+
+
+def plan_video_files(video_files, analyzed_ids):
+    """Split the listing into videos that still need analysis and videos that can be skipped.
+
+    Returns (planned, skipped) where skipped maps each skipped file to the reason it was left out.
+    """
+    planned = []
+    skipped = {}
+    planned_ids = set()
+    for video_file in video_files:
+        video_id = extract_video_id(os.path.basename(video_file))
+        if video_id is None:
+            skipped[video_file] = "invalid_id"
+        elif video_id in analyzed_ids:
+            skipped[video_file] = "already_analyzed"
+        elif video_id in planned_ids:
+            skipped[video_file] = "duplicate_id"  # e.g. a 'Copy of' upload listed next to the original
+        else:
+            planned_ids.add(video_id)
+            planned.append(video_file)
+
+    reasons = Counter(skipped.values())
+    logging.info(f"Work plan: {len(planned)} planned, {len(skipped)} skipped out of {len(video_files)} listed "
+                 f"({reasons['already_analyzed']} already analyzed, {reasons['duplicate_id']} duplicate IDs, "
+                 f"{reasons['invalid_id']} invalid IDs)")
+    return planned, skipped
+
+
+def fetch_video_durations(client, metadata_table_id, video_files):
+    """Look up each video's duration in seconds from the metadata table, keyed by video file."""
+    ids_by_file = {video_file: extract_video_id(os.path.basename(video_file)) for video_file in video_files}
+    video_ids = sorted({video_id for video_id in ids_by_file.values() if video_id is not None})
+    if not video_ids:
+        return {}
+
+    query = f"""
+    SELECT CAST(id AS INT64) as video_id, MAX(duration) as duration
+    FROM `{metadata_table_id}`
+    WHERE CAST(id AS INT64) IN UNNEST(@video_ids)
+    GROUP BY video_id
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("video_ids", "INT64", video_ids)]
+    )
+    try:
+        durations = {row.video_id: row.duration for row in client.query(query, job_config=job_config).result()}
+    except NotFound:
+        logging.warning(f"Table {metadata_table_id} not found. Video durations are unknown.")
+        return {}
+    return {video_file: durations.get(video_id) for video_file, video_id in ids_by_file.items()
+            if durations.get(video_id) is not None}
@@ -0,0 +1,131 @@
+import os
+import base64
+import logging
+import subprocess
+import multiprocessing
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from gcs_utils import get_storage_client, blob_metadata, DERIVATIVE_MARKER
+from rate_limiter import estimate_request_tokens
+
+DEFAULT_PREPROCESS_WORKERS = os.cpu_count() or 4
+
+
+def settings_tag(settings):
+    """Short, filename-safe description of the preprocessing settings, e.g. '480p-1fps-60s'."""
+    parts = []
+    if settings.get("max_height"):
+        parts.append(f"{settings['max_height']}p")
+    if settings.get("fps"):
+        parts.append(f"{settings['fps']}fps")
+    if settings.get("max_seconds"):
+        parts.append(f"{settings['max_seconds']}s")
+    return "-".join(parts) or "copy"
+
+
+def derivative_name(blob, settings):
+    """Name of the derivative written next to the original, keyed by the source md5 and the settings.
+
+    Returns None for objects without an md5 (composite uploads), which are analyzed as they are.
+    """
+    if not blob.get("md5_hash"):
+        return None
+    source_md5 = base64.b64decode(blob["md5_hash"]).hex()[:16]
+    stem = os.path.splitext(blob["name"])[0]
+    return f"{stem}{DERIVATIVE_MARKER}{settings_tag(settings)}.{source_md5}.mp4"
+
+
+def ffmpeg_command(source_path, target_path, settings):
+    filters = []
+    if settings.get("max_height"):
+        # Never upscale; -2 keeps the width even as libx264 requires
+        filters.append(f"scale=-2:'min({settings['max_height']},ih)'")
+    if settings.get("fps"):
+        filters.append(f"fps={settings['fps']}")
+
+    command = ["ffmpeg", "-y", "-loglevel", "error", "-i", source_path]
+    if settings.get("max_seconds"):
+        command += ["-t", str(settings["max_seconds"])]
+    if filters:
+        command += ["-vf", ",".join(filters)]
+    command += ["-c:v", "libx264", "-preset", "veryfast", "-crf", "28", "-c:a", "aac", "-b:a", "64k",
+                "-movflags", "+faststart", target_path]
+    return command
+
+
+def preprocess_video(bucket_name, blob, settings):
+    """Transcode one video unless its derivative already exists. Runs in a worker process, with its own client.
+
+    Returns the derivative's blob metadata, or None when the original should be analyzed instead.
+    """
+    target_name = derivative_name(blob, settings)
+    if target_name is None:
+        return None
+    bucket = get_storage_client().bucket(bucket_name)
+    target = bucket.blob(target_name)
+    if target.exists():
+        target.reload()
+        return blob_metadata(target)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        source_path = os.path.join(workdir, "source.mp4")
+        target_path = os.path.join(workdir, "derivative.mp4")
+        bucket.blob(blob["name"]).download_to_filename(source_path)
+        subprocess.run(ffmpeg_command(source_path, target_path, settings), check=True, capture_output=True,
+                       timeout=settings.get("timeout", 600))
+        target.upload_from_filename(target_path, content_type="video/mp4")
+    target.reload()
+    return blob_metadata(target)
+
+
+def preprocess_videos(bucket_name, blobs, settings, durations=None, max_workers=DEFAULT_PREPROCESS_WORKERS,
+                      metrics=None):
+    """Transcode videos in a process pool and return video file -> derivative blob metadata.
+
+    `settings` may set `max_height`, `fps` and `max_seconds`. Videos whose preprocessing fails are left out of the
+    result so the original is analyzed. The size reduction and the estimated input token reduction (from
+    `durations`, video file -> seconds) are logged and recorded in `metrics`.
+    """
+    derivatives = {}
+    # Spawned rather than forked: a child forked after the parent set up its storage client's gRPC/HTTP state
+    # can deadlock
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {blob["name"]: executor.submit(preprocess_video, bucket_name, blob, settings) for blob in blobs}
+        for video_file, future in futures.items():
+            try:
+                derivative = future.result()
+            except Exception as e:
+                logging.warning(f"Preprocessing failed for {video_file}, analyzing the original: {e}")
+                continue
+            if derivative is not None:
+                derivatives[video_file] = derivative
+
+    report = preprocessing_report(blobs, derivatives, settings, durations or {})
+    logging.info(f"Preprocessing ({settings_tag(settings)}): {report}")
+    if metrics is not None:
+        for name, value in report.items():
+            metrics.increment(f"preprocess_{name}", value)
+    return derivatives
+
+
+def preprocessing_report(blobs, derivatives, settings, durations):
+    source_bytes = sum(blob["size"] or 0 for blob in blobs if blob["name"] in derivatives)
+    derivative_bytes = sum(derivative["size"] or 0 for derivative in derivatives.values())
+    # Gemini samples video at a fixed rate, so only trimming changes the token count; resolution and fps cut bytes
+    tokens_before = sum(estimate_request_tokens(durations.get(video_file)) for video_file in derivatives)
+    tokens_after = sum(estimate_request_tokens(clipped_duration(durations.get(video_file), settings))
+                       for video_file in derivatives)
+    return {
+        "videos": len(derivatives),
+        "source_bytes": source_bytes,
+        "derivative_bytes": derivative_bytes,
+        "bytes_saved": source_bytes - derivative_bytes,
+        "estimated_tokens_before": tokens_before,
+        "estimated_tokens_after": tokens_after,
+    }
+
+
+def clipped_duration(duration, settings):
+    if duration and settings.get("max_seconds"):
+        return min(duration, settings["max_seconds"])
+    return duration
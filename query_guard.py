@@ -0,0 +1,69 @@
+import logging
+import threading
+from google.cloud import bigquery
+from google.api_core.exceptions import BadRequest
+from metrics import RunMetrics
+
+
+class QueryBudgetExceeded(RuntimeError):
+    """A statement was stopped before running because its estimate would take the run over its byte budget."""
+
+
+class QueryGuard:
+    """Per-run BigQuery cost guard.
+
+    With `dry_run` (implied by a `max_bytes` budget) every statement is dry-run first and its estimated bytes are
+    reserved against the budget, so a statement that would exceed it is never started. Statistics of every job
+    that runs are recorded in `metrics` and end up in the run summary.
+    """
+
+    def __init__(self, max_bytes=None, dry_run=False, metrics=None):
+        self.max_bytes = max_bytes
+        self.dry_run = dry_run or max_bytes is not None
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.estimated_bytes = 0  # Estimates of every statement admitted so far
+        self._lock = threading.Lock()
+
+    def admit(self, client, query, job_config, description):
+        """Dry-run a statement and reserve its estimated bytes. Returns the estimate, or None without dry runs."""
+        if not self.dry_run:
+            return None
+        dry_run_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False, use_legacy_sql=False,
+                                                 query_parameters=job_config.query_parameters)
+        try:
+            estimate = client.query(query, job_config=dry_run_config).total_bytes_processed or 0
+        except BadRequest as e:
+            if self.max_bytes is not None:
+                raise QueryBudgetExceeded(f"Cannot estimate {description} against the byte budget: {e}") from e
+            logging.warning(f"Dry run failed for {description}, running it without an estimate: {e}")
+            return None
+
+        with self._lock:
+            if self.max_bytes is not None and self.estimated_bytes + estimate > self.max_bytes:
+                raise QueryBudgetExceeded(
+                    f"{description} would process ~{estimate} bytes; {self.estimated_bytes} of the run's "
+                    f"{self.max_bytes} byte budget are already committed"
+                )
+            self.estimated_bytes += estimate
+        self.metrics.increment("bigquery_estimated_bytes", estimate)
+        logging.info(f"Dry run of {description}: ~{estimate} bytes")
+        return estimate
+
+    def record(self, job, description, estimated_bytes=None):
+        stats = job_statistics(job, description, estimated_bytes)
+        self.metrics.record_query(stats)
+        return stats
+
+
+def job_statistics(job, description, estimated_bytes=None):
+    duration = (job.ended - job.started).total_seconds() if job.started and job.ended else None
+    return {
+        "description": description,
+        "job_id": job.job_id,
+        "estimated_bytes": estimated_bytes,
+        "bytes_processed": job.total_bytes_processed,
+        "bytes_billed": job.total_bytes_billed,
+        "slot_ms": job.slot_millis,
+        "cache_hit": job.cache_hit,
+        "duration_seconds": duration,
+    }
@@ -0,0 +1,236 @@
+import os
+import json
+import tempfile
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from google.api_core import exceptions
+
+# Gemini 1.5 samples video at 1 frame per second: 258 tokens per frame plus 32 tokens per second of audio
+VIDEO_TOKENS_PER_SECOND = 258 + 32
+PROMPT_TOKENS = 2500  # Instruction plus the twelve rubric prompts
+OUTPUT_TOKENS_ALLOWANCE = 500  # Typical JSON answer; corrected against usage_metadata after each call
+DEFAULT_VIDEO_SECONDS = 30  # Used when a video's duration is unknown
+
+MAX_WAIT_STEP = 1.0  # Longest single sleep while waiting for budget, so other workers get a look in
+
+
+def estimate_request_tokens(duration_seconds=None):
+    duration = duration_seconds if duration_seconds else DEFAULT_VIDEO_SECONDS
+    return int(duration * VIDEO_TOKENS_PER_SECOND) + PROMPT_TOKENS + OUTPUT_TOKENS_ALLOWANCE
+
+
+class TokenBucket:
+    """Requests-per-minute and tokens-per-minute budgets refilled continuously.
+
+    With `state_path` the bucket lives in a small JSON file guarded by an exclusive `flock`, so every local worker
+    process that points at the same file draws from one shared budget. Without it the bucket is in-process only.
+    """
+
+    def __init__(self, rpm, tpm, state_path=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._state = {"requests": float(rpm), "tokens": float(tpm), "updated": time.time()}
+
+    @contextmanager
+    def _locked_state(self):
+        with self._lock:
+            if self.state_path is None:
+                yield self._state
+                return
+            with open(self.state_path, "a+", encoding="utf-8") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    content = f.read()
+                    state = json.loads(content) if content else dict(self._state)
+                    yield state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refill(self, state):
+        now = time.time()
+        elapsed = max(0.0, now - state["updated"])
+        state["requests"] = min(float(self.rpm), state["requests"] + elapsed * self.rpm / 60.0)
+        state["tokens"] = min(float(self.tpm), state["tokens"] + elapsed * self.tpm / 60.0)
+        state["updated"] = now
+
+    def try_acquire(self, tokens):
+        """Take one request and `tokens` from the budget, or return the seconds to wait before trying again."""
+        tokens = min(tokens, self.tpm)  # A single oversized request must still be able to run eventually
+        with self._locked_state() as state:
+            self._refill(state)
+            if state["requests"] >= 1 and state["tokens"] >= tokens:
+                state["requests"] -= 1
+                state["tokens"] -= tokens
+                return 0.0
+            request_wait = max(0.0, (1 - state["requests"]) * 60.0 / self.rpm)
+            token_wait = max(0.0, (tokens - state["tokens"]) * 60.0 / self.tpm)
+            return max(request_wait, token_wait)
+
+    def acquire(self, tokens, timeout=None):
+        """Wait for the budget and return the seconds waited, or None if it won't be there within `timeout`."""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0.0:
+                return waited
+            if timeout is not None and waited + wait > timeout:
+                return None
+            step = min(wait, MAX_WAIT_STEP)
+            time.sleep(step)
+            waited += step
+
+    def adjust(self, tokens):
+        """Debit (positive) or refund (negative) tokens once the real usage of a request is known."""
+        with self._locked_state() as state:
+            self._refill(state)
+            state["tokens"] = min(float(self.tpm), state["tokens"] - tokens)
+
+
+class AdaptiveConcurrencyLimiter:
+    """Caps in-flight requests with additive-increase/multiplicative-decrease on throttling."""
+
+    def __init__(self, initial=4, minimum=1, maximum=32, decrease_factor=0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """Take a slot, waiting for one at most `timeout` seconds; returns whether a slot was taken."""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.in_flight < int(self.limit), timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def try_acquire(self):
+        """Take a slot only if one is free right now."""
+        with self._condition:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def cancel(self):
+        """Give back a slot that was never used for a request, leaving the limit as it is."""
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(float(self.minimum), self.limit * self.decrease_factor)
+                logging.info(f"Throttled: concurrency limit lowered to {int(self.limit)}")
+            else:
+                # Grows by roughly one slot per full window of successful requests
+                self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+
+class QuotaScheduler:
+    """Admits model requests within RPM/TPM budgets and an AIMD concurrency limit.
+
+    Use `slot(estimated_tokens)` around each request and set `slot.actual_tokens` from the response so the token
+    budget is corrected for the real usage. `try_slot` takes a slot only when one is free without waiting, for
+    optional extra requests such as hedges.
+    """
+
+    def __init__(self, rpm, tpm, state_path=None, initial_concurrency=4, max_concurrency=32):
+        self.bucket = TokenBucket(rpm, tpm, state_path)
+        self.concurrency = AdaptiveConcurrencyLimiter(initial_concurrency, 1, max_concurrency)
+        self.throttled = 0
+        self.waited_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def slot(self, estimated_tokens, timeout=None):
+        """Wait for a concurrency slot and the request's token budget; the slot is released by leaving its `with`.
+
+        Returns None if they are not both available within `timeout` seconds.
+        """
+        start = time.monotonic()
+        if not self.concurrency.acquire(timeout):
+            return None
+        remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - start))
+        try:
+            waited = self.bucket.acquire(estimated_tokens, remaining)
+        except BaseException:
+            self.concurrency.cancel()
+            raise
+        if waited is None:
+            self.concurrency.cancel()
+            return None
+        with self._lock:
+            self.waited_seconds += waited
+        return Slot(self, estimated_tokens)
+
+    def try_slot(self, estimated_tokens):
+        """A slot if both a concurrency slot and the token budget are available right now, else None."""
+        if not self.concurrency.try_acquire():
+            return None
+        if self.bucket.try_acquire(estimated_tokens) > 0:
+            self.concurrency.cancel()
+            return None
+        return Slot(self, estimated_tokens)
+
+    def stats(self):
+        return {
+            "concurrency_limit": int(self.concurrency.limit),
+            "throttled": self.throttled,
+            "waited_seconds": self.waited_seconds,
+        }
+
+
+class Slot:
+    """One admitted request. Leaving its `with` block frees the concurrency slot, lowers the limit if the request
+    was throttled, and corrects the token budget by `actual_tokens` when it was set."""
+
+    def __init__(self, scheduler, estimated_tokens):
+        self.scheduler = scheduler
+        self.estimated_tokens = estimated_tokens
+        self.actual_tokens = None
+        self._freed = False
+        self._lock = threading.Lock()
+
+    def _free(self):
+        # The concurrency slot is given back once, whether by `abandon` or by leaving the `with` block
+        with self._lock:
+            freed, self._freed = self._freed, True
+        return not freed
+
+    def abandon(self):
+        """Free the concurrency slot of a request nobody waits for any more (e.g. one past its deadline that may
+        never return), leaving the limit as it is. Its tokens are still corrected if it finishes."""
+        if self._free():
+            self.scheduler.concurrency.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        throttled = exc_type is not None and issubclass(exc_type, exceptions.ResourceExhausted)
+        if throttled:
+            with self.scheduler._lock:
+                self.scheduler.throttled += 1
+        if self._free():
+            self.scheduler.concurrency.release(throttled)
+        if self.actual_tokens is not None:
+            self.scheduler.bucket.adjust(self.actual_tokens - self.estimated_tokens)
+        return False
+
+
+def default_state_path():
+    return os.path.join(tempfile.gettempdir(), "tiktok_quota_state.json")
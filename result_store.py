@@ -0,0 +1,260 @@
+import os
+import json
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+import numpy as np
+from video_processor import INTEGER_FIELDS
+from results import STRING_FIELDS, ResultColumns
+
+DEFAULT_STORE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "tiktok_ai_analysis", "result_store")
+SCORE_DTYPE = np.dtype("<i4")
+NULL_SCORE = np.iinfo(SCORE_DTYPE).min  # Stored in a score column where the value is null
+ID_DTYPE = np.dtype("<i8")
+HEAP_DTYPE = np.dtype("u1")
+STORE_VERSION = 1
+INDEX_MERGE_RATIO = 2  # Index segments are merged while the older one is at most this many times the newer
+
+
+class ResultStore:
+    """Local, append-only store of analyses, readable without the warehouse.
+
+    Layout of the store directory:
+
+    - `video_id.i8` and one `<field>.i4` file per numeric field: fixed-width little-endian columns, read as
+      memory-mapped arrays (nulls are `NULL_SCORE`)
+    - `<field>.heap` with `<field>.offsets.i8` and `<field>.lengths.i4` for each text field: UTF-8 bytes plus
+      each row's start and length (-1 for null); the heap is memory-mapped like the numeric columns
+    - `index.<start>-<end>.i8` and `index_rows.<start>-<end>.i8`: index segments, each holding the video_ids of a
+      range of rows in ascending order with their rows, so lookups are a binary search per segment. Every append
+      writes a segment for its own rows, and the newest segments are merged while the older one is at most
+      `INDEX_MERGE_RATIO` times the larger, which keeps O(log n) segments and makes an append cost O(rows added)
+      amortized rather than O(total rows). A video_id appended again resolves to its latest row.
+    - `meta.json`: the committed row count and index segments. Column files are appended first and the meta is
+      written last, so a crash mid-append leaves the previous state, and the tail is cut off by the next append.
+
+    Appends from several processes are serialized with an exclusive `flock` on `meta.json.lock`.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._columns = {}
+        self._refresh()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _read_meta(self):
+        try:
+            with open(self._file("meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return {"version": STORE_VERSION, "rows": 0, "segments": []}
+        if meta.get("version") != STORE_VERSION:
+            raise ValueError(f"Result store at {self.path} has version {meta.get('version')}, "
+                             f"expected {STORE_VERSION}")
+        return meta
+
+    def _map(self, name, dtype, length):
+        """Read-only memory map of the first `length` values of a column file."""
+        if length == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode="r", shape=(length,))
+
+    def _refresh(self):
+        """Map the columns as of the last committed append."""
+        meta = self._read_meta()
+        rows = meta["rows"]
+        columns = {"video_id": self._map("video_id.i8", ID_DTYPE, rows)}
+        for field in INTEGER_FIELDS:
+            columns[field] = self._map(f"{field}.i4", SCORE_DTYPE, rows)
+        for field in STRING_FIELDS:
+            columns[f"{field}.offsets"] = self._map(f"{field}.offsets.i8", ID_DTYPE, rows)
+            columns[f"{field}.lengths"] = self._map(f"{field}.lengths.i4", SCORE_DTYPE, rows)
+            heap_bytes = 0
+            if rows:
+                ends = columns[f"{field}.offsets"] + np.maximum(columns[f"{field}.lengths"], 0)
+                heap_bytes = int(ends.max())
+            columns[f"{field}.heap"] = self._map(f"{field}.heap", HEAP_DTYPE, heap_bytes)
+        self.rows = rows
+        self._columns = columns
+        self._segments = {(start, end): self._load_segment(start, end) for start, end in meta["segments"]}
+
+    def _load_segment(self, start, end):
+        names = (f"index.{start}-{end}.i8", f"index_rows.{start}-{end}.i8")
+        expected_bytes = (end - start) * ID_DTYPE.itemsize
+        if all(os.path.exists(self._file(name)) and os.path.getsize(self._file(name)) == expected_bytes
+               for name in names):
+            return tuple(self._map(name, ID_DTYPE, end - start) for name in names)
+        # A missing or partly written segment is derived data; rebuild it from the committed rows
+        return _sorted_segment(np.asarray(self._columns["video_id"][start:end]), start)
+
+    def __len__(self):
+        return self.rows
+
+    @contextmanager
+    def _writer(self):
+        with self._lock, open(self._file("meta.json.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()  # Another process may have appended since this store was opened
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _append_file(self, name, data, committed_bytes):
+        with open(self._file(name), "ab") as f:
+            f.truncate(committed_bytes)  # Drop what an interrupted append left past the committed rows
+            f.write(data)
+
+    def append(self, analyses):
+        """Append analyses (dicts as produced by `video_processor`) and return the number of rows added."""
+        analyses = [analysis for analysis in analyses if analysis.get("video_id") is not None]
+        if not analyses:
+            return 0
+
+        with self._writer():
+            rows = self.rows
+            video_ids = np.array([analysis["video_id"] for analysis in analyses], dtype=ID_DTYPE)
+            self._append_file("video_id.i8", video_ids.tobytes(), rows * ID_DTYPE.itemsize)
+            for field in INTEGER_FIELDS:
+                scores = np.array([NULL_SCORE if analysis.get(field) is None else analysis[field]
+                                   for analysis in analyses], dtype=SCORE_DTYPE)
+                self._append_file(f"{field}.i4", scores.tobytes(), rows * SCORE_DTYPE.itemsize)
+            for field in STRING_FIELDS:
+                self._append_text(field, [analysis.get(field) for analysis in analyses], rows)
+
+            segments = dict(self._segments)
+            segments[(rows, rows + len(analyses))] = _sorted_segment(video_ids, rows)
+            ranges = sorted(segments)
+            while len(ranges) > 1 and (ranges[-2][1] - ranges[-2][0]
+                                       <= INDEX_MERGE_RATIO * (ranges[-1][1] - ranges[-1][0])):
+                older, newer = ranges[-2], ranges.pop()
+                ranges[-1] = (older[0], newer[1])
+                segments[ranges[-1]] = _merge_segments(segments.pop(older), segments.pop(newer))
+            for start, end in ranges:
+                if (start, end) not in self._segments:
+                    index, index_rows = segments[(start, end)]
+                    self._replace_file(f"index.{start}-{end}.i8", index.tobytes())
+                    self._replace_file(f"index_rows.{start}-{end}.i8", index_rows.tobytes())
+
+            self._write_meta({"version": STORE_VERSION, "rows": rows + len(analyses),
+                              "segments": [list(segment) for segment in ranges]})
+            self._refresh()
+            self._remove_stale_segments()
+        logging.info(f"Appended {len(analyses)} results to the result store at {self.path} ({self.rows} rows)")
+        return len(analyses)
+
+    def _append_text(self, field, values, rows):
+        committed_heap = len(self._columns[f"{field}.heap"])
+        encoded = [value.encode("utf-8") if value is not None else None for value in values]
+        lengths = np.array([-1 if data is None else len(data) for data in encoded], dtype=SCORE_DTYPE)
+        offsets = committed_heap + np.concatenate(([0], np.cumsum(np.maximum(lengths, 0))[:-1])).astype(ID_DTYPE)
+        self._append_file(f"{field}.heap", b"".join(data for data in encoded if data is not None), committed_heap)
+        self._append_file(f"{field}.offsets.i8", offsets.tobytes(), rows * ID_DTYPE.itemsize)
+        self._append_file(f"{field}.lengths.i4", lengths.tobytes(), rows * SCORE_DTYPE.itemsize)
+
+    def _replace_file(self, name, data):
+        temp_path = self._file(f"{name}.tmp")
+        with open(temp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self._file(name))
+
+    def _write_meta(self, meta):
+        for name in os.listdir(self.path):
+            if not name.endswith((".tmp", ".lock", ".json")):
+                with open(self._file(name), "rb+") as f:
+                    os.fsync(f.fileno())
+        self._replace_file("meta.json", json.dumps(meta).encode("utf-8"))
+
+    def _remove_stale_segments(self):
+        """Delete index segment files no longer referenced by the committed meta (merged or never committed)."""
+        current = {name for start, end in self._segments
+                   for name in (f"index.{start}-{end}.i8", f"index_rows.{start}-{end}.i8")}
+        for name in os.listdir(self.path):
+            if name.startswith("index") and name.endswith(".i8") and name not in current:
+                os.remove(self._file(name))
+
+    def rows_for(self, video_ids):
+        """Row of each video_id (its latest append), or -1 where the store does not have it."""
+        video_ids = np.asarray(video_ids, dtype=ID_DTYPE)
+        rows = np.full(len(video_ids), -1, dtype=ID_DTYPE)
+        # The newest segment holding an id has its latest row; within a segment the last equal id is the latest
+        for start, end in sorted(self._segments, reverse=True):
+            missing = np.flatnonzero(rows < 0)
+            if not len(missing):
+                break
+            index, index_rows = self._segments[(start, end)]
+            positions = np.maximum(np.searchsorted(index, video_ids[missing], side="right") - 1, 0)
+            rows[missing] = np.where(index[positions] == video_ids[missing], index_rows[positions], -1)
+        return rows
+
+    def __contains__(self, video_id):
+        return self.rows_for([video_id])[0] >= 0
+
+    def column(self, field):
+        """A numeric column (or video_id) as a read-only memory-mapped array, without copying.
+
+        Null scores hold `NULL_SCORE`; use `np.ma.masked_equal(column, NULL_SCORE)` for a masked view.
+        """
+        if field != "video_id" and field not in INTEGER_FIELDS:
+            raise KeyError(f"{field} is not a numeric column")
+        return self._columns[field]
+
+    def text(self, field, row):
+        length = int(self._columns[f"{field}.lengths"][row])
+        if length < 0:
+            return None
+        offset = int(self._columns[f"{field}.offsets"][row])
+        return self._columns[f"{field}.heap"][offset:offset + length].tobytes().decode("utf-8")
+
+    def row(self, row):
+        analysis = {"video_id": int(self._columns["video_id"][row])}
+        for field in INTEGER_FIELDS:
+            value = int(self._columns[field][row])
+            analysis[field] = None if value == NULL_SCORE else value
+        for field in STRING_FIELDS:
+            analysis[field] = self.text(field, row)
+        return analysis
+
+    def get(self, video_id):
+        """The latest analysis stored for `video_id`, or None."""
+        row = int(self.rows_for([video_id])[0])
+        return self.row(row) if row >= 0 else None
+
+    def lookup(self, video_ids):
+        """Analyses for the video_ids the store has, in the order given; unknown ids are skipped."""
+        return [self.row(int(row)) for row in self.rows_for(video_ids) if row >= 0]
+
+    def to_columns(self, video_ids=None):
+        """The latest analysis of every stored video (or of `video_ids`) as `ResultColumns`, e.g. to re-export
+        them to Parquet or load them into the warehouse."""
+        if video_ids is None:
+            # The last entry of each run of equal ids is that video's latest row
+            index, index_rows = _sorted_segment(np.asarray(self._columns["video_id"]), 0)
+            latest = np.append(index[1:] != index[:-1], True) if len(index) else np.zeros(0, dtype=bool)
+            rows = index_rows[latest]
+        else:
+            rows = self.rows_for(video_ids)
+            rows = rows[rows >= 0]
+        return ResultColumns.from_analyses(self.row(int(row)) for row in rows)
+
+
+def _sorted_segment(video_ids, first_row):
+    """Index segment of consecutive rows starting at `first_row`: ids in ascending order and their rows, equal ids
+    in row order."""
+    order = np.argsort(video_ids, kind="stable")
+    return video_ids[order].astype(ID_DTYPE), (order + first_row).astype(ID_DTYPE)
+
+
+def _merge_segments(older, newer):
+    # A stable sort of the two sorted runs (older first) keeps equal ids in row order; NumPy's timsort merges
+    # two runs in about linear time
+    index = np.concatenate([older[0], newer[0]])
+    order = np.argsort(index, kind="stable")
+    return index[order], np.concatenate([older[1], newer[1]])[order]
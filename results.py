@@ -0,0 +1,124 @@
+import logging
+from array import array
+from video_processor import response_schema, INTEGER_FIELDS
+
+STRING_FIELDS = [field for field in response_schema['required'] if field not in INTEGER_FIELDS]
+RESULT_FIELDS = ['video_id'] + response_schema['required']
+_NULL = 0  # Placeholder stored in an integer column where the value is null
+
+
+class AnalysisRecord:
+    """One processed analysis as a fixed-layout object, without a per-instance dict."""
+
+    __slots__ = tuple(RESULT_FIELDS)
+
+    def __init__(self, **values):
+        for field in RESULT_FIELDS:
+            setattr(self, field, values.get(field))
+
+    @classmethod
+    def from_analysis(cls, analysis):
+        return cls(**analysis)
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in RESULT_FIELDS}
+
+
+class ResultColumns:
+    """Analyses accumulated column by column: 64-bit integer arrays with a validity mask, and string lists.
+
+    Iterating yields one row dict at a time, so the columns can be handed to anything that takes a list of
+    analyses (e.g. `WarehouseWriter.write`) without materializing every row at once.
+    """
+
+    def __init__(self):
+        self._ints = {field: array('q') for field in ['video_id'] + INTEGER_FIELDS}
+        self._valid = {field: bytearray() for field in INTEGER_FIELDS}
+        self._strings = {field: [] for field in STRING_FIELDS}
+        self._consistency = {}  # Row index -> consistency statistics, only for multi-sample analyses
+
+    @classmethod
+    def from_analyses(cls, analyses):
+        columns = cls()
+        columns.extend(analyses)
+        return columns
+
+    def append(self, analysis):
+        self._ints['video_id'].append(analysis['video_id'])
+        for field in INTEGER_FIELDS:
+            value = analysis.get(field)
+            self._ints[field].append(_NULL if value is None else value)
+            self._valid[field].append(value is not None)
+        for field in STRING_FIELDS:
+            self._strings[field].append(analysis.get(field))
+        if analysis.get('consistency'):
+            self._consistency[len(self) - 1] = analysis['consistency']
+
+    def extend(self, analyses):
+        for analysis in analyses:
+            self.append(analysis)
+
+    def __len__(self):
+        return len(self._ints['video_id'])
+
+    def row(self, index):
+        row = {'video_id': self._ints['video_id'][index]}
+        for field in response_schema['required']:
+            if field in self._strings:
+                row[field] = self._strings[field][index]
+            else:
+                row[field] = self._ints[field][index] if self._valid[field][index] else None
+        if index in self._consistency:
+            row['consistency'] = self._consistency[index]
+        return row
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.row(index)
+
+    def records(self):
+        for row in self:
+            yield AnalysisRecord(**row)
+
+    def column(self, field):
+        """Values of one column as a list, with None for nulls."""
+        if field in self._strings:
+            return list(self._strings[field])
+        if field == 'video_id':
+            return list(self._ints[field])
+        return [value if valid else None for value, valid in zip(self._ints[field], self._valid[field])]
+
+    def to_arrow(self):
+        import pyarrow as pa
+
+        schema = pa.schema([pa.field('video_id', pa.int64(), nullable=False)] + [
+            pa.field(field, pa.string() if field in self._strings else pa.int64())
+            for field in response_schema['required']
+        ])
+        return pa.table({field: self.column(field) for field in RESULT_FIELDS}, schema=schema)
+
+    def write_parquet(self, path):
+        """Write the columns to a Parquet file matching the ai_results table, or return None without pyarrow."""
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            logging.warning("pyarrow is not installed; results were not exported to Parquet")
+            return None
+        pq.write_table(self.to_arrow(), path, compression="zstd")
+        logging.info(f"Wrote {len(self)} results to {path}")
+        return path
+
+
+def load_parquet(client, table_id, path):
+    """Append a Parquet file written by `ResultColumns.write_parquet` to a BigQuery table with a load job."""
+    from google.cloud import bigquery
+
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+    )
+    with open(path, "rb") as f:
+        job = client.load_table_from_file(f, table_id, job_config=job_config)
+    job.result()
+    logging.info(f"Loaded {job.output_rows} rows from {path} into {table_id}")
+    return job
@@ -0,0 +1,87 @@
+import os
+import json
+import time
+import logging
+import threading
+
+DEFAULT_JOURNAL_DIR = "run_journals"
+
+
+class RunJournal:
+    """Append-only JSONL record of one run: its plan, every finished analysis and every completed step.
+
+    Each record is flushed and fsynced as it is written, so after a crash the journal holds everything done up to
+    that point. Reopening the journal of a run replays it; a torn last line from the crash is ignored.
+    """
+
+    def __init__(self, run_id, directory=DEFAULT_JOURNAL_DIR):
+        self.run_id = run_id
+        self.path = os.path.join(directory, f"{run_id}.jsonl")
+        self.plan = None
+        self.analyses = {}
+        self.steps = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path):
+            self._replay()
+        self._file = open(self.path, "a", encoding="utf-8")
+        if self._file.tell() and not self._ends_with_newline():
+            self._file.write("\n")  # Start after the torn line instead of appending to it
+
+    def _replay(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(f"Ignoring unreadable line {line_number} of journal {self.path}")
+                    continue
+                try:
+                    self._apply(record)
+                except (AttributeError, KeyError, TypeError):
+                    logging.warning(f"Ignoring malformed record on line {line_number} of journal {self.path}")
+        logging.info(f"Replayed journal {self.path}: {len(self.analyses)} analyses, "
+                     f"completed steps: {', '.join(self.steps) or 'none'}")
+
+    def _apply(self, record):
+        record_type = record.get("type")
+        if record_type == "plan":
+            self.plan = record["plan"]
+        elif record_type == "analysis":
+            self.analyses[record["analysis"]["video_id"]] = record["analysis"]
+        elif record_type == "step":
+            self.steps[record["step"]] = record.get("details", {})
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _append(self, record):
+        line = json.dumps(dict(record, at=time.time()))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def record_plan(self, plan):
+        self.plan = plan
+        self._append({"type": "plan", "plan": plan})
+
+    def record_analysis(self, analysis):
+        self.analyses[analysis["video_id"]] = analysis
+        self._append({"type": "analysis", "analysis": analysis})
+
+    def record_step(self, step, **details):
+        self.steps[step] = details
+        self._append({"type": "step", "step": step, "details": details})
+        logging.info(f"Journal {self.run_id}: step '{step}' completed")
+
+    def step_done(self, step):
+        return step in self.steps
+
+    def close(self):
+        with self._lock:
+            self._file.close()
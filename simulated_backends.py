@@ -0,0 +1,271 @@
+import io
+import json
+import time
+import random
+import hashlib
+import threading
+from google.api_core import exceptions
+from video_processor import INTEGER_FIELDS
+
+# Stand-ins for GenerativeModel, storage.Client and bigquery.Client so the pipeline can run without GCP access
+
+
+class LatencyModel:
+    """Samples latencies in seconds from a log-normal distribution with the given median, or a constant."""
+
+    def __init__(self, median=0.0, sigma=0.5, seed=None):
+        self.median = median
+        self.sigma = sigma
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        if self.median <= 0:
+            return 0.0
+        if self.sigma <= 0:
+            return self.median
+        with self._lock:
+            return self._random.lognormvariate(0.0, self.sigma) * self.median
+
+    def sleep(self):
+        delay = self.sample()
+        if delay:
+            time.sleep(delay)
+
+
+def synthetic_analysis(rng):
+    analysis = {field: str(rng.randint(1, 5)) for field in INTEGER_FIELDS}
+    analysis['ai_unexpectedness_duration'] = str(rng.randint(0, 60))
+    analysis['ai_expectation_violation_description'] = "We expect X to happen. Instead Y happens, which is surprising."
+    return analysis
+
+
+def synthetic_metadata_rows(video_ids, seed=None, users=None, languages=("en", "he", "ar", "ru", "es")):
+    """Rows shaped like tiktok_videos_metadata for the given video IDs, with about 20 videos per user."""
+    rng = random.Random(seed)
+    users = users or max(1, len(video_ids) // 20)
+    for video_id in video_ids:
+        user_id = rng.randrange(users)
+        plays = rng.randint(100, 1000000)
+        yield {
+            "id": str(video_id), "user_id": user_id, "lang": rng.choice(languages),
+            "createTimeISO": "2024-01-01T00:00:00.000Z", "duration": rng.randint(5, 180),
+            "video_plays": plays, "video_likes": rng.randint(0, plays // 10), "video_shares": rng.randint(0, plays // 100),
+            "video_comments": rng.randint(0, plays // 100), "video_bookmarks": rng.randint(0, plays // 100),
+            "user": f"user{user_id}", "user_nickname": f"User {user_id}", "user_signature": "",
+            "user_followers": rng.randint(0, 1000000), "user_videos": rng.randint(1, 500),
+            "text": f"Video {video_id}", "gcs_path": f"gs://benchmark-bucket/{video_id}.mp4",
+        }
+
+
+class FakeUsageMetadata:
+    def __init__(self, prompt_token_count, candidates_token_count, cached_content_token_count=0):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.cached_content_token_count = cached_content_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    def __init__(self, text, usage_metadata):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeGenerativeModel:
+    """Mimics `GenerativeModel.generate_content` with simulated latency, errors and JSON payloads.
+
+    `resource_exhausted_rate` raises `ResourceExhausted` (retried by the pipeline), `error_rate` raises a
+    non-retryable `InternalServerError` and `malformed_rate` returns text that is not valid JSON.
+    `payload_fn(rng)` builds the analysis dict returned for each call.
+    """
+
+    def __init__(self, latency=None, error_rate=0.0, resource_exhausted_rate=0.0, malformed_rate=0.0,
+                 payload_fn=synthetic_analysis, prompt_tokens=16000, output_tokens=400, seed=None):
+        self.latency = latency or LatencyModel()
+        self.error_rate = error_rate
+        self.resource_exhausted_rate = resource_exhausted_rate
+        self.malformed_rate = malformed_rate
+        self.payload_fn = payload_fn
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        with self._lock:
+            self.calls += 1
+            roll = self._random.random()
+            payload = self.payload_fn(self._random)
+        self.latency.sleep()
+
+        if roll < self.resource_exhausted_rate:
+            raise exceptions.ResourceExhausted("Simulated quota exhaustion")
+        roll -= self.resource_exhausted_rate
+        if roll < self.error_rate:
+            raise exceptions.InternalServerError("Simulated model failure")
+        roll -= self.error_rate
+        text = "not json" if roll < self.malformed_rate else json.dumps(payload)
+        return FakeResponse(text, FakeUsageMetadata(self.prompt_tokens, self.output_tokens))
+
+
+class FakeBlob:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.md5_hash = hashlib.md5(name.encode("utf-8")).hexdigest()
+        self.crc32c = None
+        self.generation = 1
+
+
+class FakePage(list):
+    def __init__(self, blobs, prefixes=()):
+        super().__init__(blobs)
+        self.prefixes = set(prefixes)
+
+
+class FakeBlobIterator:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def __iter__(self):
+        for page in self.pages:
+            yield from page
+
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def list_blobs(self, prefix="", delimiter=None, page_size=1000, **kwargs):
+        return self.client.list_blobs(self.name, prefix=prefix, delimiter=delimiter, page_size=page_size)
+
+
+class FakeStorageClient:
+    """Serves a synthetic bucket of `<base_prefix><folder>/<video_id>.mp4` objects with per-page latency."""
+
+    def __init__(self, folders, base_prefix="TIKTOK_samples/", page_latency=None, first_video_id=7000000000000000000,
+                 video_size=8 * 1024 * 1024):
+        self.base_prefix = base_prefix
+        self.page_latency = page_latency or LatencyModel()
+        self.names = {}
+        video_id = first_video_id
+        for folder, count in folders.items():
+            self.names[folder] = [f"{base_prefix}{folder}/{video_id + i}.mp4" for i in range(count)]
+            video_id += count
+        self.video_size = video_size
+
+    def bucket(self, name):
+        return FakeBucket(self, name)
+
+    def get_bucket(self, name):
+        return FakeBucket(self, name)
+
+    def list_blobs(self, bucket_name, prefix="", delimiter=None, page_size=1000, **kwargs):
+        if delimiter == '/':
+            prefixes = [f"{self.base_prefix}{folder}/" for folder in self.names]
+            prefixes = [folder_prefix for folder_prefix in prefixes if folder_prefix.startswith(prefix)]
+            return FakeBlobIterator(self._pages([], page_size, prefixes))
+        names = [name for folder_names in self.names.values() for name in folder_names if name.startswith(prefix)]
+        return FakeBlobIterator(self._pages(names, page_size))
+
+    def _pages(self, names, page_size, prefixes=()):
+        if not names:
+            self.page_latency.sleep()
+            yield FakePage([], prefixes)
+            return
+        for start in range(0, len(names), page_size):
+            self.page_latency.sleep()
+            yield FakePage([FakeBlob(name, self.video_size) for name in names[start:start + page_size]], prefixes)
+
+
+class FakeRow(dict):
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class FakeJob:
+    def __init__(self, rows=(), latency=None):
+        self._rows = [FakeRow(row) for row in rows]
+        self._latency = latency or LatencyModel()
+        self.job_id = "simulated"
+        self.total_bytes_processed = 0
+        self.total_bytes_billed = 0
+        self.slot_millis = 0
+        self.cache_hit = False
+        self.started = None
+        self.ended = None
+
+    def result(self, *args, **kwargs):
+        self._latency.sleep()
+        return iter(self._rows)
+
+
+class FakeBigQueryClient:
+    """Records streaming inserts, load jobs and queries, with latency and per-row insert failures.
+
+    Like BigQuery, streamed rows whose `row_ids` entry was inserted before are accepted without being added again.
+    Queries selecting `video_id` from ai_results return the IDs inserted so far; other statements succeed
+    without rows.
+    """
+
+    def __init__(self, insert_latency=None, query_latency=None, row_error_rate=0.0, seed=None):
+        self.insert_latency = insert_latency or LatencyModel()
+        self.query_latency = query_latency or LatencyModel()
+        self.row_error_rate = row_error_rate
+        self.rows = []
+        self.queries = []
+        self.bytes_received = 0
+        self._insert_ids = set()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def create_table(self, table, exists_ok=False):
+        return table
+
+    def get_table(self, table_id):
+        return table_id
+
+    def insert_rows_json(self, table_id, rows, row_ids=None, **kwargs):
+        self.insert_latency.sleep()
+        errors = []
+        accepted = []
+        with self._lock:
+            for index, row in enumerate(rows):
+                if self._random.random() < self.row_error_rate:
+                    errors.append({"index": index, "errors": [{"reason": "backendError", "message": "Simulated"}]})
+                else:
+                    accepted.append(row)
+            if errors:
+                # BigQuery rejects the whole request when any row fails; the other rows come back as stopped
+                failed = {error["index"] for error in errors}
+                errors += [{"index": index, "errors": [{"reason": "stopped"}]}
+                           for index in range(len(rows)) if index not in failed]
+                return errors
+            if row_ids is not None:
+                accepted = [row for row, row_id in zip(rows, row_ids) if row_id not in self._insert_ids]
+                self._insert_ids.update(row_ids)
+            self.rows.extend(accepted)
+            self.bytes_received += sum(len(json.dumps(row, default=str)) for row in accepted)
+        return []
+
+    def load_table_from_file(self, file_obj, table_id, job_config=None, **kwargs):
+        data = file_obj.read()
+        rows = [json.loads(line) for line in io.BytesIO(data).read().decode("utf-8").splitlines() if line]
+        with self._lock:
+            self.rows.extend(rows)
+            self.bytes_received += len(data)
+        return FakeJob(latency=self.insert_latency)
+
+    def query(self, query, job_config=None, **kwargs):
+        with self._lock:
+            self.queries.append(query)
+            rows = []
+            if "SELECT DISTINCT video_id" in query:
+                rows = [{"video_id": row["video_id"]} for row in self.rows]
+        return FakeJob(rows, self.query_latency)
@@ -0,0 +1,398 @@
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import pytz
+from google.cloud import bigquery
+from google.api_core.exceptions import BadRequest, NotFound
+from warehouse_writer import WarehouseWriter
+from metrics import RunMetrics
+from planner import fetch_analyzed_video_ids
+from query_guard import QueryGuard, job_statistics
+
+PROJECT_TIMEZONE = pytz.timezone('Asia/Jerusalem')
+MAX_CONCURRENT_QUERIES = 4
+
+# (table, PARTITION BY expression, partitioning column, CLUSTER BY columns) of the partitioned star schema tables
+PARTITIONED_TABLES = [
+    ("dim_video", "DATE(created_at)", "created_at", "video_id"),
+    ("fact_video_analytics", "analysis_date", "analysis_date", "video_id, user_id, lang_id"),
+]
+
+def query_job_config(query_parameters=None):
+    job_config = bigquery.QueryJobConfig()
+    job_config.use_legacy_sql = False
+    if query_parameters:
+        job_config.query_parameters = query_parameters
+    return job_config
+
+def execute_query(client, query, description, query_parameters=None, guard=None):
+    """Run one statement. With a `QueryGuard` it is dry-run against the run's byte budget first and its job
+    statistics go into the run metrics."""
+    job_config = query_job_config(query_parameters)
+    estimate = guard.admit(client, query, job_config, description) if guard is not None else None
+    run_statement(client, query, description, job_config, guard, estimate)
+
+def execute_queries(client, statements, guard=None):
+    """Run independent (query, description) statements concurrently.
+
+    Every statement passes the guard's budget check before any of them starts, so a run over budget changes
+    nothing.
+    """
+    job_configs = [query_job_config() for _ in statements]
+    estimates = [guard.admit(client, query, job_config, description) if guard is not None else None
+                 for (query, description), job_config in zip(statements, job_configs)]
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_QUERIES, len(statements))) as executor:
+        futures = [executor.submit(run_statement, client, query, description, job_config, guard, estimate)
+                   for (query, description), job_config, estimate in zip(statements, job_configs, estimates)]
+        for future in futures:
+            future.result()
+
+def run_statement(client, query, description, job_config, guard=None, estimated_bytes=None):
+    try:
+        job = client.query(query, job_config=job_config)
+        job.result()  # Wait for the job to complete
+    except BadRequest as e:
+        logging.error(f"Error in {description}: {e}")
+        raise
+    stats = guard.record(job, description, estimated_bytes) if guard is not None else job_statistics(
+        job, description, estimated_bytes)
+    logging.info(f"Successfully executed: {description} ({stats['bytes_billed'] or 0} bytes billed, "
+                 f"{stats['slot_ms'] or 0} slot-ms, cache hit: {stats['cache_hit']})")
+
+def migrate_partitioning(client, dataset, guard=None):
+    """Copy star schema tables created before they were partitioned (or partitioned differently) into tables
+    partitioned as declared in `PARTITIONED_TABLES`, under the same name.
+
+    BigQuery cannot replace a table with one partitioned differently, and `CREATE TABLE IF NOT EXISTS` leaves an
+    existing table as it is, so without this step a full rebuild fails and merges keep running on the old tables.
+    """
+    for name, partition_by, column, cluster_by in PARTITIONED_TABLES:
+        table_id = f"{dataset}.{name}"
+        try:
+            table = client.get_table(table_id)
+        except NotFound:
+            continue
+        if not isinstance(table, bigquery.Table):
+            continue  # The local and simulated warehouses have no partitioning
+        partitioning = table.time_partitioning
+        if partitioning is not None and partitioning.field == column and partitioning.type_ == "DAY":
+            continue
+
+        logging.info(f"Migrating {table_id} to a table partitioned by {partition_by}")
+        copy_query = f"""
+        CREATE OR REPLACE TABLE `{table_id}_partitioned`
+        PARTITION BY {partition_by}
+        CLUSTER BY {cluster_by} AS
+        SELECT * FROM `{table_id}`;
+        """
+        # One statement at a time, so the original is only dropped once its copy exists
+        execute_query(client, copy_query, f"Copy {name} into a partitioned table", guard=guard)
+        execute_query(client, f"DROP TABLE `{table_id}`;", f"Drop unpartitioned {name} table", guard=guard)
+        execute_query(client, f"ALTER TABLE `{table_id}_partitioned` RENAME TO {name};",
+                      f"Rename partitioned {name} table", guard=guard)
+
+def ensure_star_schema_tables(client, project_id, dataset_id, metadata_table_name, ai_table_id, guard=None):
+    dataset = f"{project_id}.{dataset_id}"
+    metadata_table = f"{dataset}.{metadata_table_name}"
+    migrate_partitioning(client, dataset, guard)
+
+    # Empty CTAS statements let BigQuery infer the metadata column types; existing tables are left untouched
+    dim_lang_query = f"""
+    CREATE TABLE IF NOT EXISTS `{dataset}.dim_lang`
+    CLUSTER BY lang AS
+    SELECT CAST(NULL AS INT64) as lang_id, lang, CURRENT_TIMESTAMP() as created_at
+    FROM `{metadata_table}` LIMIT 0;
+    """
+
+    dim_user_query = f"""
+    CREATE TABLE IF NOT EXISTS `{dataset}.dim_user`
+    CLUSTER BY user_id AS
+    SELECT user_id, user, user_nickname, user_signature, user_followers, user_videos, CURRENT_TIMESTAMP() as created_at
+    FROM `{metadata_table}` LIMIT 0;
+    """
+
+    dim_video_query = f"""
+    CREATE TABLE IF NOT EXISTS `{dataset}.dim_video`
+    PARTITION BY DATE(created_at)
+    CLUSTER BY video_id AS
+    SELECT CAST(m.id AS INT64) as video_id, m.text, m.gcs_path, CURRENT_TIMESTAMP() as created_at
+    FROM `{metadata_table}` m LIMIT 0;
+    """
+    execute_queries(client, [(dim_lang_query, "Ensure dim_lang table"), (dim_user_query, "Ensure dim_user table"),
+                             (dim_video_query, "Ensure dim_video table")], guard)
+
+    fact_table_query = f"""
+    CREATE TABLE IF NOT EXISTS `{dataset}.fact_video_analytics`
+    PARTITION BY analysis_date
+    CLUSTER BY video_id, user_id, lang_id AS
+    {fact_select(dataset, metadata_table, ai_table_id, "CURRENT_DATE()", "CURRENT_TIMESTAMP()")}
+    LIMIT 0;
+    """
+    # The fact table joins dim_lang, so it is ensured once the dimensions exist
+    execute_query(client, fact_table_query, "Ensure fact_video_analytics table", guard=guard)
+
+def fact_select(dataset, metadata_source, ai_source, analysis_date, created_at):
+    return f"""
+    SELECT 
+        CAST(m.id AS INT64) as video_id,
+        m.user_id,
+        l.lang_id,
+        m.createTimeISO,
+        m.duration,
+        m.video_likes,
+        m.video_shares,
+        m.video_plays,
+        m.video_bookmarks,
+        m.video_comments,
+        a.ai_unexpectedness_rating,
+        a.ai_unexpectedness_duration,
+        a.ai_expectation_violation_description,
+        a.ai_emotional_intensity,
+        a.ai_positivity,
+        a.ai_negativity,
+        a.ai_expected_desirability,
+        a.ai_unexpected_desirability,
+        a.ai_emotional_spatial_closeness,
+        a.ai_cognitive_interruption,
+        a.ai_perceived_realism,
+        a.ai_sexual_content_rating,
+        {analysis_date} as analysis_date,
+        {created_at} as created_at
+    FROM `{metadata_source}` m
+    JOIN `{ai_source}` a ON CAST(m.id AS INT64) = a.video_id
+    JOIN `{dataset}.dim_lang` l ON m.lang = l.lang"""
+
+def merge_dim_lang_query(dataset, metadata_source, current_timestamp):
+    # New languages are numbered after the current maximum so existing lang_id keys never change
+    return f"""
+    MERGE `{dataset}.dim_lang` t
+    USING (
+        SELECT
+            (SELECT IFNULL(MAX(lang_id), 0) FROM `{dataset}.dim_lang`) + ROW_NUMBER() OVER (ORDER BY n.lang) as lang_id,
+            n.lang
+        FROM (SELECT DISTINCT lang FROM `{metadata_source}` WHERE lang IS NOT NULL) n
+        WHERE NOT EXISTS (SELECT 1 FROM `{dataset}.dim_lang` d WHERE d.lang = n.lang)
+    ) s
+    ON t.lang = s.lang
+    WHEN NOT MATCHED THEN
+        INSERT (lang_id, lang, created_at) VALUES (s.lang_id, s.lang, TIMESTAMP('{current_timestamp}'));
+    """
+
+def ensure_ai_results_table(client, ai_table_id):
+    schema = [
+        bigquery.SchemaField("video_id", "INTEGER", mode="REQUIRED"),
+        bigquery.SchemaField("ai_unexpectedness_rating", "INTEGER"),  # text1
+        bigquery.SchemaField("ai_unexpectedness_duration", "INTEGER"),  # text2
+        bigquery.SchemaField("ai_expectation_violation_description", "STRING"),  # text3
+        bigquery.SchemaField("ai_emotional_intensity", "INTEGER"),  # text4
+        bigquery.SchemaField("ai_positivity", "INTEGER"),  # text5
+        bigquery.SchemaField("ai_negativity", "INTEGER"),  # text6
+        bigquery.SchemaField("ai_expected_desirability", "INTEGER"),  # text7
+        bigquery.SchemaField("ai_unexpected_desirability", "INTEGER"),  # text8
+        bigquery.SchemaField("ai_emotional_spatial_closeness", "INTEGER"),  # text9
+        bigquery.SchemaField("ai_cognitive_interruption", "INTEGER"),  # text10
+        bigquery.SchemaField("ai_perceived_realism", "INTEGER"),  # text11
+        bigquery.SchemaField("ai_sexual_content_rating", "INTEGER")  # text12
+    ]
+
+    table = bigquery.Table(ai_table_id, schema=schema)
+    table.clustering_fields = ["video_id"]  # Lets batch lookups by video_id prune blocks
+    return client.create_table(table, exists_ok=True)
+
+def ensure_consistency_table(client, consistency_table_id):
+    schema = [
+        bigquery.SchemaField("video_id", "INTEGER", mode="REQUIRED"),
+        bigquery.SchemaField("field", "STRING", mode="REQUIRED"),
+        bigquery.SchemaField("samples", "INTEGER"),
+        bigquery.SchemaField("mean", "FLOAT"),
+        bigquery.SchemaField("variance", "FLOAT"),
+        bigquery.SchemaField("agreement", "FLOAT"),
+    ]
+    table = bigquery.Table(consistency_table_id, schema=schema)
+    table.clustering_fields = ["video_id"]
+    return client.create_table(table, exists_ok=True)
+
+def insert_ai_results(client, ai_table_id, ai_results):
+    """Write the AI results and return the rows that made it into the table.
+
+    Consistency statistics of multi-sample analyses go to the `<ai_table_id>_consistency` table, one row per
+    video and field, for the rows written successfully.
+    """
+    rows = [{key: value for key, value in row.items() if key != 'consistency'} for row in ai_results]
+    report = WarehouseWriter(client, ai_table_id).write(rows)
+    failed_ids = {row['video_id'] for row in report["failed_rows"]}
+    written = [row for row in ai_results if row['video_id'] not in failed_ids]
+
+    consistency_rows = [dict(stats, video_id=row['video_id'])
+                        for row in written for stats in row.get('consistency') or []]
+    if consistency_rows:
+        consistency_table_id = f"{ai_table_id}_consistency"
+        ensure_consistency_table(client, consistency_table_id)
+        WarehouseWriter(client, consistency_table_id, key_fields=("video_id", "field")).write(consistency_rows)
+    return written
+
+def create_and_populate_tables(client, project_id, dataset_id, metadata_table_name, ai_results, full_rebuild=False,
+                               metrics=None, journal=None, guard=None):
+    """Load the AI results and maintain the star schema.
+
+    By default only the videos in `ai_results` are upserted, so the work done grows with the batch rather
+    than with the total history. `full_rebuild` recreates dim_user, dim_video and fact_video_analytics from
+    the full metadata and AI results tables. dim_lang is always merged so lang_id keys stay stable.
+    With a `RunJournal`, steps it records as completed are skipped, so a resumed run only redoes what is left.
+    Every statement goes through `guard` (a default `QueryGuard` only records job statistics in `metrics`).
+    """
+    metrics = metrics if metrics is not None else RunMetrics()
+    guard = guard if guard is not None else QueryGuard(metrics=metrics)
+    tables_ensured = False
+
+    # Create or use the permanent table for AI results
+    ai_table_id = f"{project_id}.{dataset_id}.ai_results"
+    ensure_ai_results_table(client, ai_table_id)
+
+    if journal is not None and journal.step_done("warehouse_write"):
+        video_ids = journal.steps["warehouse_write"]["video_ids"]
+    else:
+        already_written = []
+        if journal is not None:
+            # An interrupted earlier attempt of this run may have written part of the results already
+            loaded_ids = fetch_analyzed_video_ids(client, ai_table_id)
+            already_written = [row for row in ai_results if row['video_id'] in loaded_ids]
+            ai_results = [row for row in ai_results if row['video_id'] not in loaded_ids]
+
+        # Insert AI results into the AI results table while the star schema tables are ensured; neither needs the other
+        with ThreadPoolExecutor(max_workers=1) as executor, metrics.stage("warehouse_write"):
+            tables = executor.submit(ensure_star_schema_tables, client, project_id, dataset_id, metadata_table_name,
+                                     ai_table_id, guard)
+            written = insert_ai_results(client, ai_table_id, ai_results) if ai_results else []
+        tables.result()
+        tables_ensured = True
+        if not written and not already_written:
+            logging.error("No AI results were written. The star schema was not updated.")
+            return
+
+        video_ids = sorted({row['video_id'] for row in written + already_written})
+        if journal is not None:
+            journal.record_step("warehouse_write", video_ids=video_ids)
+
+    if journal is not None and journal.step_done("star_schema"):
+        logging.info("Star schema already updated for this run")
+        return
+    with metrics.stage("star_schema"):
+        update_star_schema(client, project_id, dataset_id, metadata_table_name, video_ids, full_rebuild, guard,
+                           ensure_tables=not tables_ensured)
+    if journal is not None:
+        journal.record_step("star_schema")
+
+def update_star_schema(client, project_id, dataset_id, metadata_table_name, video_ids, full_rebuild=False, guard=None,
+                       ensure_tables=True):
+    current_time = datetime.now(PROJECT_TIMEZONE)
+    current_date = current_time.date()
+    current_timestamp = current_time.isoformat()
+    dataset = f"{project_id}.{dataset_id}"
+    metadata_table = f"{dataset}.{metadata_table_name}"
+    ai_table_id = f"{dataset}.ai_results"
+
+    if ensure_tables:
+        ensure_star_schema_tables(client, project_id, dataset_id, metadata_table_name, ai_table_id, guard)
+
+    if full_rebuild:
+        rebuild_star_schema(client, dataset, metadata_table, ai_table_id, current_date, current_timestamp, guard)
+    else:
+        merge_star_schema(client, dataset, metadata_table, ai_table_id, video_ids, current_date, current_timestamp,
+                          guard)
+
+    logging.info(f"Star schema populated with data from {metadata_table_name} and AI results")
+
+def rebuild_star_schema(client, dataset, metadata_table, ai_table_id, current_date, current_timestamp, guard=None):
+    # Merge dim_lang over the full metadata table so existing lang_id keys are kept
+    dim_lang_query = merge_dim_lang_query(dataset, metadata_table, current_timestamp)
+
+    # Create dim_user table
+    dim_user_query = f"""
+    CREATE OR REPLACE TABLE `{dataset}.dim_user`
+    CLUSTER BY user_id AS
+    SELECT DISTINCT user_id, user, user_nickname, user_signature, user_followers, user_videos, TIMESTAMP('{current_timestamp}') as created_at
+    FROM `{metadata_table}`;
+    """
+
+    # Create dim_video table - Updated to use video_id instead of id
+    dim_video_query = f"""
+    CREATE OR REPLACE TABLE `{dataset}.dim_video`
+    PARTITION BY DATE(created_at)
+    CLUSTER BY video_id AS
+    SELECT 
+        CAST(m.id AS INT64) as video_id, 
+        m.text, 
+        m.gcs_path, 
+        TIMESTAMP('{current_timestamp}') as created_at
+    FROM `{metadata_table}` m
+    JOIN `{ai_table_id}` a ON CAST(m.id AS INT64) = a.video_id;
+    """
+    # The dimensions are independent of each other; the fact table joins dim_lang and waits for it
+    execute_queries(client, [(dim_lang_query, "Merge dim_lang table"), (dim_user_query, "Create dim_user table"),
+                             (dim_video_query, "Create dim_video table")], guard)
+
+    # Create fact_video_analytics table - Updated to use video_id
+    fact_table_query = f"""
+    CREATE OR REPLACE TABLE `{dataset}.fact_video_analytics`
+    PARTITION BY analysis_date
+    CLUSTER BY video_id, user_id, lang_id AS
+    {fact_select(dataset, metadata_table, ai_table_id, f"DATE('{current_date}')", f"TIMESTAMP('{current_timestamp}')")};
+    """
+    execute_query(client, fact_table_query, "Create fact_video_analytics table", guard=guard)
+
+def merge_star_schema(client, dataset, metadata_table, ai_table_id, video_ids, current_date, current_timestamp,
+                      guard=None):
+    # Metadata and AI rows for the batch are read once into temp tables; every MERGE then works on those
+    merge_script = f"""
+    CREATE TEMP TABLE batch_metadata AS
+    SELECT * FROM `{metadata_table}`
+    WHERE CAST(id AS INT64) IN UNNEST(@video_ids)
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY CAST(id AS INT64) ORDER BY createTimeISO DESC) = 1;
+
+    CREATE TEMP TABLE batch_ai_results AS
+    SELECT * FROM `{ai_table_id}`
+    WHERE video_id IN UNNEST(@video_ids)
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY video_id) = 1;
+
+    BEGIN TRANSACTION;
+
+    {merge_dim_lang_query(dataset, "batch_metadata", current_timestamp)}
+
+    MERGE `{dataset}.dim_user` t
+    USING (
+        SELECT user_id, user, user_nickname, user_signature, user_followers, user_videos
+        FROM batch_metadata
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY createTimeISO DESC) = 1
+    ) s
+    ON t.user_id = s.user_id
+    WHEN MATCHED THEN
+        UPDATE SET user = s.user, user_nickname = s.user_nickname, user_signature = s.user_signature,
+                   user_followers = s.user_followers, user_videos = s.user_videos
+    WHEN NOT MATCHED THEN
+        INSERT (user_id, user, user_nickname, user_signature, user_followers, user_videos, created_at)
+        VALUES (s.user_id, s.user, s.user_nickname, s.user_signature, s.user_followers, s.user_videos,
+                TIMESTAMP('{current_timestamp}'));
+
+    MERGE `{dataset}.dim_video` t
+    USING (
+        SELECT CAST(m.id AS INT64) as video_id, m.text, m.gcs_path
+        FROM batch_metadata m
+        JOIN batch_ai_results a ON CAST(m.id AS INT64) = a.video_id
+    ) s
+    ON t.video_id = s.video_id
+    WHEN MATCHED THEN
+        UPDATE SET text = s.text, gcs_path = s.gcs_path
+    WHEN NOT MATCHED THEN
+        INSERT (video_id, text, gcs_path, created_at)
+        VALUES (s.video_id, s.text, s.gcs_path, TIMESTAMP('{current_timestamp}'));
+
+    DELETE FROM `{dataset}.fact_video_analytics` WHERE video_id IN UNNEST(@video_ids);
+
+    INSERT INTO `{dataset}.fact_video_analytics`
+    {fact_select(dataset, "batch_metadata", "batch_ai_results", f"DATE('{current_date}')", f"TIMESTAMP('{current_timestamp}')")};
+
+    COMMIT TRANSACTION;
+    """
+    execute_query(client, merge_script, f"Merge star schema for {len(video_ids)} videos",
+                  query_parameters=[bigquery.ArrayQueryParameter("video_ids", "INT64", video_ids)], guard=guard)
@@ -0,0 +1,165 @@
+import os
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from video_processor import extract_video_id
+
+DEFAULT_QUEUE_SIZE = 64  # Items buffered between stages before the upstream stage blocks
+DEFAULT_BATCH_SIZE = 500  # Rows per warehouse flush
+DEFAULT_FLUSH_INTERVAL = 30.0  # Seconds before a partial batch is flushed anyway
+RECENT_IDS_WINDOW = 100_000  # Listed video_ids remembered to skip copies of a video listed shortly before
+
+_DONE = object()  # Marks the end of a stage's output
+
+
+class MicroBatchSink:
+    """Collects rows and hands them to `flush_fn` once `batch_size` rows are buffered or `flush_interval` passes."""
+
+    def __init__(self, flush_fn, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.flush_fn = flush_fn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rows = []
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.failed = False  # The last flush raised; its rows were handed to flush_fn and are not retried
+        self._last_flush = time.monotonic()
+
+    def time_until_flush(self):
+        return max(0.0, self._last_flush + self.flush_interval - time.monotonic())
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush_if_due(self):
+        if self.rows and self.time_until_flush() == 0.0:
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self.rows:
+            return
+        rows, self.rows = self.rows, []
+        self.failed = True
+        self.flush_fn(rows)
+        self.failed = False
+        self.flushed_rows += len(rows)
+        self.flushes += 1
+        logging.info(f"Flushed {len(rows)} rows to the warehouse ({self.flushed_rows} so far)")
+
+
+class RecentIds:
+    """The last `window` ids added, for membership tests in constant memory."""
+
+    def __init__(self, window=RECENT_IDS_WINDOW):
+        self._order = deque()
+        self._ids = set()
+        self.window = window
+
+    def __contains__(self, video_id):
+        return video_id in self._ids
+
+    def add(self, video_id):
+        self._order.append(video_id)
+        self._ids.add(video_id)
+        if len(self._order) > self.window:
+            self._ids.discard(self._order.popleft())
+
+
+def _produce(blob_pages, work_queue, analyzed_ids, stats, num_workers, stop_event):
+    # Videos analyzed by earlier runs are in analyzed_ids; this only catches copies listed within the same stretch
+    seen_ids = RecentIds()
+    try:
+        for page in blob_pages:
+            for blob in page:
+                if stop_event.is_set():
+                    return
+                stats["listed"] += 1
+                video_id = extract_video_id(os.path.basename(blob["name"]))
+                if video_id is None or video_id in analyzed_ids or video_id in seen_ids:
+                    stats["skipped"] += 1
+                    continue
+                seen_ids.add(video_id)
+                work_queue.put(blob)  # Blocks while the analyzers are behind
+    except Exception as e:
+        logging.exception(f"Error listing videos: {e}")
+    finally:
+        for _ in range(num_workers):
+            work_queue.put(_DONE)
+
+
+def _consume(work_queue, result_queue, analyze_fn):
+    while True:
+        blob = work_queue.get()
+        if blob is _DONE:
+            result_queue.put(_DONE)
+            return
+        result_queue.put((blob, analyze_fn(blob)))  # Blocks while the sink is behind
+
+
+def run_streaming_pipeline(blob_pages, analyze_fn, flush_fn, analyzed_ids=frozenset(), max_workers=8,
+                           queue_size=DEFAULT_QUEUE_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                           flush_interval=DEFAULT_FLUSH_INTERVAL):
+    """Stream videos from a lazy listing through the analyzers into micro-batched warehouse writes.
+
+    `blob_pages` yields lists of blob metadata (see `gcs_utils.iter_gcs_blob_pages`), `analyze_fn` turns one blob
+    into an analysis or None, and `flush_fn` receives each micro-batch of rows. Both queues are bounded and
+    nothing is kept per video once it is flushed, so memory stays flat regardless of how many videos the listing
+    holds. Returns the run counters.
+    """
+    work_queue = queue.Queue(maxsize=queue_size)
+    result_queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    stats = {"listed": 0, "skipped": 0, "analyzed": 0, "failed": 0}
+
+    sink = MicroBatchSink(flush_fn, batch_size, flush_interval)
+    producer = threading.Thread(target=_produce, name="gcs-lister", daemon=True,
+                                args=(blob_pages, work_queue, analyzed_ids, stats, max_workers, stop_event))
+    workers = [
+        threading.Thread(target=_consume, name=f"analyzer-{i}", daemon=True,
+                         args=(work_queue, result_queue, analyze_fn))
+        for i in range(max_workers)
+    ]
+    producer.start()
+    for worker in workers:
+        worker.start()
+
+    finished_workers = 0
+    try:
+        while finished_workers < max_workers:
+            try:
+                item = result_queue.get(timeout=sink.time_until_flush() if sink.rows else None)
+            except queue.Empty:
+                sink.flush_if_due()
+                continue
+
+            if item is _DONE:
+                finished_workers += 1
+                continue
+
+            blob, analysis = item
+            if analysis is None:
+                stats["failed"] += 1
+            else:
+                stats["analyzed"] += 1
+                sink.add(analysis)
+            sink.flush_if_due()
+    except BaseException:
+        stop_event.set()
+        if not sink.failed:
+            # Keep what was already analyzed, without hiding the original error
+            try:
+                sink.flush()
+            except Exception as e:
+                logging.exception(f"Final flush after a pipeline error failed: {e}")
+        raise
+    sink.flush()
+
+    stats["flushed"] = sink.flushed_rows
+    stats["flushes"] = sink.flushes
+    logging.info(f"Streaming pipeline finished: {stats}")
+    return stats
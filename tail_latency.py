@@ -0,0 +1,174 @@
+import time
+import logging
+import statistics
+import threading
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from google.api_core import exceptions
+from metrics import RunMetrics, percentile
+
+DEFAULT_REQUEST_TIMEOUT = 600  # Seconds before a model call is abandoned
+DEFAULT_HEDGE_PERCENTILE = None  # Hedging sends duplicate billed requests, so it is opt-in (e.g. 0.95)
+LATENCY_WINDOW = 200  # Recent call latencies the hedge delay is computed from
+MIN_LATENCY_SAMPLES = 20  # No hedging until this many calls have succeeded
+
+
+class LatencyTracker:
+    """Rolling window of recent successful call latencies."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q, min_samples=MIN_LATENCY_SAMPLES):
+        """The q-th percentile of the window, or None while there are fewer than `min_samples` latencies."""
+        with self._lock:
+            samples = sorted(self._samples)
+        return percentile(samples, q) if len(samples) >= min_samples else None
+
+
+class HedgedCaller:
+    """Runs calls with a deadline, optionally sending a duplicate when one runs longer than most recent calls did.
+
+    With `hedge_percentile`, a call still running after that latency of the recent window gets one duplicate, and
+    the first of the two to succeed wins. Past `timeout` seconds the call raises `DeadlineExceeded`. Python threads
+    cannot be interrupted, so every attempt runs on its own daemon thread: losing and timed-out attempts finish
+    in the background (or never) without holding up later calls, and `on_discarded` receives their responses
+    (e.g. to still account for their tokens).
+    """
+
+    def __init__(self, timeout=DEFAULT_REQUEST_TIMEOUT, hedge_percentile=DEFAULT_HEDGE_PERCENTILE, metrics=None,
+                 on_discarded=None):
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.on_discarded = on_discarded
+        self.latencies = LatencyTracker()
+
+    def call(self, fn, *args, admit=None):
+        """Return `fn(*args)`, hedged and bounded by the deadline.
+
+        `admit(timeout)` gates each attempt on a shared resource such as a quota slot. It waits up to `timeout`
+        seconds (None: without limit) and returns a `(run, release)` pair, or None if nothing was free in time:
+        `run` sends the attempt holding what was taken and `release` gives it back should the attempt be abandoned.
+        Waiting for the first attempt's admission counts toward the deadline, so a call never waits forever for a
+        resource held by hung calls, and the hedge clock starts once it is sent. A hedge is only sent if it is
+        admitted without waiting, so hedging never adds to a queue for the resource.
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout if self.timeout else None
+        release = None
+        if admit is not None:
+            admitted = admit(self.timeout or None)
+            if admitted is None:
+                self.metrics.increment("deadline_exceeded")
+                raise exceptions.DeadlineExceeded(f"Model call was not admitted within {self.timeout} seconds")
+            fn, release = admitted
+        attempts = {self._start(fn, *args): release}
+
+        hedge_delay = self.latencies.percentile(self.hedge_percentile) if self.hedge_percentile else None
+        hedge_at = time.monotonic() + hedge_delay if hedge_delay is not None else None
+        hedge = None
+        pending = set(attempts)
+        error = None
+
+        while pending:
+            wake_times = [t for t in (deadline, hedge_at) if t is not None]
+            timeout = max(0.0, min(wake_times) - time.monotonic()) if wake_times else None
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                self._abandon(pending, attempts)
+                if future is hedge:
+                    self.metrics.increment("hedge_wins")
+                return result
+
+            now = time.monotonic()
+            if pending and deadline is not None and now >= deadline:
+                self._abandon(pending, attempts)
+                self.metrics.increment("deadline_exceeded")
+                raise exceptions.DeadlineExceeded(f"Model call did not finish within {self.timeout} seconds")
+            if pending and hedge_at is not None and now >= hedge_at:
+                hedge_at = None  # At most one hedge per call
+                hedge_fn, hedge_release = fn, None
+                if admit is not None:
+                    admitted = admit(0)
+                    if admitted is None:
+                        self.metrics.increment("hedges_not_admitted")
+                        continue
+                    hedge_fn, hedge_release = admitted
+                logging.info(f"Call still running after {hedge_delay:.1f}s "
+                             f"(p{int(self.hedge_percentile * 100)}), hedging with a duplicate")
+                self.metrics.increment("hedged_requests")
+                hedge = self._start(hedge_fn, *args)
+                attempts[hedge] = hedge_release
+                pending.add(hedge)
+        raise error
+
+    def _start(self, fn, *args):
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def attempt():
+            try:
+                future.set_result(self._timed(fn, *args))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=attempt, name="model-call", daemon=True).start()
+        return future
+
+    def _timed(self, fn, *args):
+        start = time.monotonic()
+        result = fn(*args)
+        self.latencies.observe(time.monotonic() - start)
+        return result
+
+    def _abandon(self, futures, attempts):
+        for future in futures:
+            if attempts[future] is not None:
+                attempts[future]()  # An attempt that may never return must not keep its slot
+            future.add_done_callback(self._discarded)
+
+    def _discarded(self, future):
+        if self.on_discarded is not None and future.exception() is None:
+            self.on_discarded(future.result())
+
+
+def order_by_expected_duration(video_files, durations=None, blob_metadata=None):
+    """Indexes of `video_files`, longest expected video first (longest-processing-time-first scheduling).
+
+    The expected length is the known duration, else the blob size converted at the median bytes per second of
+    the videos where both are known (or the size alone when no duration is known at all). Videos with neither
+    take the median expected length. Ties keep the listing order.
+    """
+    durations = durations or {}
+    blob_metadata = blob_metadata or {}
+    sizes = {video_file: blob_metadata[video_file].get("size") for video_file in video_files
+             if blob_metadata.get(video_file, {}).get("size")}
+    rates = [sizes[video_file] / durations[video_file] for video_file in sizes if durations.get(video_file)]
+    bytes_per_second = statistics.median(rates) if rates else None
+    any_duration = any(durations.get(video_file) for video_file in video_files)
+
+    def expected(video_file):
+        if durations.get(video_file):
+            return durations[video_file]
+        if video_file in sizes and bytes_per_second:
+            return sizes[video_file] / bytes_per_second
+        if video_file in sizes and not any_duration:
+            return sizes[video_file]  # Sizes only compare with each other
+        return None
+
+    expected_lengths = [expected(video_file) for video_file in video_files]
+    known = [length for length in expected_lengths if length is not None]
+    fallback = statistics.median(known) if known else 0
+    return sorted(range(len(video_files)),
+                  key=lambda index: -(expected_lengths[index] if expected_lengths[index] is not None else fallback))
@@ -0,0 +1,75 @@
+from analysis_cache import AnalysisCache
+from metrics import RunMetrics
+from simulated_backends import FakeGenerativeModel, synthetic_analysis
+from video_processor import generate
+
+BUCKET = "test-bucket"
+VIDEO_FILES = [f"TIKTOK_samples/2024-01-01/{7300000000000000000 + index}.mp4" for index in range(20)]
+
+
+def run_generate(model, cache, blob_metadata, metrics=None):
+    return generate(VIDEO_FILES, BUCKET, model=model, cache=cache, blob_metadata=blob_metadata, metrics=metrics,
+                    request_timeout=None, hedge_percentile=None)
+
+
+def test_unchanged_videos_are_served_from_the_cache(tmp_path):
+    blob_metadata = {video_file: {"name": video_file, "md5_hash": f"md5-{index}"}
+                     for index, video_file in enumerate(VIDEO_FILES)}
+    cache = AnalysisCache(str(tmp_path / "analysis_cache.sqlite"))
+    model = FakeGenerativeModel(seed=5)
+    try:
+        first = run_generate(model, cache, blob_metadata)
+        assert model.calls == len(VIDEO_FILES)
+
+        # A re-uploaded video has a new md5 and misses; every other video hits
+        changed = VIDEO_FILES[0]
+        blob_metadata[changed] = dict(blob_metadata[changed], md5_hash="md5-reuploaded")
+        metrics = RunMetrics()
+        second = run_generate(model, cache, blob_metadata, metrics)
+    finally:
+        cache.close()
+
+    assert model.calls == len(VIDEO_FILES) + 1
+    assert metrics.summary()["counters"]["cache_hits"] == len(VIDEO_FILES) - 1
+    assert second[1:] == first[1:]
+
+
+def test_a_different_generation_config_misses_the_cache(tmp_path):
+    blob_metadata = {video_file: {"name": video_file, "md5_hash": f"md5-{index}"}
+                     for index, video_file in enumerate(VIDEO_FILES)}
+    cache = AnalysisCache(str(tmp_path / "analysis_cache.sqlite"))
+    model = FakeGenerativeModel(seed=6)
+    try:
+        run_generate(model, cache, blob_metadata)
+        generate(VIDEO_FILES, BUCKET, temperature=0.7, model=model, cache=cache, blob_metadata=blob_metadata,
+                 request_timeout=None, hedge_percentile=None)
+    finally:
+        cache.close()
+
+    assert model.calls == 2 * len(VIDEO_FILES)
+
+
+def test_analyses_with_missing_fields_are_not_cached(tmp_path):
+    blob_metadata = {video_file: {"name": video_file, "md5_hash": f"md5-{index}"}
+                     for index, video_file in enumerate(VIDEO_FILES)}
+    cache = AnalysisCache(str(tmp_path / "analysis_cache.sqlite"))
+    # The model never answers one of the fields, not even when it is asked again on its own
+    model = FakeGenerativeModel(payload_fn=lambda rng: dict(synthetic_analysis(rng), ai_positivity="N/A"), seed=7)
+    try:
+        run_generate(model, cache, blob_metadata)
+        assert model.calls == 2 * len(VIDEO_FILES)  # Every analysis plus its repair request
+        second = run_generate(model, cache, blob_metadata)
+    finally:
+        cache.close()
+
+    assert model.calls == 4 * len(VIDEO_FILES)
+    assert all(analysis["ai_positivity"] is None for analysis in second)
+
+
+def test_repair_can_be_turned_off():
+    model = FakeGenerativeModel(payload_fn=lambda rng: dict(synthetic_analysis(rng), ai_positivity="N/A"), seed=8)
+
+    results = generate(VIDEO_FILES, BUCKET, model=model, repair=False, request_timeout=None, hedge_percentile=None)
+
+    assert model.calls == len(VIDEO_FILES)
+    assert len(results) == len(VIDEO_FILES)
@@ -0,0 +1,61 @@
+import json
+from batch_prediction import write_batch_requests, parse_batch_output_files
+
+BUCKET = "test-bucket"
+VIDEO_FILES = [f"TIKTOK_samples/2024-01-01/{7300000000000000000 + index}.mp4" for index in range(3)]
+
+
+def batch_output_line(request_line, texts=None, status=None):
+    """What Vertex AI writes for one request: the request echoed back with its response or error status."""
+    record = json.loads(request_line)
+    if status:
+        record["status"] = status
+    else:
+        record["response"] = {"candidates": [{"content": {"parts": [{"text": text}]}} for text in texts]}
+    return json.dumps(record) + "\n"
+
+
+def answer(rating):
+    return json.dumps({"ai_unexpectedness_rating": str(rating), "ai_positivity": "N/A",
+                       "ai_expectation_violation_description": "We expect X. Instead Y happens."})
+
+
+def test_batch_requests_round_trip_through_parsed_output(tmp_path):
+    requests_path = tmp_path / "requests.jsonl"
+    assert write_batch_requests(VIDEO_FILES, BUCKET, str(requests_path)) == len(VIDEO_FILES)
+    request_lines = requests_path.read_text(encoding="utf-8").splitlines()
+
+    output_path = tmp_path / "predictions.jsonl"
+    output_path.write_text(
+        batch_output_line(request_lines[0], [answer(4)])
+        + batch_output_line(request_lines[1], status="Internal error")
+        + batch_output_line(request_lines[2], ["not json"])
+        + "{truncated\n",
+        encoding="utf-8")
+
+    results = list(parse_batch_output_files([str(output_path)]))
+
+    assert [analysis["video_id"] for analysis in results] == [7300000000000000000]
+    assert results[0]["ai_unexpectedness_rating"] == 4
+    assert results[0]["ai_positivity"] is None
+    assert results[0]["ai_expectation_violation_description"] == "We expect X. Instead Y happens."
+
+
+def test_derivatives_and_samples_map_back_to_the_original_video(tmp_path):
+    derivative_uri = f"gs://{BUCKET}/TIKTOK_samples/2024-01-01/7300000000000000000.preprocessed.480p.0123abcd.mp4"
+    requests_path = tmp_path / "requests.jsonl"
+    write_batch_requests(VIDEO_FILES[:1], BUCKET, str(requests_path), video_uris={VIDEO_FILES[0]: derivative_uri},
+                         candidate_count=3)
+    request_line = requests_path.read_text(encoding="utf-8").splitlines()[0]
+    request = json.loads(request_line)["request"]
+    assert request["contents"][0]["parts"][0]["fileData"]["fileUri"] == derivative_uri
+    assert request["generationConfig"]["candidateCount"] == 3
+
+    output_path = tmp_path / "predictions.jsonl"
+    output_path.write_text(batch_output_line(request_line, [answer(4), answer(4), answer(2)]), encoding="utf-8")
+    (analysis,) = parse_batch_output_files([str(output_path)])
+
+    assert analysis["video_id"] == 7300000000000000000
+    rating = next(stats for stats in analysis["consistency"] if stats["field"] == "ai_unexpectedness_rating")
+    assert rating["samples"] == 3
+    assert rating["agreement"] == 2 / 3
@@ -0,0 +1,67 @@
+import json
+import random
+import pytest
+from simulated_backends import FakeBigQueryClient, FakeResponse, FakeUsageMetadata, synthetic_analysis
+from star_schema import insert_ai_results
+from video_processor import INTEGER_FIELDS, consistency_stats, generate
+
+FIELD = INTEGER_FIELDS[0]
+VIDEO_FILES = [f"TIKTOK_samples/2024-01-01/{7300000000000000000 + index}.mp4" for index in range(3)]
+TABLE_ID = "project.tiktok_data.ai_results"
+
+
+class SamplingModel:
+    """Returns one candidate per answer in `answers`, each giving `FIELD` that answer."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = 0
+
+    def generate_content(self, contents, generation_config=None, **kwargs):
+        self.calls += 1
+        candidates = []
+        for answer in self.answers:
+            payload = dict(synthetic_analysis(random.Random(0)), **{FIELD: answer})
+            candidates.append(FakeResponse(json.dumps(payload), None))
+        response = FakeResponse(None, FakeUsageMetadata(1000, 400 * len(candidates)))
+        response.candidates = candidates
+        return response
+
+
+def test_consistency_statistics_per_field():
+    stats = {row["field"]: row for row in consistency_stats([{FIELD: 1}, {FIELD: 3}, {FIELD: 3}, {FIELD: None}])}
+
+    assert stats[FIELD]["samples"] == 3
+    assert stats[FIELD]["mean"] == pytest.approx(7 / 3)
+    assert stats[FIELD]["variance"] == pytest.approx(8 / 9)
+    assert stats[FIELD]["agreement"] == pytest.approx(2 / 3)
+    assert stats[INTEGER_FIELDS[1]] == {"field": INTEGER_FIELDS[1], "samples": 0, "mean": None, "variance": None,
+                                       "agreement": None}
+
+
+def test_each_video_is_sampled_in_one_request():
+    model = SamplingModel(["4", "2", "4"])
+
+    results = generate(VIDEO_FILES, "test-bucket", model=model, candidate_count=3, request_timeout=None)
+
+    assert model.calls == len(VIDEO_FILES)
+    for analysis in results:
+        assert analysis[FIELD] == 4  # The first sample provides the stored answer
+        stats = {row["field"]: row for row in analysis["consistency"]}
+        assert stats[FIELD]["samples"] == 3 and stats[FIELD]["agreement"] == pytest.approx(2 / 3)
+
+
+def test_consistency_rows_are_written_for_the_results_written():
+    model = SamplingModel(["4", "2", "4"])
+    results = generate(VIDEO_FILES, "test-bucket", model=model, candidate_count=3, request_timeout=None)
+    client = FakeBigQueryClient()
+
+    written = insert_ai_results(client, TABLE_ID, results)
+
+    assert len(written) == len(VIDEO_FILES)
+    result_rows = [row for row in client.rows if "field" not in row]
+    consistency_rows = [row for row in client.rows if "field" in row]
+    assert all("consistency" not in row for row in result_rows) and len(result_rows) == len(VIDEO_FILES)
+    assert len(consistency_rows) == len(VIDEO_FILES) * len(INTEGER_FIELDS)
+    assert {(row["video_id"], row["field"]) for row in consistency_rows} == {
+        (analysis["video_id"], field) for analysis in results for field in INTEGER_FIELDS}
@@ -0,0 +1,76 @@
+import random
+from dedup import (HashBandIndex, FrameHashIndex, MAX_MEAN_DISTANCE, find_duplicates, orphaned_duplicates,
+                   reuse_duplicate_analyses)
+
+FOLDER = "TIKTOK_samples/2024-01-01/"
+
+
+def random_fingerprint(rng, frames=8):
+    return [rng.getrandbits(64) for _ in range(frames)]
+
+
+def flip_bits(hashes, rng, bits_per_frame):
+    """A copy of `hashes` with `bits_per_frame` random bits flipped in every frame, as a re-encode would."""
+    flipped = []
+    for frame_hash in hashes:
+        for bit in rng.sample(range(64), bits_per_frame):
+            frame_hash ^= 1 << bit
+        flipped.append(frame_hash)
+    return flipped
+
+
+def test_near_copies_are_found_and_unrelated_videos_are_not():
+    rng = random.Random(1)
+    index = HashBandIndex()
+    fingerprints = {video_id: random_fingerprint(rng) for video_id in range(200)}
+    for video_id, hashes in fingerprints.items():
+        index.add(video_id, hashes)
+
+    assert index.find(flip_bits(fingerprints[42], rng, 3)) == (42, 3.0)
+    assert index.find(flip_bits(fingerprints[42], rng, MAX_MEAN_DISTANCE + 4)) is None
+    assert index.find(random_fingerprint(rng)) is None
+
+
+def test_the_closest_of_several_matches_wins():
+    rng = random.Random(2)
+    original = random_fingerprint(rng)
+    index = HashBandIndex()
+    index.add(1, flip_bits(original, rng, 5))
+    index.add(2, flip_bits(original, rng, 1))
+
+    assert index.find(original)[0] == 2
+
+
+def test_duplicates_match_indexed_videos_before_earlier_videos_of_the_batch(tmp_path):
+    rng = random.Random(3)
+    original, batch_original = random_fingerprint(rng), random_fingerprint(rng)
+    index = FrameHashIndex(str(tmp_path / "frame_hashes.sqlite"))
+    try:
+        index.add(100, original, {"ai_positivity": 4})
+        fingerprints = {
+            f"{FOLDER}200.mp4": flip_bits(original, rng, 2),  # Copy of the indexed video
+            f"{FOLDER}300.mp4": batch_original,
+            f"{FOLDER}301.mp4": flip_bits(batch_original, rng, 2),  # Copy of an earlier file of the batch
+        }
+        duplicates = find_duplicates(index, fingerprints)
+    finally:
+        index.close()
+
+    assert {video_file: original_id for video_file, (original_id, _) in duplicates.items()} == {
+        f"{FOLDER}200.mp4": 100, f"{FOLDER}301.mp4": 300}
+
+
+def test_a_duplicate_of_an_original_that_failed_is_analyzed_itself(tmp_path):
+    index = FrameHashIndex(str(tmp_path / "frame_hashes.sqlite"))
+    duplicates = {f"{FOLDER}301.mp4": (300, 1.0), f"{FOLDER}401.mp4": (400, 2.0)}
+    analyses = {400: {"video_id": 400, "ai_positivity": 2}}  # 300 failed, 400 was analyzed
+    try:
+        assert orphaned_duplicates(index, duplicates, analyses) == [f"{FOLDER}301.mp4"]
+
+        analyses[301] = {"video_id": 301, "ai_positivity": 5}  # The fallback analysis of the duplicate
+        assert orphaned_duplicates(index, duplicates, analyses) == []
+        reused = reuse_duplicate_analyses(index, duplicates, analyses)
+    finally:
+        index.close()
+
+    assert reused == [{"video_id": 401, "ai_positivity": 2}]
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+from fact_analytics import (FACT_COLUMNS, bootstrap_ci, correlation_matrix, engagement_kpis, engagement_report,
+                            grouped_summary, load_fact_data)
+from simulated_backends import FakeJob
+
+
+class FactTableClient:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+
+    def query(self, query, **kwargs):
+        self.queries += 1
+        return FakeJob(self.rows)
+
+
+def fact_rows(count, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for index in range(count):
+        row = {column: int(rng.integers(1, 6)) for column in FACT_COLUMNS}
+        row.update(video_id=index, lang_id=index % 3, video_plays=int(rng.integers(0, 1000)),
+                   user_followers=None if index % 7 == 0 else int(rng.integers(1, 10000)))
+        rows.append(row)
+    return rows
+
+
+def test_pairwise_complete_correlations_match_numpy_on_the_shared_rows():
+    rng = np.random.default_rng(1)
+    a = rng.normal(size=200)
+    b = a + rng.normal(size=200)
+    c = rng.normal(size=200)
+    b[:20] = np.nan
+    c[150:] = np.nan
+
+    names, _, matrix = correlation_matrix({"a": a, "b": b, "c": c})
+
+    assert names == ["a", "b", "c"]
+    for i, x in enumerate((a, b, c)):
+        for j, y in enumerate((a, b, c)):
+            shared = ~(np.isnan(x) | np.isnan(y))
+            assert matrix[i, j] == pytest.approx(np.corrcoef(x[shared], y[shared])[0, 1])
+
+
+def test_spearman_is_one_for_a_monotonic_relation_with_ties():
+    x = np.array([1.0, 2.0, 2.0, 3.0, 5.0, np.nan, 8.0])
+    y = np.exp(x)
+
+    _, _, matrix = correlation_matrix({"x": x}, {"y": y}, method="spearman")
+
+    assert matrix[0, 0] == pytest.approx(1.0)
+    assert correlation_matrix({"x": x}, {"y": y})[2][0, 0] < 1.0
+
+
+def test_kpis_are_nan_where_there_is_nothing_to_divide_by():
+    data = {column: np.array([2.0, 1.0, 4.0]) for column in FACT_COLUMNS}
+    data["video_plays"] = np.array([10.0, 0.0, np.nan])
+
+    assert np.allclose(engagement_kpis(data)["like_rate"], [0.2, np.nan, np.nan], equal_nan=True)
+
+
+def test_grouped_summary_ignores_missing_keys_and_values():
+    keys = np.array([1, 1, 2, np.nan, 2, 2])
+    values = np.array([1.0, 3.0, 5.0, 100.0, np.nan, 7.0])
+
+    summary = grouped_summary(keys, {"value": values})
+
+    assert list(summary) == [1, 2]
+    assert summary[1]["value"] == {"count": 2, "mean": 2.0, "std": pytest.approx(np.std([1, 3], ddof=1))}
+    assert summary[2]["value"] == {"count": 2, "mean": 6.0, "std": pytest.approx(np.std([5, 7], ddof=1))}
+
+
+def test_bootstrap_interval_surrounds_the_estimate_and_is_repeatable():
+    values = np.append(np.random.default_rng(2).normal(10, 2, 500), np.nan)
+
+    estimate, low, high = bootstrap_ci(values, n_resamples=500)
+
+    assert low < estimate < high and estimate == pytest.approx(np.nanmean(values))
+    assert bootstrap_ci(values, n_resamples=500) == (estimate, low, high)
+
+
+def test_the_export_is_reused_until_it_goes_stale(tmp_path):
+    path = str(tmp_path / "facts.npz")
+    client = FactTableClient(fact_rows(50))
+
+    data = load_fact_data(client, "project.dataset", path)
+    load_fact_data(client, "project.dataset", path)
+    assert client.queries == 1
+    assert np.isnan(data["user_followers"][0]) and data["video_id"].tolist() == list(range(50))
+
+    load_fact_data(client, "project.dataset", path, max_age_hours=0)
+    assert client.queries == 2
+    assert load_fact_data(path=path, max_age_hours=0)["video_id"].tolist() == list(range(50))
+
+
+def test_the_report_has_every_section():
+    data = {column: np.array([row[column] for row in fact_rows(60)], dtype=np.float64) for column in FACT_COLUMNS}
+
+    report = engagement_report(data, n_resamples=200)
+
+    assert report["rows"] == 60
+    assert set(report["by_lang_id"]) == {0, 1, 2}
+    assert set(report["unexpectedness_vs_engagement_rate_ci"]) == {"estimate", "low", "high"}
+    assert set(report["pearson_correlations"]["ai_unexpectedness_rating"]) == set(engagement_kpis(data))
@@ -0,0 +1,47 @@
+import threading
+import pytest
+import gcs_utils
+from gcs_utils import is_video_blob, iter_folders_blob_pages, list_gcs_files, select_folders
+from simulated_backends import FakeStorageClient
+
+BUCKET_NAME = "test-bucket"
+BASE_PREFIX = "TIKTOK_samples/"
+FOLDERS = {"2024-01-01": 5, "2024-01-02": 7, "2024-01-03": 3}
+
+
+@pytest.fixture
+def storage_client(monkeypatch):
+    client = FakeStorageClient(FOLDERS, BASE_PREFIX)
+    monkeypatch.setattr(gcs_utils, "get_storage_client", lambda: client)
+    return client
+
+
+def test_folders_are_selected_explicitly_by_date_range_or_latest(storage_client):
+    assert select_folders(BUCKET_NAME, BASE_PREFIX) == ["2024-01-03"]
+    assert select_folders(BUCKET_NAME, BASE_PREFIX, start_date="2024-01-02") == ["2024-01-03", "2024-01-02"]
+    assert select_folders(BUCKET_NAME, BASE_PREFIX, end_date="2024-01-01") == ["2024-01-01"]
+    assert select_folders(BUCKET_NAME, BASE_PREFIX, folders=["2023-12-31"]) == ["2023-12-31"]
+
+
+def test_several_folders_are_listed_in_pages(storage_client):
+    pages = list(iter_folders_blob_pages(BUCKET_NAME, BASE_PREFIX, list(FOLDERS), max_workers=2, page_size=2))
+
+    assert all(len(page) <= 2 for page in pages)
+    assert sorted(blob["name"] for page in pages for blob in page) == sorted(
+        name for names in storage_client.names.values() for name in names)
+    assert list_gcs_files(BUCKET_NAME, f"{BASE_PREFIX}2024-01-01/") == storage_client.names["2024-01-01"]
+
+
+def test_stopping_early_releases_the_listers(storage_client):
+    pages = iter_folders_blob_pages(BUCKET_NAME, BASE_PREFIX, list(FOLDERS), max_workers=1, page_size=1)
+    next(pages)
+    pages.close()  # Listers blocked on the full page queue must exit so the pool can shut down
+
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith("ThreadPoolExecutor")
+                and thread.is_alive() and thread is not threading.current_thread()]
+
+
+def test_derivatives_and_other_files_are_not_videos():
+    assert is_video_blob("TIKTOK_samples/2024-01-01/1.MP4")
+    assert not is_video_blob("TIKTOK_samples/2024-01-01/1.preprocessed.480p.abcd.mp4")
+    assert not is_video_blob("TIKTOK_samples/2024-01-01/notes.txt")
@@ -0,0 +1,85 @@
+import json
+import pytest
+from google.api_core.exceptions import BadRequest, NotFound
+from google.cloud import bigquery
+from local_warehouse import split_statements, to_duckdb_sql
+from planner import fetch_video_durations
+
+pytest.importorskip("duckdb")
+from local_warehouse import LocalWarehouseClient  # noqa: E402
+
+PROJECT = "project"
+METADATA_TABLE_ID = f"{PROJECT}.tiktok_data.tiktok_videos_metadata"
+SCORES_TABLE_ID = f"{PROJECT}.tiktok_data.scores"
+
+
+@pytest.fixture
+def client():
+    client = LocalWarehouseClient(":memory:", PROJECT)
+    client.create_table(bigquery.Table(SCORES_TABLE_ID, schema=[
+        bigquery.SchemaField("video_id", "INTEGER", mode="REQUIRED"),
+        bigquery.SchemaField("score", "INTEGER"),
+    ]))
+    yield client
+    client.close()
+
+
+def test_bigquery_sql_is_translated():
+    sql = to_duckdb_sql(
+        "CREATE TABLE IF NOT EXISTS `p.ds.t`\n"
+        "PARTITION BY DATE(created_at)\n"
+        "CLUSTER BY video_id\n"
+        "AS SELECT CAST(id AS INT64) AS id, TIMESTAMP('2024-01-01') AS at FROM `tmp` WHERE id IN UNNEST(@ids)",
+        {"ids": "BIGINT"})
+
+    assert '"ds"."t"' in sql and '"tmp"' in sql and "PARTITION BY" not in sql and "CLUSTER BY" not in sql
+    assert "CAST(id AS BIGINT)" in sql and "CAST('2024-01-01' AS TIMESTAMPTZ)" in sql
+    assert "IN (SELECT UNNEST(from_json($ids, '[\"BIGINT\"]')))" in sql
+    assert to_duckdb_sql("MERGE `p.ds.t` T USING s") == 'MERGE INTO "ds"."t" T USING s'
+    assert split_statements("SELECT 1;\nSELECT ';';\n") == ["SELECT 1", "SELECT ';'"]
+
+
+def test_streamed_rows_ignore_unknown_keys_and_report_invalid_ones(client):
+    assert client.insert_rows_json(SCORES_TABLE_ID, [{"video_id": 1, "score": 3, "extra": "x"}]) == []
+    errors = client.insert_rows_json(SCORES_TABLE_ID, [{"video_id": 2, "score": "high"}])
+
+    assert [error["errors"][0]["reason"] for error in errors] == ["invalid"]
+    rows = client.query(f"SELECT video_id, score FROM `{SCORES_TABLE_ID}`").result()
+    assert [(row.video_id, row.score) for row in rows] == [(1, 3)]
+
+
+def test_missing_tables_raise_not_found(client):
+    with pytest.raises(NotFound):
+        client.get_table(f"{PROJECT}.tiktok_data.missing")
+    with pytest.raises(NotFound):
+        client.query(f"SELECT * FROM `{PROJECT}.tiktok_data.missing`")
+
+
+def test_a_failed_script_is_rolled_back_and_drops_its_temp_tables(client):
+    client.insert_rows_json(SCORES_TABLE_ID, [{"video_id": 1, "score": 3}])
+    script = f"""
+    BEGIN TRANSACTION;
+    CREATE TEMP TABLE staged AS SELECT video_id, score + 1 AS score FROM `{SCORES_TABLE_ID}`;
+    DELETE FROM `{SCORES_TABLE_ID}` WHERE TRUE;
+    SELECT * FROM no_such_table;
+    COMMIT TRANSACTION;
+    """
+
+    with pytest.raises((BadRequest, NotFound)):
+        client.query(script)
+
+    assert [row.score for row in client.query(f"SELECT score FROM `{SCORES_TABLE_ID}`").result()] == [3]
+    client.query(f"CREATE TEMP TABLE staged AS SELECT * FROM `{SCORES_TABLE_ID}`")  # Dropped with its script
+
+
+def test_source_tables_load_from_files_and_answer_parameterized_queries(client, tmp_path):
+    path = tmp_path / "metadata.ndjson"
+    path.write_text("".join(json.dumps({"id": str(video_id), "duration": video_id * 10}) + "\n"
+                            for video_id in (1, 2, 3)))
+
+    assert client.load_file(METADATA_TABLE_ID, str(path)) == 3
+    durations = fetch_video_durations(client, METADATA_TABLE_ID, ["folder/1.mp4", "folder/3.mp4", "folder/4.mp4"])
+
+    assert durations == {"folder/1.mp4": 10, "folder/3.mp4": 30}
+    exported = client.export_table(METADATA_TABLE_ID, str(tmp_path / "metadata.parquet"))
+    assert client.load_file(f"{PROJECT}.copy.metadata", exported) == 3
@@ -0,0 +1,45 @@
+from google.api_core.exceptions import NotFound
+from planner import VideoIdSet, fetch_analyzed_video_ids, plan_video_files
+from simulated_backends import FakeBigQueryClient
+
+FOLDER = "TIKTOK_samples/2024-01-01/"
+TABLE_ID = "project.dataset.ai_results"
+
+
+class MissingTableClient:
+    def query(self, query, **kwargs):
+        raise NotFound(f"Not found: Table {TABLE_ID}")
+
+
+def test_video_id_set_membership():
+    ids = VideoIdSet([7300000000000000003, 5, 5, 1, 9])
+
+    assert len(ids) == 4
+    assert [video_id in ids for video_id in (0, 1, 4, 5, 9, 10, 7300000000000000003)] == [
+        False, True, False, True, True, False, True]
+    assert 1 not in VideoIdSet()
+
+
+def test_plan_skips_analyzed_duplicate_and_invalid_files():
+    video_files = [f"{FOLDER}1.mp4", f"{FOLDER}2.mp4", f"{FOLDER}Copy of 2.mp4", f"{FOLDER}3.mp4",
+                   f"{FOLDER}notes.mp4"]
+
+    planned, skipped = plan_video_files(video_files, VideoIdSet([3]))
+
+    assert planned == [f"{FOLDER}1.mp4", f"{FOLDER}2.mp4"]
+    assert skipped == {f"{FOLDER}Copy of 2.mp4": "duplicate_id", f"{FOLDER}3.mp4": "already_analyzed",
+                       f"{FOLDER}notes.mp4": "invalid_id"}
+
+
+def test_analyzed_ids_are_fetched_in_one_query():
+    client = FakeBigQueryClient()
+    client.rows = [{"video_id": 2}, {"video_id": 1}, {"video_id": 2}]
+
+    analyzed = fetch_analyzed_video_ids(client, TABLE_ID)
+
+    assert len(client.queries) == 1
+    assert len(analyzed) == 2 and 1 in analyzed and 2 in analyzed
+
+
+def test_a_missing_results_table_means_nothing_was_analyzed():
+    assert len(fetch_analyzed_video_ids(MissingTableClient(), TABLE_ID)) == 0
@@ -0,0 +1,94 @@
+import base64
+import hashlib
+import preprocess
+from gcs_utils import is_video_blob
+from metrics import RunMetrics
+from preprocess import (derivative_name, ffmpeg_command, preprocess_video, preprocess_videos, preprocessing_report,
+                        settings_tag)
+from rate_limiter import VIDEO_TOKENS_PER_SECOND
+
+SETTINGS = {"max_height": 480, "fps": 1, "max_seconds": 60}
+MD5 = base64.b64encode(hashlib.md5(b"video").digest()).decode()
+BLOB = {"name": "TIKTOK_samples/2024-01-01/7300000000000000000.mp4", "size": 8000000, "md5_hash": MD5}
+
+
+class FakeStorageObject:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.size = bucket.objects.get(name)
+        self.md5_hash, self.crc32c, self.generation = "derivative-md5", None, 1
+
+    def exists(self):
+        return self.name in self.bucket.objects
+
+    def reload(self):
+        self.size = self.bucket.objects[self.name]
+
+    def download_to_filename(self, path):
+        self.bucket.downloads.append(self.name)
+
+
+class FakeBucket:
+    def __init__(self, objects):
+        self.objects = objects
+        self.downloads = []
+
+    def blob(self, name):
+        return FakeStorageObject(self, name)
+
+
+class FakeClient:
+    def __init__(self, bucket):
+        self._bucket = bucket
+
+    def bucket(self, name):
+        return self._bucket
+
+
+def test_derivatives_are_named_after_the_original_settings_and_source_md5():
+    name = derivative_name(BLOB, SETTINGS)
+
+    assert name == ("TIKTOK_samples/2024-01-01/7300000000000000000.preprocessed.480p-1fps-60s."
+                    f"{hashlib.md5(b'video').hexdigest()[:16]}.mp4")
+    assert not is_video_blob(name)  # Never listed as a video of its own
+    assert derivative_name(dict(BLOB, md5_hash=None), SETTINGS) is None
+    assert settings_tag({}) == "copy"
+
+
+def test_ffmpeg_trims_before_filtering_and_never_upscales():
+    command = ffmpeg_command("in.mp4", "out.mp4", SETTINGS)
+
+    assert command[command.index("-t") + 1] == "60"
+    assert command[command.index("-vf") + 1] == "scale=-2:'min(480,ih)',fps=1"
+    assert command[-1] == "out.mp4"
+    assert "-t" not in ffmpeg_command("in.mp4", "out.mp4", {"max_height": 480})
+
+
+def test_an_existing_derivative_is_reused_without_downloading_the_original(monkeypatch):
+    bucket = FakeBucket({derivative_name(BLOB, SETTINGS): 1200000})
+    monkeypatch.setattr(preprocess, "get_storage_client", lambda: FakeClient(bucket))
+
+    derivative = preprocess_video("bucket", BLOB, SETTINGS)
+
+    assert derivative["name"] == derivative_name(BLOB, SETTINGS)
+    assert derivative["size"] == 1200000
+    assert bucket.downloads == []
+
+
+def test_videos_without_an_md5_keep_their_original_in_spawned_workers():
+    metrics = RunMetrics()
+
+    derivatives = preprocess_videos("bucket", [dict(BLOB, md5_hash=None)], SETTINGS, max_workers=1, metrics=metrics)
+
+    assert derivatives == {}
+    assert metrics.summary()["counters"]["preprocess_videos"] == 0
+
+
+def test_only_trimming_lowers_the_estimated_tokens():
+    derivatives = {BLOB["name"]: {"name": derivative_name(BLOB, SETTINGS), "size": 2000000}}
+
+    report = preprocessing_report([BLOB], derivatives, SETTINGS, {BLOB["name"]: 90})
+
+    assert report["bytes_saved"] == 6000000
+    assert report["estimated_tokens_before"] - report["estimated_tokens_after"] == 30 * VIDEO_TOKENS_PER_SECOND
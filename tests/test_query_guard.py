@@ -0,0 +1,71 @@
+import pytest
+from google.api_core.exceptions import BadRequest
+from metrics import RunMetrics
+from query_guard import QueryBudgetExceeded, QueryGuard
+from simulated_backends import FakeJob
+from star_schema import execute_queries, execute_query
+
+
+class EstimatingClient:
+    """Dry runs estimate `bytes_per_query[query]` (BadRequest for None); real runs are recorded and bill that much."""
+
+    def __init__(self, bytes_per_query):
+        self.bytes_per_query = bytes_per_query
+        self.dry_runs = []
+        self.executed = []
+
+    def query(self, query, job_config=None, **kwargs):
+        size = self.bytes_per_query[query]
+        if job_config.dry_run:
+            if size is None:
+                raise BadRequest("Query cannot be estimated")
+            self.dry_runs.append(query)
+        else:
+            self.executed.append(query)
+        job = FakeJob()
+        job.total_bytes_processed = job.total_bytes_billed = size
+        return job
+
+
+def test_a_statement_over_the_budget_is_never_started():
+    client = EstimatingClient({"small": 400, "large": 700})
+    guard = QueryGuard(max_bytes=1000)
+
+    execute_query(client, "small", "small merge", guard=guard)
+    with pytest.raises(QueryBudgetExceeded):
+        execute_query(client, "large", "large merge", guard=guard)
+
+    assert client.executed == ["small"] and client.dry_runs == ["small", "large"]
+    assert guard.estimated_bytes == 400
+
+
+def test_concurrent_statements_are_all_checked_before_any_starts():
+    client = EstimatingClient({"a": 400, "b": 400, "c": 400})
+
+    with pytest.raises(QueryBudgetExceeded):
+        execute_queries(client, [("a", "a"), ("b", "b"), ("c", "c")], guard=QueryGuard(max_bytes=1000))
+
+    assert client.executed == []
+
+
+def test_a_statement_that_cannot_be_estimated_runs_only_without_a_budget():
+    client = EstimatingClient({"unestimated": None})
+
+    with pytest.raises(QueryBudgetExceeded):
+        execute_query(client, "unestimated", "merge", guard=QueryGuard(max_bytes=10 ** 12))
+    assert client.executed == []
+    execute_query(client, "unestimated", "merge", guard=QueryGuard(dry_run=True))
+    assert client.executed == ["unestimated"]
+
+
+def test_job_statistics_go_into_the_run_metrics():
+    client = EstimatingClient({"merge": 300})
+    metrics = RunMetrics()
+
+    execute_query(client, "merge", "dim_video merge", guard=QueryGuard(max_bytes=1000, metrics=metrics))
+    execute_query(client, "merge", "dim_video merge", guard=QueryGuard(metrics=metrics))
+
+    counters = metrics.summary()["counters"]
+    assert counters["bigquery_jobs"] == 2 and counters["bigquery_bytes_billed"] == 600
+    assert counters["bigquery_estimated_bytes"] == 300
+    assert len(client.dry_runs) == 1  # Without a budget or dry_run, statements are not estimated
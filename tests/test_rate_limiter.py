@@ -0,0 +1,105 @@
+import pytest
+from google.api_core import exceptions
+import rate_limiter
+from rate_limiter import AdaptiveConcurrencyLimiter, QuotaScheduler, TokenBucket
+
+
+class FakeClock:
+    """Stands in for the `time` module so budget refills and waits take no real time."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    return clock
+
+
+def test_the_bucket_enforces_both_budgets_and_refills(clock):
+    bucket = TokenBucket(rpm=2, tpm=1000)
+
+    assert bucket.try_acquire(400) == 0.0
+    assert bucket.try_acquire(400) == 0.0
+    assert bucket.try_acquire(100) == pytest.approx(30.0)  # Out of requests: one comes back every 30 s
+    clock.sleep(30)
+    assert bucket.try_acquire(800) == pytest.approx(6.0)  # A request is back, but only 700 tokens
+    clock.sleep(6)
+    assert bucket.try_acquire(800) == 0.0
+
+
+def test_acquire_waits_for_the_budget_or_gives_up_at_the_timeout(clock):
+    bucket = TokenBucket(rpm=60, tpm=1000)
+    bucket.try_acquire(1000)
+
+    assert bucket.acquire(500, timeout=10) is None
+    assert clock.now == 1000.0  # Gave up without sleeping, as the wait was known to be too long
+    assert bucket.acquire(500) == pytest.approx(30.0)
+
+
+def test_real_usage_corrects_the_token_budget(clock):
+    bucket = TokenBucket(rpm=100, tpm=1000)
+    bucket.try_acquire(800)
+    bucket.adjust(-600)  # The request used 200 tokens, not 800
+
+    assert bucket.try_acquire(800) == 0.0
+
+
+def test_buckets_sharing_a_state_file_share_the_budget(clock, tmp_path):
+    state_path = str(tmp_path / "quota.json")
+    first, second = TokenBucket(rpm=2, tpm=10 ** 6, state_path=state_path), TokenBucket(2, 10 ** 6, state_path)
+
+    assert first.try_acquire(1) == 0.0
+    assert second.try_acquire(1) == 0.0
+    assert first.try_acquire(1) > 0
+
+
+def test_the_concurrency_limit_grows_additively_and_halves_on_throttling():
+    limiter = AdaptiveConcurrencyLimiter(initial=4, minimum=1, maximum=5)
+    for _ in range(4):
+        assert limiter.acquire(timeout=0)
+    assert not limiter.acquire(timeout=0)
+
+    for _ in range(4):
+        limiter.release()
+    assert limiter.limit == pytest.approx(5.0, abs=0.1)  # About one slot per window of successes
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.limit == 5.0
+
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.limit == 2.5
+    for _ in range(3):
+        limiter.acquire()
+        limiter.release(throttled=True)
+    assert limiter.limit == 1.0
+
+
+def test_a_throttled_request_lowers_the_limit_and_an_abandoned_one_does_not(clock):
+    scheduler = QuotaScheduler(rpm=100, tpm=10 ** 6, initial_concurrency=4)
+
+    with pytest.raises(exceptions.ResourceExhausted):
+        with scheduler.slot(1000):
+            raise exceptions.ResourceExhausted("Quota exceeded")
+    assert scheduler.stats()["throttled"] == 1 and scheduler.stats()["concurrency_limit"] == 2
+
+    slot = scheduler.slot(1000)
+    slot.abandon()
+    slot.abandon()
+    assert scheduler.concurrency.in_flight == 0
+    with slot:
+        slot.actual_tokens = 200  # Finishing late still corrects the tokens but frees nothing more
+    assert scheduler.concurrency.in_flight == 0 and scheduler.stats()["concurrency_limit"] == 2
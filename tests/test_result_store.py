@@ -0,0 +1,97 @@
+import os
+import numpy as np
+from result_store import ResultStore, ID_DTYPE
+from video_processor import INTEGER_FIELDS
+
+
+def analysis(video_id, score=3, description="We expect X. Instead Y happens."):
+    return {"video_id": video_id, **{field: score for field in INTEGER_FIELDS},
+            "ai_expectation_violation_description": description}
+
+
+def scores(store, video_ids):
+    return {row["video_id"]: row["ai_positivity"] for row in store.lookup(video_ids)}
+
+
+def test_lookups_return_the_latest_analysis_of_each_video(tmp_path):
+    store = ResultStore(str(tmp_path))
+    expected = {}
+    rng = np.random.default_rng(0)
+    for batch in range(30):
+        video_ids = rng.integers(0, 200, rng.integers(1, 40)).tolist()
+        store.append([analysis(video_id, batch) for video_id in video_ids])
+        expected.update({video_id: batch for video_id in video_ids})
+
+    reopened = ResultStore(str(tmp_path))
+    assert scores(reopened, range(300)) == expected
+    assert {row["video_id"]: row["ai_positivity"] for row in reopened.to_columns()} == expected
+    assert 12345 not in reopened
+
+
+def test_nulls_and_text_round_trip(tmp_path):
+    store = ResultStore(str(tmp_path))
+    row = analysis(7, description="Überraschung")
+    row["ai_positivity"] = None
+    store.append([row, analysis(8, description=None)])
+
+    assert store.get(7) == row
+    assert store.get(8)["ai_expectation_violation_description"] is None
+    assert store.get(9) is None
+
+
+def test_an_uncommitted_append_is_discarded(tmp_path):
+    store = ResultStore(str(tmp_path))
+    store.append([analysis(1, 1), analysis(2, 2)])
+
+    # A crash mid-append leaves column and index data past the committed rows, but meta.json unchanged
+    with open(tmp_path / "video_id.i8", "ab") as f:
+        f.write(np.arange(100, 105, dtype=ID_DTYPE).tobytes())
+    with open(tmp_path / "ai_positivity.i4", "ab") as f:
+        f.write(b"\xff" * 12)
+    (tmp_path / "index.2-7.i8").write_bytes(b"\x00" * 17)
+
+    recovered = ResultStore(str(tmp_path))
+    assert len(recovered) == 2
+    assert 100 not in recovered
+
+    recovered.append([analysis(3, 3)])
+    reopened = ResultStore(str(tmp_path))
+    assert scores(reopened, [1, 2, 3, 100]) == {1: 1, 2: 2, 3: 3}
+    assert os.path.getsize(tmp_path / "video_id.i8") == 3 * ID_DTYPE.itemsize
+    assert not (tmp_path / "index.2-7.i8").exists()
+
+
+def test_a_damaged_index_segment_is_rebuilt(tmp_path):
+    store = ResultStore(str(tmp_path))
+    store.append([analysis(video_id, video_id % 5) for video_id in range(50)])
+    for name in os.listdir(tmp_path):
+        if name.startswith("index."):
+            with open(tmp_path / name, "r+b") as f:
+                f.truncate(8)
+
+    assert scores(ResultStore(str(tmp_path)), range(50)) == {video_id: video_id % 5 for video_id in range(50)}
+
+
+def test_appends_keep_a_logarithmic_number_of_index_segments(tmp_path):
+    store = ResultStore(str(tmp_path))
+    for batch in range(64):
+        store.append([analysis(batch * 10 + offset) for offset in range(10)])
+
+    assert len(store._segments) <= 8
+    assert len(store) == 640
+    assert len(store.lookup(range(640))) == 640
+
+def test_text_is_read_from_the_mapped_heap(tmp_path, monkeypatch):
+    store = ResultStore(str(tmp_path))
+    store.append([analysis(1, description="first"), analysis(2, description=None)])
+    # Torn heap bytes from an interrupted append are cut off by the next one
+    with open(tmp_path / "ai_expectation_violation_description.heap", "ab") as f:
+        f.write(b"garbage")
+    store.append([analysis(3, description="third")])
+
+    def no_open(*args, **kwargs):
+        raise AssertionError("text() opened a file")
+
+    monkeypatch.setattr("builtins.open", no_open)
+    texts = [row["ai_expectation_violation_description"] for row in store.lookup([1, 2, 3])]
+    assert texts == ["first", None, "third"]
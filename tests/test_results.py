@@ -0,0 +1,66 @@
+import pytest
+from results import RESULT_FIELDS, STRING_FIELDS, ResultColumns, load_parquet
+from star_schema import ensure_ai_results_table
+from video_processor import INTEGER_FIELDS, process_analysis
+
+TEXT_FIELD = STRING_FIELDS[0]
+TABLE_ID = "project.tiktok_data.ai_results"
+
+
+def analyses():
+    first = {"video_id": 1, **{field: 3 for field in INTEGER_FIELDS}, **{field: "text" for field in STRING_FIELDS}}
+    second = process_analysis({field: "N/A" for field in INTEGER_FIELDS + STRING_FIELDS})
+    second["video_id"] = 7300000000000000002
+    return [first, second]
+
+
+def test_unparseable_answers_become_nulls():
+    processed = process_analysis({INTEGER_FIELDS[0]: "4", INTEGER_FIELDS[1]: "N/A", TEXT_FIELD: "N/A"})
+
+    assert processed[INTEGER_FIELDS[0]] == 4
+    assert processed[INTEGER_FIELDS[1]] is None and processed[INTEGER_FIELDS[2]] is None
+    assert processed[TEXT_FIELD] is None
+
+
+def test_columns_round_trip_rows_with_nulls():
+    columns = ResultColumns.from_analyses(analyses())
+
+    assert list(columns) == analyses()
+    assert columns.column(INTEGER_FIELDS[0]) == [3, None]
+    assert columns.column("video_id") == [1, 7300000000000000002]
+    assert [record.as_dict() for record in columns.records()] == analyses()
+
+
+def test_consistency_statistics_stay_with_their_row():
+    rows = analyses()
+    rows[1]["consistency"] = {INTEGER_FIELDS[0]: {"samples": 3, "agreement": 1.0}}
+    columns = ResultColumns.from_analyses(rows)
+
+    assert "consistency" not in columns.row(0)
+    assert columns.row(1)["consistency"] == rows[1]["consistency"]
+
+
+def test_parquet_export_keeps_types_and_nulls(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = ResultColumns.from_analyses(analyses()).write_parquet(str(tmp_path / "results.parquet"))
+
+    table = pq.read_table(path)
+    assert table.column_names == RESULT_FIELDS
+    assert str(table.schema.field(INTEGER_FIELDS[0]).type) == "int64"
+    assert table.to_pylist() == analyses()
+
+
+def test_a_parquet_export_loads_into_the_results_table(tmp_path):
+    pytest.importorskip("pyarrow")
+    pytest.importorskip("duckdb")
+    from local_warehouse import LocalWarehouseClient
+
+    client = LocalWarehouseClient(str(tmp_path / "warehouse.duckdb"), "project")
+    ensure_ai_results_table(client, TABLE_ID)
+    path = ResultColumns.from_analyses(analyses()).write_parquet(str(tmp_path / "results.parquet"))
+
+    load_parquet(client, TABLE_ID, path)
+
+    rows = list(client.query(f"SELECT video_id, {INTEGER_FIELDS[0]} AS score FROM `{TABLE_ID}` ORDER BY video_id")
+                .result())
+    assert [(row.video_id, row.score) for row in rows] == [(1, 3), (7300000000000000002, None)]
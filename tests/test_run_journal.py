@@ -0,0 +1,64 @@
+import json
+from run_journal import RunJournal
+from simulated_backends import FakeBigQueryClient
+from star_schema import create_and_populate_tables
+
+PLAN = {"folders": ["2024-01-01"], "video_blobs": []}
+
+
+def test_a_reopened_journal_replays_the_run(tmp_path):
+    journal = RunJournal("run-1", str(tmp_path))
+    journal.record_plan(PLAN)
+    journal.record_analysis({"video_id": 1, "ai_positivity": 2})
+    journal.record_analysis({"video_id": 1, "ai_positivity": 4})
+    journal.record_step("analysis", videos=1)
+    journal.close()
+
+    replayed = RunJournal("run-1", str(tmp_path))
+    assert replayed.plan == PLAN
+    assert replayed.analyses == {1: {"video_id": 1, "ai_positivity": 4}}
+    assert replayed.step_done("analysis") and replayed.steps["analysis"] == {"videos": 1}
+    assert not replayed.step_done("star_schema")
+
+
+def test_torn_and_malformed_lines_are_skipped(tmp_path):
+    journal = RunJournal("run-1", str(tmp_path))
+    journal.record_plan(PLAN)
+    journal.close()
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"plan": "no type"}) + "\n")
+        f.write(json.dumps({"type": "analysis"}) + "\n")
+        f.write("[1, 2]\n")
+        f.write('{"type": "analysis", "analysis": {"video_')  # Torn by a crash
+
+    journal = RunJournal("run-1", str(tmp_path))
+    journal.record_analysis({"video_id": 2})
+    journal.close()
+
+    replayed = RunJournal("run-1", str(tmp_path))
+    assert replayed.plan == PLAN
+    assert replayed.analyses == {2: {"video_id": 2}}
+
+
+def test_steps_completed_before_a_crash_are_skipped(tmp_path):
+    journal = RunJournal("run-1", str(tmp_path))
+    journal.record_step("warehouse_write", video_ids=[1, 2])
+    journal.record_step("star_schema")
+    client = FakeBigQueryClient()
+
+    create_and_populate_tables(client, "project", "dataset", "metadata", [{"video_id": 3}], journal=journal)
+
+    assert client.rows == [] and client.queries == []
+
+
+def test_a_resumed_run_updates_the_star_schema_for_the_journaled_videos(tmp_path):
+    journal = RunJournal("run-1", str(tmp_path))
+    journal.record_step("warehouse_write", video_ids=[1, 2])
+    client = FakeBigQueryClient()
+
+    create_and_populate_tables(client, "project", "dataset", "metadata", [{"video_id": 3}], journal=journal)
+
+    assert client.rows == []
+    assert client.queries and journal.step_done("star_schema")
+    journal.close()
+    assert RunJournal("run-1", str(tmp_path)).step_done("star_schema")
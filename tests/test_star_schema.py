@@ -0,0 +1,105 @@
+import json
+import random
+import pytest
+from google.cloud import bigquery
+from simulated_backends import synthetic_analysis, synthetic_metadata_rows
+from star_schema import ensure_ai_results_table, insert_ai_results, update_star_schema
+from video_processor import process_analysis
+
+pytest.importorskip("duckdb")
+from local_warehouse import LocalWarehouseClient  # noqa: E402
+
+PROJECT_ID = "test-project"
+DATASET_ID = "tiktok_data"
+METADATA_TABLE = "tiktok_videos_metadata"
+VIDEO_IDS = [7300000000000000000 + index for index in range(60)]
+
+
+@pytest.fixture
+def warehouse(tmp_path):
+    client = LocalWarehouseClient(":memory:", PROJECT_ID)
+    # A user's profile is the same on every one of their videos, so dim_user doesn't depend on the merge order
+    rows = [dict(row, user_followers=row["user_id"] * 100, user_videos=row["user_id"] + 1)
+            for row in synthetic_metadata_rows(VIDEO_IDS, seed=1)]
+    metadata_path = tmp_path / "metadata.ndjson"
+    metadata_path.write_text("".join(json.dumps(row) + "\n" for row in rows), encoding="utf-8")
+    client.load_file(f"{PROJECT_ID}.{DATASET_ID}.{METADATA_TABLE}", str(metadata_path))
+    yield client
+    client.close()
+
+
+def load_analyses(client, video_ids, seed):
+    rng = random.Random(seed)
+    ai_table_id = f"{PROJECT_ID}.{DATASET_ID}.ai_results"
+    ensure_ai_results_table(client, ai_table_id)
+    analyses = [dict(process_analysis(synthetic_analysis(rng)), video_id=video_id) for video_id in video_ids]
+    assert len(insert_ai_results(client, ai_table_id, analyses)) == len(analyses)
+
+
+def table_contents(client):
+    contents = {}
+    for table, key in (("dim_lang", "lang_id"), ("dim_user", "user_id"), ("dim_video", "video_id"),
+                       ("fact_video_analytics", "video_id")):
+        rows = client.query(f"SELECT * EXCLUDE (created_at) FROM `{PROJECT_ID}.{DATASET_ID}.{table}` "
+                            f"ORDER BY {key}").result()
+        contents[table] = [dict(row) for row in rows]
+    return contents
+
+
+def merge(client, video_ids):
+    update_star_schema(client, PROJECT_ID, DATASET_ID, METADATA_TABLE, video_ids)
+
+
+def test_merging_the_same_videos_twice_changes_nothing(warehouse):
+    load_analyses(warehouse, VIDEO_IDS, seed=2)
+    merge(warehouse, VIDEO_IDS)
+    first = table_contents(warehouse)
+    merge(warehouse, VIDEO_IDS)
+
+    assert table_contents(warehouse) == first
+    fact_ids = [row["video_id"] for row in first["fact_video_analytics"]]
+    assert sorted(fact_ids) == VIDEO_IDS
+
+
+def test_incremental_merges_match_one_merge_of_everything(warehouse):
+    load_analyses(warehouse, VIDEO_IDS[:30], seed=3)
+    merge(warehouse, VIDEO_IDS[:30])
+    load_analyses(warehouse, VIDEO_IDS[30:], seed=4)
+    merge(warehouse, VIDEO_IDS[30:])
+    incremental = table_contents(warehouse)
+    merge(warehouse, VIDEO_IDS)
+
+    assert table_contents(warehouse) == incremental
+    assert len(incremental["fact_video_analytics"]) == len(VIDEO_IDS)
+    assert [row["lang_id"] for row in incremental["dim_lang"]] == list(range(1, len(incremental["dim_lang"]) + 1))
+
+
+def test_tables_from_before_partitioning_are_migrated_once_without_losing_rows(warehouse, monkeypatch):
+    load_analyses(warehouse, VIDEO_IDS, seed=5)
+    merge(warehouse, VIDEO_IDS)
+    before = table_contents(warehouse)
+
+    # DuckDB has no partitioning, so the tables are reported as BigQuery reports the baseline's unpartitioned ones
+    partitioning = {}
+
+    def get_table(table_id):
+        table = bigquery.Table(table_id)
+        table.time_partitioning = partitioning.get(table_id.rsplit(".", 1)[1])
+        return table
+
+    queries = []
+    run_query = warehouse.query
+    monkeypatch.setattr(warehouse, "get_table", get_table)
+    monkeypatch.setattr(warehouse, "query", lambda query, job_config=None: queries.append(query) or run_query(
+        query, job_config))
+    merge(warehouse, VIDEO_IDS)
+
+    assert sum("RENAME TO" in query for query in queries) == 2
+    assert table_contents(warehouse) == before
+
+    partitioning.update(dim_video=bigquery.TimePartitioning(field="created_at"),
+                        fact_video_analytics=bigquery.TimePartitioning(field="analysis_date"))
+    queries.clear()
+    merge(warehouse, VIDEO_IDS)
+
+    assert not any("RENAME TO" in query for query in queries)
@@ -0,0 +1,94 @@
+import pytest
+from streaming_pipeline import MicroBatchSink, RecentIds, run_streaming_pipeline
+
+FOLDER = "TIKTOK_samples/2024-01-01/"
+
+
+def pages(video_ids, page_size=4):
+    blobs = [{"name": f"{FOLDER}{video_id}.mp4"} for video_id in video_ids]
+    return (blobs[start:start + page_size] for start in range(0, len(blobs), page_size))
+
+
+def analyze(blob):
+    return {"video_id": int(blob["name"].rsplit("/", 1)[1].split(".")[0])}
+
+
+def fail_due_check(monkeypatch, after):
+    """Make the sink's due check raise once `after` rows were added, as an unexpected error in the loop would."""
+    original = MicroBatchSink.flush_if_due
+
+    def flush_if_due(sink):
+        if len(sink.rows) + sink.flushed_rows >= after:
+            raise RuntimeError("Pipeline error")
+        original(sink)
+
+    monkeypatch.setattr(MicroBatchSink, "flush_if_due", flush_if_due)
+
+
+def test_recent_ids_forget_ids_past_the_window():
+    recent = RecentIds(window=3)
+    for video_id in range(5):
+        recent.add(video_id)
+
+    assert [video_id in recent for video_id in range(5)] == [False, False, True, True, True]
+    assert len(recent._ids) == 3
+
+
+def test_the_sink_flushes_full_batches_and_records_a_failed_flush():
+    batches = []
+    sink = MicroBatchSink(batches.append, batch_size=2, flush_interval=60)
+    for row in range(5):
+        sink.add(row)
+    assert batches == [[0, 1], [2, 3]] and sink.rows == [4]
+
+    def failing_flush(rows):
+        raise RuntimeError("Insert failed")
+
+    sink.flush_fn = failing_flush
+    with pytest.raises(RuntimeError):
+        sink.flush()
+    assert sink.failed and sink.rows == [] and sink.flushed_rows == 4
+
+
+def test_pipeline_writes_new_videos_once():
+    batches = []
+    video_ids = [1, 2, 2, 3, 4, 5, 5, 6]
+
+    stats = run_streaming_pipeline(pages(video_ids), analyze, batches.append, analyzed_ids={4}, max_workers=2,
+                                   batch_size=2)
+
+    assert sorted(row["video_id"] for batch in batches for row in batch) == [1, 2, 3, 5, 6]
+    assert stats["listed"] == 8 and stats["skipped"] == 3 and stats["flushed"] == 5
+
+
+def test_rows_analyzed_before_an_error_are_flushed_and_the_error_is_raised(monkeypatch):
+    fail_due_check(monkeypatch, after=3)
+    batches = []
+
+    with pytest.raises(RuntimeError, match="Pipeline error"):
+        run_streaming_pipeline(pages(range(10)), analyze, batches.append, max_workers=1, batch_size=100)
+
+    assert len(batches) == 1 and len(batches[0]) == 3
+
+
+def test_a_failing_final_flush_does_not_hide_the_original_error(monkeypatch):
+    fail_due_check(monkeypatch, after=3)
+
+    def failing_flush(rows):
+        raise ConnectionError("Warehouse unavailable")
+
+    with pytest.raises(RuntimeError, match="Pipeline error"):
+        run_streaming_pipeline(pages(range(10)), analyze, failing_flush, max_workers=1, batch_size=100)
+
+
+def test_a_failed_flush_is_not_retried_on_the_way_out():
+    calls = []
+
+    def failing_flush(rows):
+        calls.append(rows)
+        raise ConnectionError("Warehouse unavailable")
+
+    with pytest.raises(ConnectionError):
+        run_streaming_pipeline(pages(range(10)), analyze, failing_flush, max_workers=1, batch_size=2)
+
+    assert len(calls) == 1
@@ -0,0 +1,103 @@
+import time
+import threading
+import pytest
+from google.api_core import exceptions
+from metrics import RunMetrics
+from rate_limiter import QuotaScheduler
+from simulated_backends import FakeGenerativeModel, LatencyModel
+from tail_latency import HedgedCaller, order_by_expected_duration
+from video_processor import generate_content_with_retry
+
+
+def scheduler_with_slots(slots):
+    return QuotaScheduler(rpm=100000, tpm=10 ** 9, initial_concurrency=slots, max_concurrency=slots)
+
+
+def warmed_up_caller(metrics, timeout=None):
+    # Recent calls took 10ms, so a call still running after that is hedged
+    caller = HedgedCaller(timeout, hedge_percentile=0.5, metrics=metrics)
+    for _ in range(20):
+        caller.latencies.observe(0.01)
+    return caller
+
+
+class HangingModel(FakeGenerativeModel):
+    """The first `hangs` calls never return (until the test ends); later calls answer normally."""
+
+    def __init__(self, hangs, **kwargs):
+        super().__init__(**kwargs)
+        self.hangs = hangs
+        self.released = threading.Event()
+
+    def generate_content(self, contents, **kwargs):
+        with self._lock:
+            hang = self.hangs > 0
+            self.hangs -= 1
+        if hang:
+            self.released.wait()
+        return super().generate_content(contents, **kwargs)
+
+
+def test_hung_calls_neither_block_the_run_nor_keep_their_quota_slot():
+    scheduler = scheduler_with_slots(1)
+    metrics = RunMetrics()
+    model = HangingModel(hangs=3, seed=1)
+    caller = HedgedCaller(timeout=0.2, metrics=metrics)
+    try:
+        for _ in range(3):
+            started = time.monotonic()
+            with pytest.raises(exceptions.DeadlineExceeded):
+                generate_content_with_retry(model, [], None, metrics, scheduler, 0, caller)
+            assert time.monotonic() - started < 1.0
+
+        # The only slot was held by a hung call each time; abandoning it freed the slot for the next call
+        assert generate_content_with_retry(model, [], None, metrics, scheduler, 0, caller) is not None
+    finally:
+        model.released.set()
+    assert metrics.summary()["counters"]["deadline_exceeded"] == 3
+
+
+def test_waiting_for_quota_counts_toward_the_deadline():
+    scheduler = scheduler_with_slots(1)
+    metrics = RunMetrics()
+    model = FakeGenerativeModel(seed=1)
+    caller = HedgedCaller(timeout=0.2, metrics=metrics)
+    with scheduler.slot(0):
+        with pytest.raises(exceptions.DeadlineExceeded):
+            generate_content_with_retry(model, [], None, metrics, scheduler, 0, caller)
+
+    assert model.calls == 0  # A call that was never admitted is never sent, so it is never billed
+    assert scheduler.concurrency.in_flight == 0
+
+
+def test_hedges_are_only_sent_when_a_quota_slot_is_free():
+    for slots, hedged in ((1, 0), (2, 1)):
+        metrics = RunMetrics()
+        model = FakeGenerativeModel(latency=LatencyModel(0.2, sigma=0), seed=2)
+        generate_content_with_retry(model, [], None, metrics, scheduler_with_slots(slots), 0, warmed_up_caller(metrics))
+
+        counters = metrics.summary()["counters"]
+        assert counters.get("hedged_requests", 0) == hedged
+        assert counters.get("hedges_not_admitted", 0) == 1 - hedged
+
+
+def test_hedging_is_off_by_default():
+    metrics = RunMetrics()
+    caller = HedgedCaller(metrics=metrics)
+    for _ in range(20):
+        caller.latencies.observe(0.01)
+    model = FakeGenerativeModel(latency=LatencyModel(0.1, sigma=0), seed=5)
+
+    generate_content_with_retry(model, [], None, metrics, None, 0, caller)
+
+    assert model.calls == 1
+    assert "hedged_requests" not in metrics.summary()["counters"]
+
+
+def test_longest_expected_videos_come_first():
+    video_files = ["a.mp4", "b.mp4", "c.mp4", "d.mp4"]
+    durations = {"a.mp4": 10, "b.mp4": 60}
+    blob_metadata = {"a.mp4": {"size": 1000}, "b.mp4": {"size": 6000}, "c.mp4": {"size": 3000}}
+
+    # c is estimated at 30s from its size; d has neither and takes the median
+    assert order_by_expected_duration(video_files, durations, blob_metadata) == [1, 2, 3, 0]
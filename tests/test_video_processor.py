@@ -0,0 +1,66 @@
+from google.api_core import retry, exceptions
+import video_processor
+from metrics import RunMetrics
+from simulated_backends import FakeGenerativeModel, LatencyModel
+from video_processor import generate, extract_video_id
+
+BUCKET = "test-bucket"
+VIDEO_FILES = [f"TIKTOK_samples/2024-01-01/{7300000000000000000 + index}.mp4" for index in range(40)]
+VIDEO_IDS = [extract_video_id(video_file.rsplit("/", 1)[1]) for video_file in VIDEO_FILES]
+
+
+def run_generate(video_files, model, **kwargs):
+    # No deadlines or hedges, so every call the model gets is one call per video
+    return generate(video_files, BUCKET, model=model, request_timeout=None, hedge_percentile=None, **kwargs)
+
+
+def test_results_follow_input_order_whatever_the_completion_order():
+    model = FakeGenerativeModel(latency=LatencyModel(0.005, sigma=1.0, seed=1), seed=1)
+    # Longest-first starts the last video first, and the random latencies finish them in any order
+    durations = {video_file: index for index, video_file in enumerate(VIDEO_FILES)}
+
+    results = run_generate(VIDEO_FILES, model, durations=durations, max_workers=8)
+
+    assert [analysis["video_id"] for analysis in results] == VIDEO_IDS
+    assert model.calls == len(VIDEO_FILES)
+
+
+def test_failed_videos_are_left_out_without_stopping_the_run():
+    model = FakeGenerativeModel(error_rate=0.3, seed=3)
+    metrics = RunMetrics()
+
+    results = run_generate(VIDEO_FILES + ["TIKTOK_samples/2024-01-01/not-a-video-id.mp4"], model, metrics=metrics)
+
+    failed = metrics.summary()["counters"].get("videos_failed", 0)
+    assert 0 < failed < len(VIDEO_FILES)
+    assert len(results) == len(VIDEO_FILES) - failed
+    result_ids = [analysis["video_id"] for analysis in results]
+    assert result_ids == [video_id for video_id in VIDEO_IDS if video_id in set(result_ids)]
+    assert model.calls == len(VIDEO_FILES)  # The invalid name never reached the model
+
+
+def test_analyses_are_processed_into_typed_values():
+    results = run_generate(VIDEO_FILES[:3], FakeGenerativeModel(seed=4))
+
+    for analysis in results:
+        assert isinstance(analysis["ai_unexpectedness_rating"], int)
+        assert isinstance(analysis["ai_expectation_violation_description"], str)
+
+
+def test_videos_that_stay_throttled_are_counted_once_the_retry_budget_runs_out(monkeypatch):
+    # A retry budget of a fraction of a second instead of two minutes, and no backoff after it
+    quick_retry = retry.Retry(predicate=retry.if_exception_type(exceptions.ResourceExhausted),
+                              initial=0.001, maximum=0.001, timeout=0.05)
+    monkeypatch.setattr(video_processor, "generate_content_with_retry",
+                        quick_retry(video_processor.generate_content_with_retry.__wrapped__))
+    monkeypatch.setattr(video_processor, "RESOURCE_EXHAUSTED_BACKOFF", 0)
+    model = FakeGenerativeModel(resource_exhausted_rate=1.0, seed=5)
+    metrics = RunMetrics()
+
+    assert run_generate(VIDEO_FILES[:4], model, metrics=metrics, max_workers=4) == []
+
+    counters = metrics.summary()["counters"]
+    assert counters["videos_failed_resource_exhausted"] == 4
+    assert "videos_failed" not in counters
+    assert counters["resource_exhausted"] == model.calls
+    assert counters["retries"] == model.calls - 4
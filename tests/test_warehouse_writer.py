@@ -0,0 +1,59 @@
+import pytest
+import warehouse_writer
+from simulated_backends import FakeBigQueryClient
+from warehouse_writer import WarehouseWriter
+
+TABLE_ID = "test-project.tiktok_data.ai_results"
+ROWS = [{"video_id": 7300000000000000000 + index, "ai_positivity": index % 5} for index in range(1200)]
+
+
+class TimeoutAfterInsertClient(FakeBigQueryClient):
+    """The first insert request reaches the table, but the caller only sees a timeout."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.requests = 0
+
+    def insert_rows_json(self, table_id, rows, row_ids=None, **kwargs):
+        self.requests += 1
+        errors = super().insert_rows_json(table_id, rows, row_ids=row_ids, **kwargs)
+        if self.requests == 1:
+            raise TimeoutError("Simulated timeout after the insert was committed")
+        return errors
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(warehouse_writer, "RETRY_BACKOFF", 0)
+
+
+def test_a_chunk_resent_after_a_timeout_is_not_written_twice():
+    client = TimeoutAfterInsertClient()
+
+    report = WarehouseWriter(client, TABLE_ID, max_workers=1, max_rows=500).write(ROWS)
+
+    assert client.requests == 4  # Three chunks, the first of them sent twice
+    assert report["rows_failed"] == 0
+    assert sorted(row["video_id"] for row in client.rows) == [row["video_id"] for row in ROWS]
+
+
+def test_only_failed_rows_are_retried_and_rows_left_failing_are_reported():
+    client = FakeBigQueryClient(row_error_rate=0.01, seed=3)
+
+    report = WarehouseWriter(client, TABLE_ID, max_rows=100).write(ROWS)
+
+    written = [row["video_id"] for row in client.rows]
+    assert len(written) == len(set(written)) == report["rows_written"]
+    assert report["rows_written"] + report["rows_failed"] == len(ROWS)
+    assert {row["video_id"] for row in report["failed_rows"]}.isdisjoint(written)
+
+
+def test_large_batches_go_through_one_load_job():
+    client = FakeBigQueryClient()
+
+    report = WarehouseWriter(client, TABLE_ID, load_job_threshold=1000).write(ROWS, extra_fields={"created_at": "now"})
+
+    assert report["method"] == "load_job"
+    assert len(client.rows) == len(ROWS)
+    assert all(row["created_at"] == "now" for row in client.rows)
+    assert "created_at" not in ROWS[0]
@@ -0,0 +1,79 @@
+import time
+import pytest
+import work_queue
+from work_queue import SQLiteWorkQueue, run_worker
+
+FOLDER = "TIKTOK_samples/2024-01-01/"
+VIDEO_FILES = [f"{FOLDER}{video_id}.mp4" for video_id in (101, 102, 103)]
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = SQLiteWorkQueue(str(tmp_path / "queue.sqlite"), max_attempts=2)
+    queue.enqueue(VIDEO_FILES)
+    yield queue
+    queue.close()
+
+
+def test_an_expired_lease_is_reclaimed_by_another_worker(queue):
+    assert [video_id for video_id, _ in queue.claim("a", lease_seconds=-1)] == [101, 102, 103]
+    assert queue.claim("b", batch_size=2) == [(101, VIDEO_FILES[0]), (102, VIDEO_FILES[1])]
+
+    # The first worker learns it lost every expired lease, including the one handed back to the pending tasks
+    assert queue.heartbeat("a", [101, 102, 103]) == [101, 102, 103]
+    assert queue.heartbeat("b", [101, 102]) == []
+    # Leases not yet expired are not handed out again
+    assert queue.claim("c") == [(103, VIDEO_FILES[2])]
+    assert queue.claim("a") == []
+
+
+def test_a_result_committed_twice_is_stored_once(queue):
+    queue.claim("a", lease_seconds=-1)
+    queue.claim("b")
+    queue.commit("b", [{"video_id": 101, "ai_positivity": 2}])
+    queue.commit("a", [{"video_id": 101, "ai_positivity": 5}])
+
+    assert queue.unloaded_results() == [{"video_id": 101, "ai_positivity": 2}]
+    queue.mark_loaded([101])
+    assert queue.stats()["unloaded_results"] == 0
+
+
+def test_released_tasks_fail_after_max_attempts(queue):
+    queue.claim("a")
+    queue.release("b", [101])  # Not b's lease: ignored
+    queue.release("a", [101, 102])
+    assert queue.stats()["pending"] == 2
+
+    assert queue.claim("a", batch_size=1) == [(101, VIDEO_FILES[0])]
+    queue.release("a", [101])
+
+    stats = queue.stats()
+    assert stats["failed"] == 1 and stats["pending"] == 1 and stats["leased"] == 1
+
+
+def test_a_worker_skips_tasks_whose_lease_it_lost(queue, monkeypatch):
+    analyzed = []
+
+    def analyze_video_isolated(run, video_file):
+        analyzed.append(video_file)
+        if len(analyzed) == 1:
+            time.sleep(0.4)  # Stalls past the lease
+        return {"video_id": int(video_file[len(FOLDER):-4])}
+
+    heartbeat = queue.heartbeat
+    heartbeats = []
+
+    def losing_heartbeat(worker_id, video_ids, lease_seconds):
+        # The first heartbeat finds every lease of the batch taken over
+        heartbeats.append(video_ids)
+        return list(video_ids) if len(heartbeats) == 1 else heartbeat(worker_id, video_ids, lease_seconds)
+
+    monkeypatch.setattr(work_queue, "analyze_video_isolated", analyze_video_isolated)
+    monkeypatch.setattr(queue, "heartbeat", losing_heartbeat)
+
+    committed = run_worker(queue, run=None, worker_id="a", lease_seconds=0.15, max_workers=1)
+
+    # The stalled task finished and was committed; the other two were skipped, reclaimed and analyzed once each
+    assert analyzed == VIDEO_FILES
+    assert committed == 3
+    assert queue.stats()["done"] == 3 and queue.stats()["failed"] == 0
@@ -1,15 +1,41 @@
 import os
+import re
 import json
 import logging
 import time
-from vertexai.generative_models import GenerativeModel, Part, GenerationConfig
+import statistics
+from collections import Counter
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from prompts import text1, text2, text3, text4, text5, text6, text7, text8, text9, text10, text11, text12
-from tqdm import tqdm
+from analysis_cache import make_cache_key, prompt_hash
+from metrics import RunMetrics
+from rate_limiter import estimate_request_tokens, OUTPUT_TOKENS_ALLOWANCE
+from tail_latency import HedgedCaller, order_by_expected_duration, DEFAULT_REQUEST_TIMEOUT, DEFAULT_HEDGE_PERCENTILE
 from google.api_core import retry, exceptions
 
+# The Vertex AI SDK and tqdm are imported inside the functions that call them, so modules that only need the
+# schema or extract_video_id (planner, results, the CLI's list and load commands) don't pay for them at import time
+
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
+MODEL_NAME = "gemini-1.5-pro-002"
+SEED = 42
+MAX_OUTPUT_TOKENS = 8000
+DEFAULT_MAX_WORKERS = 8  # Concurrent in-flight requests to Vertex AI
+RESOURCE_EXHAUSTED_BACKOFF = 15  # Seconds a worker waits after the retry budget runs out, without a scheduler
+
+ANALYSIS_INSTRUCTION = """
+                        Analyze the video and provide your response strictly in valid JSON format as per the provided schema, without any additional text, explanations, or formatting symbols like asterisks. Do not include markdown or any other markup language in your response. If a value is not applicable or cannot be determined, use 'N/A'.
+                        """
+
+PROMPTS = [text1, text2, text3, text4, text5, text6, text7, text8, text9, text10, text11, text12]
+
+REPAIR_INSTRUCTION = """
+                        Analyze the video and answer only the questions below, strictly in valid JSON format as per the provided schema, without any additional text, explanations, or formatting symbols like asterisks. If a value is not applicable or cannot be determined, use 'N/A'.
+                        """
+
 response_schema = {
     "type": "object",
     "properties": {
@@ -42,6 +68,16 @@ response_schema = {
     ]
 }
 
+# Fields answered on a numeric scale; they map to INTEGER warehouse columns
+INTEGER_FIELDS = [field for field in response_schema['required'] if field != 'ai_expectation_violation_description']
+
+# The rubric prompt behind each field: text1 answers the first required field, text2 the second, and so on
+FIELD_PROMPTS = dict(zip(response_schema['required'], PROMPTS))
+_FIELD_VALUE_PATTERN = re.compile(r'"(ai_[a-z_]+)"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+# Identifies the static prompt block; changes whenever the instruction, rubric prompts or schema change
+PROMPT_DIGEST = prompt_hash(ANALYSIS_INSTRUCTION, PROMPTS, response_schema)
+
 
 def extract_video_id(filename):
     """Extract the numeric video ID from the filename, handling 'Copy of' prefix."""
@@ -61,49 +97,67 @@ def extract_video_id(filename):
 
 
 def safe_convert(value, convert_func):
+    """Convert a model answer, returning None (a real null) when it is missing, 'N/A' or unusable."""
     if value is None or value == "N/A":
-        return "N/A"
+        return None
     if isinstance(value, list):
         logging.warning(f"Unexpected list value: {value}")
-        return "N/A"
+        return None
     if isinstance(value, str) and value.lower() in ['true', 'false']:
         value = '1' if value.lower() == 'true' else '0'
     try:
         return convert_func(value)
     except (ValueError, TypeError) as e:
         logging.warning(f"Conversion error: {e} for value: {value}")
-        return "N/A"
+        return None
 
 
 def process_analysis(analysis):
-    logging.debug(f"Original analysis: {analysis}")
-
     processed = {}
     for field in response_schema['required']:
-        value = analysis.get(field, 'N/A')
-        if field in [
-            'ai_unexpectedness_rating',  # text1
-            'ai_unexpectedness_duration',  # text2
-            'ai_emotional_intensity',  # text4
-            'ai_positivity',  # text5
-            'ai_negativity',  # text6
-            'ai_expected_desirability',  # text7
-            'ai_unexpected_desirability',  # text8
-            'ai_emotional_spatial_closeness',  # text9
-            'ai_cognitive_interruption',  # text10
-            'ai_perceived_realism',  # text11
-            'ai_sexual_content_rating'  # text12
-        ]:
+        value = analysis.get(field)
+        if field in INTEGER_FIELDS:
             processed[field] = safe_convert(value, int)
         else:
-            processed[field] = str(value) if value is not None else 'N/A'
-
-    logging.debug(f"Processed analysis: {processed}")
+            processed[field] = str(value) if value not in (None, "N/A") else None
     return processed
 
 
 @retry.Retry(predicate=retry.if_exception_type(exceptions.ResourceExhausted))
-def generate_content_with_retry(model, instructions, generation_config):
+def generate_content_with_retry(model, instructions, generation_config, metrics=None, scheduler=None,
+                                estimated_tokens=0, caller=None):
+    # With a `HedgedCaller` every attempt has a deadline and may be hedged
+    try:
+        if caller is not None:
+            admit = partial(_admit_request, scheduler, estimated_tokens) if scheduler is not None else None
+            return caller.call(_generate_content, model, instructions, generation_config, admit=admit)
+        if scheduler is None:
+            return _generate_content(model, instructions, generation_config)
+        return _generate_in_slot(scheduler.slot(estimated_tokens), model, instructions, generation_config)
+    except exceptions.ResourceExhausted:
+        if metrics is not None:
+            metrics.increment("resource_exhausted")
+        raise
+
+
+def _admit_request(scheduler, estimated_tokens, timeout):
+    """Take a quota slot for one model request, waiting for it at most `timeout` seconds (0 for hedges), and return
+    the function that sends the request in that slot with the slot's `abandon`, or None if no slot was free."""
+    slot = scheduler.try_slot(estimated_tokens) if timeout == 0 else scheduler.slot(estimated_tokens, timeout)
+    return (partial(_generate_in_slot, slot), slot.abandon) if slot is not None else None
+
+
+def _generate_in_slot(slot, model, instructions, generation_config):
+    # Every attempt, retries and hedges included, holds its own quota slot until its response arrives
+    with slot:
+        response = _generate_content(model, instructions, generation_config)
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            slot.actual_tokens = usage.total_token_count
+        return response
+
+
+def _generate_content(model, instructions, generation_config):
     return model.generate_content(
         instructions,
         generation_config=generation_config,
@@ -111,73 +165,295 @@ def generate_content_with_retry(model, instructions, generation_config):
     )
 
 
-def generate(video_files, bucket_name, temperature=0.01, top_p=0.99):
+def build_generation_config(temperature, top_p, candidate_count=1, schema=response_schema):
+    from vertexai.generative_models import GenerationConfig
+
+    return GenerationConfig(
+        candidate_count=candidate_count,
+        max_output_tokens=MAX_OUTPUT_TOKENS,
+        temperature=temperature,
+        top_p=top_p,
+        seed=SEED,
+        response_mime_type="application/json",
+        response_schema=schema
+    )
+
+
+def build_instructions(video_uri):
+    from vertexai.generative_models import Part
+
+    return [Part.from_uri(mime_type="video/mp4", uri=video_uri), ANALYSIS_INSTRUCTION] + PROMPTS
+
+
+class AnalysisRun:
+    """State shared by every per-video call of one run: the model, its configuration and run-wide helpers."""
+
+    def __init__(self, model, bucket_name, generation_config, cache=None, metrics=None, scheduler=None,
+                 durations=None, video_uris=None, candidate_count=1, temperature=None, top_p=None, repair=True,
+                 caller=None):
+        self.model = model
+        self.bucket_name = bucket_name
+        self.generation_config = generation_config
+        self.cache = cache
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.scheduler = scheduler
+        self.durations = durations or {}
+        self.video_uris = video_uris or {}
+        self.candidate_count = candidate_count
+        self.temperature = temperature
+        self.top_p = top_p
+        self.repair = repair and temperature is not None  # Repair requests are configured like the run's own
+        self.caller = caller
+
+    def estimate_tokens(self, video_file):
+        extra_output = (self.candidate_count - 1) * OUTPUT_TOKENS_ALLOWANCE
+        return estimate_request_tokens(self.durations.get(video_file)) + extra_output
+
+
+def create_analysis_run(bucket_name, temperature, top_p, model=None, cache=None, metrics=None, scheduler=None,
+                        durations=None, video_uris=None, candidate_count=1, repair=True,
+                        request_timeout=DEFAULT_REQUEST_TIMEOUT, hedge_percentile=DEFAULT_HEDGE_PERCENTILE):
+    """Set up an `AnalysisRun` for one configuration of the model.
+
+    With `candidate_count` above one, every request returns that many samples for consistency statistics.
+    With `repair`, fields that come back missing or unparseable are asked again on their own.
+    Model calls are abandoned after `request_timeout` seconds (None: never) and, with `hedge_percentile`, hedged
+    past that latency of recent calls.
+    """
+    if model is None:
+        from vertexai.generative_models import GenerativeModel
+
+        model = GenerativeModel(MODEL_NAME)
+    generation_config = build_generation_config(temperature, top_p, candidate_count)
+    metrics = metrics if metrics is not None else RunMetrics()
+    caller = None
+    if request_timeout or hedge_percentile:
+        caller = HedgedCaller(request_timeout, hedge_percentile, metrics, metrics.usage.record)
+    return AnalysisRun(model, bucket_name, generation_config, cache, metrics, scheduler, durations, video_uris,
+                       candidate_count, temperature, top_p, repair, caller)
+
+
+def analyze_video(run, video_file, cache_key=None):
+    """Run the model on a single video and return its processed analysis, or None if it can't be used."""
+    with run.metrics.stage("video"):
+        return _analyze_video(run, video_file, cache_key)
+
+
+def _analyze_video(run, video_file, cache_key):
+    video_id = extract_video_id(os.path.basename(video_file))
+
+    if video_id is None:
+        logging.error(f"Skipping video {video_file} due to invalid ID format")
+        return None
+
+    if cache_key is not None:
+        cached = run.cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"Cache hit for video: {video_file}")
+            run.metrics.increment("cache_hits")
+            cached['video_id'] = video_id
+            return cached
+
+    video_uri = run.video_uris.get(video_file, f"gs://{run.bucket_name}/{video_file}")
+    logging.info(f"Processing video: {video_file}")
+
+    instructions = build_instructions(video_uri)
+    with run.metrics.stage("model_call"):
+        response = generate_content_with_retry(run.model, instructions, run.generation_config, run.metrics,
+                                               run.scheduler, run.estimate_tokens(video_file), run.caller)
+    run.metrics.usage.record(response)
+
+    # response.text is only defined for a single candidate
+    texts = [candidate.text for candidate in response.candidates] if run.candidate_count > 1 else [response.text]
+    with run.metrics.stage("parse"):
+        samples = []
+        for text in texts:
+            logging.debug(f"Raw response: {text}")
+            try:
+                samples.append(process_analysis(json.loads(text)))
+            except json.JSONDecodeError as e:
+                logging.error(f"JSON decode error: {e}")
+                logging.error(f"Raw response causing error: {text}")
+                run.metrics.increment("json_errors")
+        if not samples and not run.repair:
+            return None
+
+        # Keep whatever fields can still be read from a malformed response; the repair pass asks for the rest
+        analysis = samples[0] if samples else process_analysis(salvage_fields(texts[0] if texts else ""))
+        if run.candidate_count > 1 and samples:
+            analysis['consistency'] = consistency_stats(samples)
+
+    if run.repair and missing_fields(analysis):
+        with run.metrics.stage("repair"):
+            repair_analysis(run, video_file, video_uri, analysis)
+        if len(missing_fields(analysis)) == len(response_schema['required']):
+            return None
+
+    # An analysis with gaps is not cached, so a later run asks again instead of serving the gaps
+    if cache_key is not None and not missing_fields(analysis):
+        run.cache.put(cache_key, analysis)
+
+    analysis['video_id'] = video_id
+    return analysis
+
+
+def missing_fields(analysis):
+    return [field for field in response_schema['required'] if analysis.get(field) is None]
+
+
+def salvage_fields(text):
+    """Pick the `"field": "value"` pairs out of a response that is not valid JSON as a whole."""
+    return {field: value for field, value in _FIELD_VALUE_PATTERN.findall(text) if field in FIELD_PROMPTS}
+
+
+def build_repair_schema(fields):
+    return {
+        "type": "object",
+        "properties": {field: response_schema['properties'][field] for field in fields},
+        "required": list(fields),
+    }
+
+
+def repair_analysis(run, video_file, video_uri, analysis):
+    """Ask again for only the missing fields, with their own prompts and a reduced schema, and merge the answers.
+
+    Answers that are still 'N/A' or unusable stay None. Returns the number of fields repaired.
+    """
+    from vertexai.generative_models import Part
+
+    fields = missing_fields(analysis)
+    instructions = [Part.from_uri(mime_type="video/mp4", uri=video_uri), REPAIR_INSTRUCTION]
+    instructions += [FIELD_PROMPTS[field] for field in fields]
+    generation_config = build_generation_config(run.temperature, run.top_p, schema=build_repair_schema(fields))
+    run.metrics.increment("repair_requests")
     try:
-        model = GenerativeModel("gemini-1.5-pro-002")
-        all_results = []
+        response = generate_content_with_retry(run.model, instructions, generation_config, run.metrics,
+                                               run.scheduler, estimate_request_tokens(run.durations.get(video_file)),
+                                               run.caller)
+        run.metrics.usage.record(response)
+        answers = process_analysis(json.loads(response.text))
+    except Exception as e:
+        logging.warning(f"Repair of {', '.join(fields)} failed for {video_file}: {e}")
+        return 0
 
-        with tqdm(total=len(video_files), desc=f"Processing videos (temp={temperature}, top_p={top_p})") as pbar:
-            for video_file in video_files:
-                video_uri = f"gs://{bucket_name}/{video_file}"
-                video_part = Part.from_uri(mime_type="video/mp4", uri=video_uri)
+    repaired = 0
+    for field in fields:
+        if answers.get(field) is not None:
+            analysis[field] = answers[field]
+            repaired += 1
+    run.metrics.increment("fields_repaired", repaired)
+    logging.info(f"Repaired {repaired} of {len(fields)} missing fields for {video_file}")
+    return repaired
 
-                try:
-                    logging.info(f"Processing video: {video_file}")
 
-                    instructions = [
-                        video_part,
-                        """
-                        Analyze the video and provide your response strictly in valid JSON format as per the provided schema, without any additional text, explanations, or formatting symbols like asterisks. Do not include markdown or any other markup language in your response. If a value is not applicable or cannot be determined, use 'N/A'.
-                        """,
-                        text1, text2, text3, text4, text5, text6, text7, text8, text9, text10, text11, text12
-                    ]
-
-                    generation_config = GenerationConfig(
-                        max_output_tokens=8000,
-                        temperature=temperature,
-                        top_p=top_p,
-                        seed=42,
-                        response_mime_type="application/json",
-                        response_schema=response_schema
-                    )
-
-                    response = generate_content_with_retry(model, instructions, generation_config)
-
-                    logging.debug(f"Raw response: {response.text}")
-
-                    try:
-                        analysis = json.loads(response.text)
-                    except json.JSONDecodeError as e:
-                        logging.error(f"JSON decode error: {e}")
-                        logging.error(f"Raw response causing error: {response.text}")
-                        continue
-
-                    analysis = process_analysis(analysis)
-                    video_id = extract_video_id(os.path.basename(video_file))
-
-                    if video_id is not None:
-                        analysis['video_id'] = video_id
-                        logging.info(f"Final analysis for {video_file}:\n{json.dumps(analysis, indent=2)}")
-                        print("-" * 50)
-                        all_results.append(analysis)
-                    else:
-                        logging.error(f"Skipping video {video_file} due to invalid ID format")
-
-                except exceptions.ResourceExhausted as e:
-                    logging.warning(f"Resource exhausted for video {video_file}. Retrying after delay: {e}")
-                    time.sleep(15)  # Wait for 15 seconds before retrying
-                    pbar.update(0)  # Update progress bar without incrementing
-                    continue
-
-                except Exception as e:
-                    logging.exception(f"Error processing video {video_file}: {e}")
-
-                finally:
-                    pbar.update(1)
-                    time.sleep(1)  # Add a small delay between each video processing
-
-        return all_results
+def consistency_stats(samples):
+    """Per-field mean, population variance and agreement (share of samples giving the most common answer)."""
+    stats = []
+    for field in INTEGER_FIELDS:
+        values = [sample[field] for sample in samples if sample.get(field) is not None]
+        stats.append({
+            "field": field,
+            "samples": len(values),
+            "mean": statistics.fmean(values) if values else None,
+            "variance": statistics.pvariance(values) if values else None,
+            "agreement": Counter(values).most_common(1)[0][1] / len(values) if values else None,
+        })
+    return stats
+
+
+def analyze_video_isolated(run, video_file, cache_key=None):
+    # Errors are contained to the video that raised them so one bad file never stops the batch
+    try:
+        return analyze_video(run, video_file, cache_key)
+
+    except (exceptions.ResourceExhausted, exceptions.RetryError) as e:
+        # Only ResourceExhausted is retried: once the retry deadline passes it surfaces as a RetryError with the
+        # last ResourceExhausted as its cause
+        logging.warning(f"Resource exhausted for video {video_file}. Backing off before freeing the slot: {e}")
+        run.metrics.increment("videos_failed_resource_exhausted")
+        if run.scheduler is None:
+            time.sleep(RESOURCE_EXHAUSTED_BACKOFF)  # Hold this worker so the quota can recover
+        return None
+
+    except exceptions.DeadlineExceeded as e:
+        logging.warning(f"Giving up on video {video_file}: {e}")
+        run.metrics.increment("videos_failed_deadline")
+        return None
+
+    except Exception as e:
+        logging.exception(f"Error processing video {video_file}: {e}")
+        run.metrics.increment("videos_failed")
+        return None
+
+
+def video_cache_key(blob, temperature, top_p):
+    return make_cache_key(blob, PROMPT_DIGEST, MODEL_NAME, temperature, top_p, SEED)
+
+
+def _cache_keys(video_files, cache, blob_metadata, temperature, top_p, candidate_count=1):
+    # Cached entries hold a single sample, so consistency runs always call the model
+    if cache is None or not blob_metadata or candidate_count > 1:
+        return [None] * len(video_files)
+    return [
+        video_cache_key(blob_metadata[video_file], temperature, top_p) if video_file in blob_metadata else None
+        for video_file in video_files
+    ]
+
+
+def generate(video_files, bucket_name, temperature=0.01, top_p=0.99, max_workers=DEFAULT_MAX_WORKERS, model=None,
+             cache=None, blob_metadata=None, metrics=None, scheduler=None, durations=None,
+             journal=None, video_uris=None, candidate_count=1, repair=True, request_timeout=DEFAULT_REQUEST_TIMEOUT,
+             hedge_percentile=DEFAULT_HEDGE_PERCENTILE, longest_first=True):
+    """Analyze videos concurrently, keeping at most `max_workers` requests in flight.
+
+    Results are returned in the order of `video_files`; videos that failed are left out.
+    `model` can be any object exposing `generate_content`, which lets the engine run against a fake.
+    With an `AnalysisCache` and the `blob_metadata` listing (name -> metadata from `gcs_utils.list_gcs_blobs`),
+    videos already analyzed with the same prompts and configuration are served without a model call.
+    Timings, counters and token usage for the run are recorded in `metrics` (a `RunMetrics`).
+    A `QuotaScheduler` keeps requests within the RPM/TPM quota, estimating each request's tokens from
+    `durations` (video file -> seconds); `max_workers` should then be at least its maximum concurrency.
+    Each finished analysis is appended to `journal` (a `RunJournal`) as soon as it completes.
+    `video_uris` (video file -> gs:// URI) sends a preprocessed derivative to the model in place of the original.
+    `candidate_count` above one samples every video that many times in one request and adds per-field
+    consistency statistics under the analysis' `consistency` key.
+    With `repair`, fields that come back missing or unparseable are asked again in a second, smaller request.
+    Each model call is abandoned after `request_timeout` seconds and, with `hedge_percentile` (off by default, as
+    duplicates are billed), hedged once it runs past that latency of recent calls. With `longest_first`, the
+    longest videos (by duration, else blob size) are started first so they don't finish last.
+    """
+    from tqdm import tqdm
+
+    try:
+        run = create_analysis_run(bucket_name, temperature, top_p, model, cache, metrics,
+                                  scheduler, durations, video_uris, candidate_count, repair,
+                                  request_timeout=request_timeout, hedge_percentile=hedge_percentile)
+        results = [None] * len(video_files)
+        cache_keys = _cache_keys(video_files, cache, blob_metadata, temperature, top_p, candidate_count)
+        order = range(len(video_files))
+        if longest_first:
+            order = order_by_expected_duration(video_files, durations, blob_metadata)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+                tqdm(total=len(video_files), desc=f"Processing videos (temp={temperature}, top_p={top_p})") as pbar:
+            futures = {
+                executor.submit(analyze_video_isolated, run, video_files[index], cache_keys[index]): index
+                for index in order
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if journal is not None and results[futures[future]] is not None:
+                    journal.record_analysis(results[futures[future]])
+                pbar.update(1)
+
+        if cache is not None:
+            logging.info(f"Analysis cache stats: {cache.stats()}")
+        logging.info(f"Token usage: {run.metrics.usage.report()}")
+        if scheduler is not None:
+            logging.info(f"Quota scheduler stats: {scheduler.stats()}")
+
+        return [analysis for analysis in results if analysis is not None]
 
     except Exception as e:
         logging.exception(f"Error in generate function: {e}")
-        return []
\ No newline at end of file
+        return []
@@ -0,0 +1,146 @@
+import io
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from google.cloud import bigquery
+
+MAX_ROWS_PER_REQUEST = 500  # Recommended streaming insert batch size
+MAX_BYTES_PER_REQUEST = 9 * 1024 * 1024  # Stays under the 10 MB streaming insert request limit
+LOAD_JOB_THRESHOLD = 10000  # Row count from which a batch load job is used instead of streaming inserts
+MAX_ROW_RETRIES = 3
+RETRY_BACKOFF = 1.0  # Seconds, doubled after every retry round
+
+
+class WarehouseWriter:
+    """Writes rows to a BigQuery table in size-bounded parallel chunks, retrying only the rows that failed.
+
+    Batches of `load_job_threshold` rows or more go through a single NDJSON load job, which avoids streaming
+    insert cost and quotas. Input rows are never modified. Streamed rows carry an insert ID built from their
+    `key_fields`, so a chunk sent again after an error that hid a successful insert is deduplicated by BigQuery.
+    """
+
+    def __init__(self, client, table_id, max_workers=4, max_rows=MAX_ROWS_PER_REQUEST,
+                 max_bytes=MAX_BYTES_PER_REQUEST, load_job_threshold=LOAD_JOB_THRESHOLD,
+                 max_retries=MAX_ROW_RETRIES, key_fields=("video_id",)):
+        self.client = client
+        self.table_id = table_id
+        self.key_fields = key_fields
+        self.max_workers = max_workers
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.load_job_threshold = load_job_threshold
+        self.max_retries = max_retries
+
+    def write(self, rows, extra_fields=None):
+        """Write `rows` (with `extra_fields` such as created_at added to copies) and return a report.
+
+        The report holds the method used, rows written, bytes sent, rows/sec and the rows that could not be written.
+        """
+        if extra_fields:
+            rows = [{**row, **extra_fields} for row in rows]
+        start_time = time.monotonic()
+
+        if len(rows) >= self.load_job_threshold:
+            method = "load_job"
+            bytes_sent, failed_rows = self._load(rows)
+        else:
+            method = "streaming"
+            bytes_sent, failed_rows = self._stream(rows)
+
+        elapsed = time.monotonic() - start_time
+        written = len(rows) - len(failed_rows)
+        report = {
+            "method": method,
+            "rows_written": written,
+            "rows_failed": len(failed_rows),
+            "bytes_sent": bytes_sent,
+            "seconds": elapsed,
+            "rows_per_sec": written / elapsed if elapsed > 0 else 0.0,
+            "failed_rows": failed_rows,
+        }
+        logging.info(f"Wrote {written}/{len(rows)} rows to {self.table_id} via {method}: "
+                     f"{bytes_sent} bytes in {elapsed:.2f}s ({report['rows_per_sec']:.1f} rows/sec)")
+        if failed_rows:
+            logging.error(f"{len(failed_rows)} rows could not be written to {self.table_id}")
+        return report
+
+    def _chunks(self, rows):
+        chunk, chunk_bytes = [], 0
+        for row in rows:
+            size = len(json.dumps(row, default=str))
+            if chunk and (len(chunk) >= self.max_rows or chunk_bytes + size > self.max_bytes):
+                yield chunk, chunk_bytes
+                chunk, chunk_bytes = [], 0
+            chunk.append(row)
+            chunk_bytes += size
+        if chunk:
+            yield chunk, chunk_bytes
+
+    def _stream(self, rows):
+        bytes_sent = 0
+        failed_rows = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._insert_chunk, chunk, size) for chunk, size in self._chunks(rows)]
+            for future in futures:
+                chunk_bytes, chunk_failed = future.result()
+                bytes_sent += chunk_bytes
+                failed_rows.extend(chunk_failed)
+        return bytes_sent, failed_rows
+
+    def _insert_chunk(self, chunk, chunk_bytes):
+        bytes_sent = 0
+        pending = chunk
+        rejected = []
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+                chunk_bytes = sum(len(json.dumps(row, default=str)) for row in pending)
+            try:
+                errors = self.client.insert_rows_json(self.table_id, pending, row_ids=self._row_ids(pending))
+            except Exception as e:
+                logging.warning(f"Insert of {len(pending)} rows into {self.table_id} failed (attempt {attempt + 1}): {e}")
+                continue
+            bytes_sent += chunk_bytes
+            if not errors:
+                return bytes_sent, rejected
+
+            retryable = []
+            for error in errors:
+                row = pending[error['index']]
+                reasons = {detail.get('reason') for detail in error.get('errors', [])}
+                if 'invalid' in reasons:
+                    # Rows that don't match the schema will fail again, so report them instead of retrying
+                    logging.error(f"Row rejected by {self.table_id}: {error['errors']}")
+                    rejected.append(row)
+                else:
+                    retryable.append(row)
+            if not retryable:
+                return bytes_sent, rejected
+            logging.warning(f"Retrying {len(retryable)} of {len(pending)} rows for {self.table_id}")
+            pending = retryable
+        return bytes_sent, rejected + pending
+
+    def _row_ids(self, rows):
+        # The same ID on every attempt, unlike the random one the client generates when none is given
+        return [":".join(str(row[field]) for field in self.key_fields) for row in rows]
+
+    def _load(self, rows):
+        buffer = io.BytesIO()
+        for row in rows:
+            buffer.write(json.dumps(row, default=str).encode("utf-8"))
+            buffer.write(b"\n")
+        bytes_sent = buffer.tell()
+        buffer.seek(0)
+
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        )
+        try:
+            job = self.client.load_table_from_file(buffer, self.table_id, job_config=job_config)
+            job.result()
+        except Exception as e:
+            logging.error(f"Load job into {self.table_id} failed: {e}")
+            return bytes_sent, rows
+        return bytes_sent, []
@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from video_processor import extract_video_id, analyze_video_isolated
+
+DEFAULT_LEASE_SECONDS = 600
+DEFAULT_CLAIM_BATCH = 16
+MAX_ATTEMPTS = 3
+IDLE_POLL_SECONDS = 30  # How long a worker waits before looking for expired leases again
+
+
+class WorkQueue(ABC):
+    """Lease-based queue of video files shared by several workers.
+
+    A claimed task is leased to one worker until its lease expires; heartbeats extend the lease while the worker is
+    busy, and expired leases are handed to other workers. Results are committed once per video_id, so a task
+    that was picked up twice is still stored once. Backends implement every method below.
+    """
+
+    @abstractmethod
+    def enqueue(self, video_files):
+        raise NotImplementedError
+
+    @abstractmethod
+    def claim(self, worker_id, batch_size=DEFAULT_CLAIM_BATCH, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Lease up to `batch_size` pending tasks, returned as (video_id, video_file) pairs."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def heartbeat(self, worker_id, video_ids, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Extend the leases still held by `worker_id` and return the video_ids whose leases were lost."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def commit(self, worker_id, analyses):
+        """Store results and mark their tasks done. Results already committed for a video_id are kept as they are."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def release(self, worker_id, video_ids):
+        """Hand failed tasks back for another attempt, or mark them failed after MAX_ATTEMPTS."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def unloaded_results(self, limit=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def mark_loaded(self, video_ids):
+        raise NotImplementedError
+
+    @abstractmethod
+    def stats(self):
+        raise NotImplementedError
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """WorkQueue backed by one SQLite file.
+
+    Fine for worker processes on one machine. SQLite locking is unreliable on network file systems, so for workers
+    spread across machines put a server-backed implementation behind the same interface.
+    """
+
+    def __init__(self, path, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                video_id INTEGER PRIMARY KEY,
+                video_file TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker_id TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, lease_expires);
+            CREATE TABLE IF NOT EXISTS results (
+                video_id INTEGER PRIMARY KEY,
+                analysis TEXT NOT NULL,
+                worker_id TEXT NOT NULL,
+                committed_at REAL NOT NULL,
+                loaded INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+
+    def _transaction(self):
+        return _ImmediateTransaction(self._conn, self._lock)
+
+    def enqueue(self, video_files):
+        rows = []
+        for video_file in video_files:
+            video_id = extract_video_id(os.path.basename(video_file))
+            if video_id is not None:
+                rows.append((video_id, video_file))
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO tasks (video_id, video_file) VALUES (?, ?)", rows)
+            added = conn.total_changes - before
+        logging.info(f"Enqueued {added} new tasks ({len(rows) - added} already queued)")
+        return added
+
+    def claim(self, worker_id, batch_size=DEFAULT_CLAIM_BATCH, lease_seconds=DEFAULT_LEASE_SECONDS):
+        now = time.time()
+        with self._transaction() as conn:
+            reclaimed = conn.execute(
+                "UPDATE tasks SET status = 'pending', worker_id = NULL WHERE status = 'leased' AND lease_expires < ?",
+                (now,)
+            ).rowcount
+            if reclaimed:
+                logging.warning(f"Reclaimed {reclaimed} tasks with expired leases")
+            tasks = conn.execute(
+                "SELECT video_id, video_file FROM tasks WHERE status = 'pending' ORDER BY video_id LIMIT ?",
+                (batch_size,)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET status = 'leased', worker_id = ?, lease_expires = ? WHERE video_id = ?",
+                [(worker_id, now + lease_seconds, video_id) for video_id, _ in tasks]
+            )
+        return tasks
+
+    def heartbeat(self, worker_id, video_ids, lease_seconds=DEFAULT_LEASE_SECONDS):
+        lost = []
+        with self._transaction() as conn:
+            for video_id in video_ids:
+                updated = conn.execute(
+                    "UPDATE tasks SET lease_expires = ? WHERE video_id = ? AND worker_id = ? AND status = 'leased'",
+                    (time.time() + lease_seconds, video_id, worker_id)
+                ).rowcount
+                if not updated:
+                    lost.append(video_id)
+        return lost
+
+    def commit(self, worker_id, analyses):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO results (video_id, analysis, worker_id, committed_at) VALUES (?, ?, ?, ?)",
+                [(analysis['video_id'], json.dumps(analysis), worker_id, now) for analysis in analyses]
+            )
+            conn.executemany(
+                "UPDATE tasks SET status = 'done', worker_id = ?, lease_expires = NULL WHERE video_id = ?",
+                [(worker_id, analysis['video_id']) for analysis in analyses]
+            )
+
+    def release(self, worker_id, video_ids):
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE tasks SET attempts = attempts + 1, worker_id = NULL, lease_expires = NULL, "
+                "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END "
+                "WHERE video_id = ? AND worker_id = ? AND status = 'leased'",
+                [(self.max_attempts, video_id, worker_id) for video_id in video_ids]
+            )
+
+    def unloaded_results(self, limit=None):
+        query = "SELECT analysis FROM results WHERE loaded = 0 ORDER BY video_id"
+        params = ()
+        if limit is not None:
+            query += " LIMIT ?"
+            params = (limit,)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [json.loads(analysis) for (analysis,) in rows]
+
+    def mark_loaded(self, video_ids):
+        with self._transaction() as conn:
+            conn.executemany("UPDATE results SET loaded = 1 WHERE video_id = ?", [(video_id,) for video_id in video_ids])
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+            (unloaded,) = self._conn.execute("SELECT COUNT(*) FROM results WHERE loaded = 0").fetchone()
+        return {status: counts.get(status, 0) for status in ("pending", "leased", "done", "failed")} | {
+            "unloaded_results": unloaded
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _ImmediateTransaction:
+    # BEGIN IMMEDIATE takes the write lock up front, so two workers can never claim the same pending rows
+    def __init__(self, conn, lock):
+        self.conn = conn
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.lock.release()
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+def _heartbeat_loop(queue, worker_id, video_ids, lease_seconds, stop_event, lost):
+    while not stop_event.wait(lease_seconds / 3):
+        try:
+            lost.update(queue.heartbeat(worker_id, [video_id for video_id in video_ids if video_id not in lost],
+                                        lease_seconds))
+        except Exception as e:
+            logging.warning(f"Heartbeat failed for worker {worker_id}: {e}")
+
+
+def run_worker(queue, run, worker_id=None, batch_size=DEFAULT_CLAIM_BATCH, lease_seconds=DEFAULT_LEASE_SECONDS,
+               max_workers=8):
+    """Claim, analyze and commit batches until no pending or leased tasks remain. Returns the number committed."""
+    worker_id = worker_id or default_worker_id()
+    committed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            tasks = queue.claim(worker_id, batch_size, lease_seconds)
+            if not tasks:
+                if queue.stats()["leased"] == 0:
+                    break
+                # Other workers still hold leases; wait in case one of them dies and its lease expires
+                time.sleep(IDLE_POLL_SECONDS)
+                continue
+
+            video_ids = [video_id for video_id, _ in tasks]
+            lost = set()
+            stop_event = threading.Event()
+            heartbeat = threading.Thread(target=_heartbeat_loop, daemon=True,
+                                         args=(queue, worker_id, video_ids, lease_seconds, stop_event, lost))
+            heartbeat.start()
+
+            def analyze(task):
+                # A lease that expired while this worker stalled now belongs to someone else; don't pay for it twice
+                if task[0] in lost:
+                    return None
+                return analyze_video_isolated(run, task[1])
+
+            try:
+                analyses = list(executor.map(analyze, tasks))
+            finally:
+                stop_event.set()
+                heartbeat.join()
+
+            succeeded = [analysis for analysis in analyses if analysis is not None]
+            failed = [video_id for (video_id, _), analysis in zip(tasks, analyses)
+                      if analysis is None and video_id not in lost]
+            queue.commit(worker_id, succeeded)
+            if failed:
+                queue.release(worker_id, failed)
+            committed += len(succeeded)
+            logging.info(f"Worker {worker_id} committed {len(succeeded)} results, released {len(failed)}: "
+                         f"{queue.stats()}")
+    return committed